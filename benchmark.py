@@ -0,0 +1,556 @@
+#!/usr/bin/env -S uv run --with .
+# /// script
+# requires-python = ">=3.13"
+# dependencies = []
+# ///
+#
+"""
+Benchmarks for the lookup, validation and parser hot paths.
+
+Uses the fixtures in `tests/data` when they are present, and synthetic data that
+is scaled up by `--scale` for the rest. Results are written as json, pass the
+results of an earlier run with `--compare` to see the change per benchmark:
+
+    ./benchmark.py --output before.json
+    git checkout ...
+    ./benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import bz2
+import datetime
+import gzip
+import io
+import ipaddress
+import json
+import logging
+import lzma
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from rpki_analysis.delegated_stats import (
+    RirLookup,
+    RirTable,
+    StatsCombinedAllocations,
+    normalized_delegated_extended_stats,
+    read_delegated_extended_stats,
+)
+from rpki_analysis.prefixes import parse_prefixes
+from rpki_analysis.riswhois import (
+    AddressSpace,
+    RisWhoisLookup,
+    RisWhoisLookupMoreSpecific,
+    join_delegations,
+    read_ris_dump,
+)
+from rpki_analysis.routinator import read_csv
+from rpki_analysis.rov import (
+    CompactRouteOriginAuthorizationLookup,
+    RouteOriginAuthorizationLookup,
+    rov_validity,
+    rov_validity_batch,
+)
+from rpki_analysis.rpki_client import read_dump
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+DATA = Path(__file__).parent / "tests/data"
+
+# Number of single lookups/validations to time for latency benchmarks
+SAMPLE_SIZE = 2_000
+
+
+def synthetic_prefixes(rng: np.random.Generator, count: int) -> list[str]:
+    """Random IPv4 (80%) and IPv6 prefixes of typical routed lengths."""
+    res = []
+    for is_v6, address, length in zip(
+        rng.random(count) < 0.2,
+        rng.integers(0, 2**32, size=count, dtype=np.uint64).tolist(),
+        rng.integers(0, 17, size=count).tolist(),
+    ):
+        if is_v6:
+            # 2000::/3 with lengths /32 to /48
+            network = ipaddress.IPv6Network(
+                (
+                    (0x2 << 124 | address << 92) & ~((1 << (96 - length)) - 1),
+                    32 + length,
+                ),
+            )
+        else:
+            # lengths /8 to /24
+            network = ipaddress.IPv4Network(
+                (address & ~((1 << (24 - length)) - 1) & 0xFFFF_FFFF, 8 + length)
+            )
+        res.append(str(network))
+    return res
+
+
+def synthetic_vrps(rng: np.random.Generator, count: int) -> pd.DataFrame:
+    """VRPs in the shape of `read_csv`."""
+    prefixes = synthetic_prefixes(rng, count)
+    lengths = np.array([int(p.split("/")[1]) for p in prefixes])
+    max_lengths = lengths + rng.integers(0, 3, size=count) * (lengths < 24)
+    return pd.DataFrame(
+        {
+            "asn": rng.integers(1, 400_000, size=count),
+            "prefix": prefixes,
+            "max_length": max_lengths,
+        }
+    )
+
+
+def synthetic_announcements(
+    rng: np.random.Generator, vrps: pd.DataFrame, count: int
+) -> pd.DataFrame:
+    """Announcements for (more specifics of) VRP prefixes, half with the VRP AS."""
+    rows = vrps.sample(count, replace=True, random_state=int(rng.integers(2**31)))
+    prefixes = []
+    for prefix, extra in zip(rows.prefix, rng.integers(0, 3, size=count).tolist()):
+        network = ipaddress.ip_network(prefix)
+        length = min(network.prefixlen + extra, network.max_prefixlen)
+        prefixes.append(str(next(network.subnets(new_prefix=length))))
+    origin = np.where(rng.random(count) < 0.5, rows.asn, rows.asn + 1)
+    return pd.DataFrame({"prefix": prefixes, "origin": origin.astype(str)})
+
+
+def synthetic_ris_dump(rng: np.random.Generator, count: int) -> str:
+    """A riswhoisdump, as text."""
+    lines = [
+        f"{origin}\t{prefix}\t{peers}"
+        for origin, prefix, peers in zip(
+            rng.integers(1, 400_000, size=count).tolist(),
+            synthetic_prefixes(rng, count),
+            rng.integers(1, 400, size=count).tolist(),
+        )
+    ]
+    return "% synthetic\n\n" + "\n".join(lines) + "\n"
+
+
+def synthetic_delegated_extended(rng: np.random.Generator, count: int) -> str:
+    """A delegated-extended stats file with `count` IPv4 and IPv6 resources."""
+    # like the real files, start with an ASN
+    lines = [
+        "2|nro|20250101|0|19830705|20250101|+0000",
+        "",
+        "",
+        "",
+        "ripencc|NL|asn|3333|1|19930901|allocated|00000000|e-stats",
+    ]
+    opaque_ids = [f"{i:08x}" for i in range(max(count // 4, 1))]
+    for is_v6, address, length, opaque_id in zip(
+        rng.random(count) < 0.3,
+        rng.integers(1 << 24, 224 << 24, size=count).tolist(),
+        rng.integers(0, 9, size=count).tolist(),
+        rng.choice(opaque_ids, size=count).tolist(),
+    ):
+        if is_v6:
+            raw_resource = str(ipaddress.IPv6Address(0x2 << 124 | address << 88))
+            resource = f"{raw_resource.split('::')[0]}::|{29 + length}"
+        else:
+            size = 1 << (8 + length)
+            resource = f"{ipaddress.IPv4Address(address & ~(size - 1))}|{size}"
+        lines.append(
+            f"ripencc|NL|{'ipv6' if is_v6 else 'ipv4'}|{resource}|20100101|allocated"
+            f"|{opaque_id}|e-stats"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def measure(
+    name: str, rows: int, func: Callable[[], Any], repeat: int
+) -> dict[str, Any]:
+    """Best wall clock time of `repeat` calls of `func`, that processes `rows`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+    res = {
+        "name": name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_second": rows / seconds if seconds else None,
+        "repeat": repeat,
+    }
+    logging.info(
+        "%-45s %10d rows %9.4fs %12.0f rows/s",
+        name,
+        rows,
+        seconds,
+        res["rows_per_second"] or float("nan"),
+    )
+    return res
+
+
+def fixture(name: str) -> Path | None:
+    path = DATA / name
+    if not path.exists():
+        logging.warning("Fixture %s is missing, skipping its benchmarks", path)
+        return None
+    return path
+
+
+def run_riswhois(
+    bench: Callable[[str, int, Callable[[], Any]], None],
+    ris: dict[str, pd.DataFrame],
+    df_delegated: dict[str, pd.DataFrame],
+) -> None:
+    """Lookups, joins and address space over RIS dumps."""
+    # RIS lookups
+    for name, df in ris.items():
+        bench(
+            f"riswhois/build/more_specific/{name}",
+            len(df),
+            lambda df=df: RisWhoisLookupMoreSpecific(df),
+        )
+        lookup = RisWhoisLookupMoreSpecific(df)
+        # less specifics of routed prefixes, that have some more specifics
+        sample = [
+            str(ipaddress.ip_network(p).supernet(prefixlen_diff=4))
+            for p in df.prefix.sample(
+                min(SAMPLE_SIZE, len(df)), random_state=1
+            ).tolist()
+            if ipaddress.ip_network(p).prefixlen >= 4
+        ]
+        bench(
+            f"riswhois/lookup/more_specific/{name}",
+            len(sample),
+            lambda lookup=lookup, sample=sample: [
+                list(lookup.lookup(p)) for p in sample
+            ],
+        )
+        bench(
+            f"riswhois/lookup_many/more_specific/{name}",
+            len(sample),
+            lambda lookup=lookup, sample=sample: lookup.lookup_many(sample),
+        )
+
+    for name, df in ris.items():
+        lookup = RisWhoisLookup(df)
+        # host addresses in routed space
+        addresses = [
+            str(ipaddress.ip_network(p).network_address + 1)
+            for p in df.prefix.sample(min(SAMPLE_SIZE, len(df)), random_state=1)
+        ]
+        bench(
+            f"riswhois/lookup_addresses/{name}",
+            len(addresses),
+            lambda lookup=lookup, addresses=addresses: lookup.lookup_addresses(
+                addresses
+            ),
+        )
+
+    for name, df in ris.items():
+        bounds = parse_prefixes(df.prefix)
+        bench(
+            f"riswhois/address_space/build/{name}",
+            len(df),
+            lambda bounds=bounds: AddressSpace.from_prefixes(bounds),
+        )
+        space = AddressSpace.from_prefixes(bounds)
+        other = AddressSpace.from_prefixes(df.prefix.sample(frac=0.5, random_state=1))
+        bench(
+            f"riswhois/address_space/difference/{name}",
+            len(df),
+            lambda space=space, other=other: space - other,
+        )
+        queries = [
+            str(ipaddress.ip_network(p).supernet(prefixlen_diff=4))
+            for p in df.prefix.sample(min(SAMPLE_SIZE, len(df)), random_state=1)
+            if ipaddress.ip_network(p).prefixlen >= 4
+        ]
+        bench(
+            f"riswhois/address_space/fraction/{name}",
+            len(queries),
+            lambda space=space, queries=queries: space.fraction(queries),
+        )
+
+    for ris_name, df in ris.items():
+        for name, delegations in df_delegated.items():
+            bench(
+                f"riswhois/join_delegations/{ris_name}/{name}",
+                len(df) + len(delegations),
+                lambda df=df, delegations=delegations: join_delegations(
+                    df, delegations
+                ),
+            )
+
+
+def run(scale: float, repeat: int, only: str | None) -> list[dict[str, Any]]:
+    """Run the benchmarks (whose names contain `only`)."""
+    rng = np.random.default_rng(1)
+    results = []
+
+    def bench(name: str, rows: int, func: Callable[[], Any]) -> None:
+        if only is not None and only not in name:
+            return
+        try:
+            results.append(measure(name, rows, func, repeat))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # keep going, a failure is a result as well
+            logging.exception("Benchmark %s failed", name)
+            results.append({"name": name, "rows": rows, "error": repr(e)})
+
+    # parsers
+    vrp_inputs = {}
+    if path := fixture("routinator_csv.csv.xz"):
+        with lzma.open(path, "rt") as f:
+            text = f.read()
+        vrp_inputs["routinator_csv"] = read_csv(io.StringIO(text))
+        bench(
+            "parse/routinator_csv",
+            len(vrp_inputs["routinator_csv"]),
+            lambda: read_csv(io.StringIO(text)),
+        )
+    if path := fixture("rpki_client_dump.json.xz"):
+        with lzma.open(path, "rt") as f:
+            text = f.read()
+        vrp_inputs["rpki_client_dump"] = read_dump(io.StringIO(text))
+        bench(
+            "parse/rpki_client_dump",
+            len(vrp_inputs["rpki_client_dump"]),
+            lambda: read_dump(io.StringIO(text)),
+        )
+    vrp_inputs["synthetic"] = synthetic_vrps(rng, int(500_000 * scale))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ris_dumps = {
+            name: path
+            for name in ["riswhoisdump.IPv4.gz", "riswhoisdump.IPv6.gz"]
+            if (path := fixture(name))
+        }
+        ris_dumps["synthetic"] = Path(tmpdir) / "riswhoisdump.gz"
+        with gzip.open(ris_dumps["synthetic"], "wt") as f:
+            f.write(synthetic_ris_dump(rng, int(1_000_000 * scale)))
+
+        ris = {}
+        for name, path in ris_dumps.items():
+            ris[name] = read_ris_dump(str(path))
+            bench(
+                f"parse/read_ris_dump/{name}",
+                len(ris[name]),
+                lambda path=path: read_ris_dump(str(path)),
+            )
+
+    for name, df in ris.items():
+        bench(
+            f"parse/parse_prefixes/{name}",
+            len(df),
+            lambda df=df: parse_prefixes(df.prefix),
+        )
+
+    delegated = {}
+    if path := fixture("nro-delegated-stats.bz2"):
+        with bz2.open(path, "rt") as f:
+            delegated["nro"] = f.read()
+    delegated["synthetic"] = synthetic_delegated_extended(rng, int(200_000 * scale))
+    df_delegated = {}
+    for name, text in delegated.items():
+        df_delegated[name] = read_delegated_extended_stats(io.StringIO(text))
+        bench(
+            f"parse/read_delegated_extended_stats/{name}",
+            len(df_delegated[name]),
+            lambda text=text: read_delegated_extended_stats(io.StringIO(text)),
+        )
+        bench(
+            f"parse/read_delegated_extended_stats/resource_bounds/{name}",
+            len(df_delegated[name]),
+            lambda text=text: read_delegated_extended_stats(
+                io.StringIO(text), resource_bounds=True
+            ),
+        )
+        bench(
+            f"parse/normalized_delegated_extended_stats/{name}",
+            len(df_delegated[name]),
+            lambda text=text: normalized_delegated_extended_stats(
+                io.StringIO(text)
+            ).collect(),
+        )
+
+    # VRP lookups and validation
+    for name, vrps in vrp_inputs.items():
+        bench(
+            f"rov/build/trie/{name}",
+            len(vrps),
+            lambda vrps=vrps: RouteOriginAuthorizationLookup(vrps),
+        )
+        bench(
+            f"rov/build/compact/{name}",
+            len(vrps),
+            lambda vrps=vrps: CompactRouteOriginAuthorizationLookup(vrps),
+        )
+        trie = RouteOriginAuthorizationLookup(vrps)
+        compact = CompactRouteOriginAuthorizationLookup(vrps)
+
+        announcements = synthetic_announcements(rng, vrps, int(200_000 * scale))
+        sample = announcements.head(SAMPLE_SIZE)
+        for lookup_name, lookup in [("trie", trie), ("compact", compact)]:
+            bench(
+                f"rov/lookup/{lookup_name}/{name}",
+                len(sample),
+                lambda lookup=lookup: [list(lookup.lookup(p)) for p in sample.prefix],
+            )
+        bench(
+            f"rov/rov_validity/{name}",
+            len(sample),
+            lambda trie=trie: [rov_validity(row, trie) for row in sample.itertuples()],
+        )
+        bench(
+            f"rov/rov_validity_batch/{name}",
+            len(announcements),
+            lambda compact=compact, announcements=announcements: rov_validity_batch(
+                announcements, compact
+            ),
+        )
+        for ris_name, df in ris.items():
+            bench(
+                f"rov/rov_validity_batch/{name}/ris/{ris_name}",
+                len(df),
+                lambda compact=compact, df=df: rov_validity_batch(df, compact),
+            )
+
+    run_riswhois(bench, ris, df_delegated)
+
+    # delegated stats
+    for name, df in df_delegated.items():
+        bench(
+            f"delegated_stats/build/combined_allocations/{name}",
+            len(df),
+            lambda df=df: StatsCombinedAllocations(df),
+        )
+        bench(
+            f"delegated_stats/build/rir/{name}",
+            len(df),
+            lambda df=df: RirLookup(df),
+        )
+        bench(
+            f"delegated_stats/build/rir_table/{name}",
+            len(df),
+            lambda df=df: RirTable.from_delegated_stats(df),
+        )
+        lookup = RirLookup(df).freeze()
+        addresses = [
+            str(ipaddress.ip_address(int(address) + 1))
+            for address in rng.integers(0, 2**32 - 1, size=SAMPLE_SIZE * 100)
+        ]
+        bench(
+            f"delegated_stats/match/rir/{name}",
+            len(addresses),
+            lambda lookup=lookup, addresses=addresses: lookup.match(addresses),
+        )
+        bench(
+            f"delegated_stats/get/rir/{name}",
+            len(addresses),
+            lambda lookup=lookup, addresses=addresses: [
+                lookup.get(address) for address in addresses
+            ],
+        )
+        bounds = parse_prefixes(addresses)
+        bench(
+            f"delegated_stats/attribute/rir_table/{name}",
+            len(addresses),
+            lambda table=lookup.rir_table, bounds=bounds: table.attribute(bounds),
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lookup.rir_table.save(Path(tmpdir) / "rir.bin")
+            bench(
+                f"delegated_stats/load/rir_table/{name}",
+                len(lookup.rir_table),
+                lambda path=Path(tmpdir) / "rir.bin": RirTable.load(path),
+            )
+        prefixes = [
+            str(ipaddress.ip_network(f"{ipaddress.ip_address(address)}/16", False))
+            for address in rng.integers(0, 2**32 - 1, size=SAMPLE_SIZE).tolist()
+        ]
+        bench(
+            f"delegated_stats/children/rir/{name}",
+            len(prefixes),
+            lambda lookup=lookup, prefixes=prefixes: [
+                list(lookup.children(prefix)) for prefix in prefixes
+            ],
+        )
+        bench(
+            f"delegated_stats/children_many/rir/{name}",
+            len(prefixes),
+            lambda lookup=lookup, prefixes=prefixes: lookup.children_many(prefixes),
+        )
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=Path(__file__).parent,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict[str, Any]], baseline_path: Path) -> None:
+    """Log the change in time per benchmark relative to an earlier run."""
+    with baseline_path.open() as f:
+        baseline = {res["name"]: res for res in json.load(f)["results"]}
+    for res in results:
+        if "seconds" not in res or "seconds" not in baseline.get(res["name"], {}):
+            continue
+        before = baseline[res["name"]]["seconds"]
+        logging.info(
+            "%-45s %9.4fs -> %9.4fs (%+.0f%%)",
+            res["name"],
+            before,
+            res["seconds"],
+            (res["seconds"] / before - 1) * 100,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark lookups, validation and parsers")
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Size factor of the synthetic data"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", default=None, help="Only run benchmarks with this in their name"
+    )
+    parser.add_argument(
+        "--compare", type=Path, default=None, help="Results of an earlier run"
+    )
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat, args.only)
+    with args.output.open("w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "date": datetime.datetime.now(datetime.UTC).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "scale": args.scale,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    logging.info("Wrote %d results to %s", len(results), args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
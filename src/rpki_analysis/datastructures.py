@@ -1,14 +1,448 @@
 import ipaddress
+import json
+import mmap
+import os
+import threading
 from abc import ABC
-from typing import Callable, TypeVar
+from pathlib import Path
+from typing import Any, Callable, Iterable, Literal, Protocol, Self, TypeVar
 
 import netaddr
+import numpy as np
 import pytricia
 
+from rpki_analysis.prefixes import (
+    AFI_IPV4,
+    AFI_IPV6,
+    PrefixBounds,
+    host_masks,
+    increment,
+    less,
+    parse_prefixes,
+    searchsorted,
+)
+
 PrefixType = str | netaddr.IPNetwork | ipaddress.IPv4Network | ipaddress.IPv6Network
 
 V = TypeVar("V")
 
+ARRAYS_MAGIC = b"RPKIARR1"
+# align arrays to cache lines
+ARRAYS_ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARRAYS_ALIGNMENT) * ARRAYS_ALIGNMENT
+
+
+def save_arrays(
+    path: str | Path, arrays: dict[str, np.ndarray], metadata: dict[str, Any]
+) -> None:
+    """
+    Store named numpy arrays and json metadata in a single file for `load_arrays`.
+
+    Layout: magic, uint64 header length, json header, then the raw arrays at
+    aligned offsets. The file is written next to `path` and renamed, so readers
+    never see a partially written file.
+    """
+    header: dict[str, Any] = {"metadata": metadata, "arrays": {}}
+    offset = 0
+    for name, arr in arrays.items():
+        header["arrays"][name] = {
+            "dtype": arr.dtype.str,
+            "shape": list(arr.shape),
+            "offset": offset,
+        }
+        offset = _aligned(offset + arr.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(len(ARRAYS_MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = Path(f"{path}.tmp")
+    with tmp_path.open("wb") as f:
+        f.write(ARRAYS_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for name, arr in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_arrays(path: str | Path) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """
+    Memory map a file written by `save_arrays`.
+
+    The arrays are read-only views on the mapping: nothing is parsed or copied,
+    and processes that load the same file share the pages in the page cache.
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buf[: len(ARRAYS_MAGIC)] != ARRAYS_MAGIC:
+        raise ValueError(f"{path} is not an array snapshot")
+    header_start = len(ARRAYS_MAGIC) + 8
+    header_length = int.from_bytes(buf[len(ARRAYS_MAGIC) : header_start], "little")
+    header = json.loads(buf[header_start : header_start + header_length])
+    data_start = _aligned(header_start + header_length)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        arrays[name] = np.frombuffer(
+            buf,
+            dtype=dtype,
+            count=int(np.prod(spec["shape"])),
+            offset=data_start + spec["offset"],
+        ).reshape(spec["shape"])
+    return arrays, header["metadata"]
+
+
+class AddressRangesType(Protocol):
+    """Address ranges encoded like `rpki_analysis.prefixes.PrefixBounds`."""
+
+    afi: np.ndarray
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    last_hi: np.ndarray
+    last_lo: np.ndarray
+
+
+class IntervalTable:
+    """
+    Match addresses to the most specific of a set of (nested) address ranges.
+
+    The ranges, e.g. prefixes or delegations, must be nested or disjoint. They
+    are split into a sorted table of non-overlapping segments that are labelled
+    with the most specific range covering them, so matching an address is a
+    single binary search.
+    """
+
+    # segments, sorted by (afi, start), with the id of the range or -1
+    afi: np.ndarray
+    start_hi: np.ndarray
+    start_lo: np.ndarray
+    owner: np.ndarray
+
+    def __init__(self, ranges: AddressRangesType) -> None:
+        """Build the table, ranges are identified by their position."""
+        segments = [
+            self.__segments(ranges, afi, np.flatnonzero(ranges.afi == afi))
+            for afi in (AFI_IPV4, AFI_IPV6)
+        ]
+        self.afi, self.start_hi, self.start_lo, self.owner = (
+            np.concatenate(values) for values in zip(*segments)
+        )
+
+    @staticmethod
+    def __segments(
+        ranges: AddressRangesType, afi: int, ids: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        if not len(ids):
+            empty = np.array([], dtype=np.uint64)
+            return np.array([], dtype=np.uint8), empty, empty, ids.astype(np.int64)
+        # Pre-order of the nesting: by first address, enclosing ranges first.
+        order = ids[
+            np.lexsort(
+                (
+                    ~ranges.last_lo[ids],
+                    ~ranges.last_hi[ids],
+                    ranges.first_lo[ids],
+                    ranges.first_hi[ids],
+                )
+            )
+        ]
+        first = (ranges.first_hi[order], ranges.first_lo[order])
+        last = (ranges.last_hi[order], ranges.last_lo[order])
+
+        # The depth of a range is the number of ranges before it that are still
+        # open. Its parent is the closest range before it at depth - 1.
+        by_last = np.lexsort((last[1], last[0]))
+        closed = searchsorted(last[0][by_last], last[1][by_last], *first)
+        depth = np.arange(len(order)) - closed
+        parent = np.full(len(order), -1, dtype=np.int64)
+        for level in range(1, int(depth.max(initial=0)) + 1):
+            children = np.flatnonzero(depth == level)
+            parents = np.flatnonzero(depth == level - 1)
+            parent[children] = parents[np.searchsorted(parents, children) - 1]
+
+        # Segments start at the first address of every range, and after the
+        # last address, unless that is the end of the address space.
+        max_hi, max_lo = host_masks(afi, 0)
+        not_end = (last[0] != max_hi) | (last[1] != max_lo)
+        after = increment(last[0][not_end], last[1][not_end])
+        start_hi = np.concatenate([first[0], after[0]])
+        start_lo = np.concatenate([first[1], after[1]])
+        by_start = np.lexsort((start_lo, start_hi))
+        start_hi, start_lo = start_hi[by_start], start_lo[by_start]
+
+        # The owner is the last range that starts at or before the segment and
+        # is still open, or one of its ancestors.
+        owner = searchsorted(*first, start_hi, start_lo, side="right") - 1
+        while True:
+            is_open = owner >= 0
+            is_open[is_open] = ~less(
+                last[0][owner[is_open]],
+                last[1][owner[is_open]],
+                start_hi[is_open],
+                start_lo[is_open],
+            )
+            closed = (owner >= 0) & ~is_open
+            if not closed.any():
+                break
+            owner[closed] = parent[owner[closed]]
+
+        # merge segments with the same owner
+        keep = np.concatenate([[True], owner[1:] != owner[:-1]])
+        owner = np.where(owner >= 0, order[np.maximum(owner, 0)], -1)[keep]
+        return (
+            np.full(int(keep.sum()), afi, dtype=np.uint8),
+            start_hi[keep],
+            start_lo[keep],
+            owner,
+        )
+
+    def __len__(self) -> int:
+        """The number of segments."""
+        return len(self.afi)
+
+    def relabel(self, labels: np.ndarray) -> "IntervalTable":
+        """
+        A table that matches to `labels[id]` instead of the id of a range, with
+        the adjacent segments that have the same label merged.
+        """
+        owner = np.where(self.owner >= 0, labels[np.maximum(self.owner, 0)], -1)
+        keep = np.ones(len(owner), dtype=bool)
+        keep[1:] = (owner[1:] != owner[:-1]) | (self.afi[1:] != self.afi[:-1])
+        return IntervalTable.from_arrays(
+            self.afi[keep],
+            self.start_hi[keep],
+            self.start_lo[keep],
+            owner[keep].astype(labels.dtype),
+        )
+
+    @classmethod
+    def from_arrays(
+        cls,
+        afi: np.ndarray,
+        start_hi: np.ndarray,
+        start_lo: np.ndarray,
+        owner: np.ndarray,
+    ) -> Self:
+        """A table from its segments, e.g. as stored with `save_arrays`."""
+        table = cls.__new__(cls)
+        table.afi, table.start_hi, table.start_lo, table.owner = (
+            afi,
+            start_hi,
+            start_lo,
+            owner,
+        )
+        return table
+
+    def match(self, addresses: Iterable | PrefixBounds) -> np.ndarray:
+        """
+        The id of the most specific range that contains each address (or the
+        first address of a prefix), -1 if there is none.
+        """
+        bounds = (
+            addresses
+            if isinstance(addresses, PrefixBounds)
+            else parse_prefixes(addresses)
+        )
+        res = np.full(len(bounds), -1, dtype=np.int64)
+        for afi in (AFI_IPV4, AFI_IPV6):
+            queries = np.flatnonzero(bounds.afi == afi)
+            lo = int(np.searchsorted(self.afi, afi, side="left"))
+            hi = int(np.searchsorted(self.afi, afi, side="right"))
+            if not len(queries) or lo == hi:
+                continue
+            pos = (
+                searchsorted(
+                    self.start_hi[lo:hi],
+                    self.start_lo[lo:hi],
+                    bounds.first_hi[queries],
+                    bounds.first_lo[queries],
+                    side="right",
+                )
+                - 1
+            )
+            res[queries] = np.where(pos >= 0, self.owner[lo + np.maximum(pos, 0)], -1)
+        return res
+
+
+class SubtreeIndex:
+    """
+    Enumerate the prefixes of a set that are within other prefixes.
+
+    The prefixes are sorted in pre-order (by first address, less specifics
+    first), so the prefixes within a prefix are a contiguous slice.
+    """
+
+    # the prefixes in pre-order, `order` holds their ids
+    afi: np.ndarray
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    length: np.ndarray
+    order: np.ndarray
+
+    def __init__(self, prefixes: Iterable | PrefixBounds) -> None:
+        """Build the index, prefixes are identified by their position."""
+        bounds = (
+            prefixes if isinstance(prefixes, PrefixBounds) else parse_prefixes(prefixes)
+        )
+        self.order = np.lexsort(
+            (bounds.length, bounds.first_lo, bounds.first_hi, bounds.afi)
+        )
+        self.afi = bounds.afi[self.order]
+        self.first_hi = bounds.first_hi[self.order]
+        self.first_lo = bounds.first_lo[self.order]
+        self.length = bounds.length[self.order]
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def slices(
+        self, prefixes: Iterable | PrefixBounds
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The (start, stop) positions in `order` of the prefixes within (or equal
+        to) each of the prefixes.
+        """
+        bounds = (
+            prefixes if isinstance(prefixes, PrefixBounds) else parse_prefixes(prefixes)
+        )
+        starts = np.zeros(len(bounds), dtype=np.int64)
+        stops = np.zeros(len(bounds), dtype=np.int64)
+        for afi in (AFI_IPV4, AFI_IPV6):
+            queries = np.flatnonzero(bounds.afi == afi)
+            lo = int(np.searchsorted(self.afi, afi, side="left"))
+            hi = int(np.searchsorted(self.afi, afi, side="right"))
+            if not len(queries) or lo == hi:
+                continue
+            start = self.__search(
+                lo, hi, bounds.first_hi[queries], bounds.first_lo[queries], "left"
+            )
+            stops[queries] = self.__search(
+                lo, hi, bounds.last_hi[queries], bounds.last_lo[queries], "right"
+            )
+
+            # skip the less specifics with the same first address, there are at
+            # most as many as the prefix length
+            skip = np.ones(len(queries), dtype=bool)
+            while True:
+                skip &= start < stops[queries]
+                position = np.minimum(start, len(self) - 1)
+                skip &= (
+                    (self.first_hi[position] == bounds.first_hi[queries])
+                    & (self.first_lo[position] == bounds.first_lo[queries])
+                    & (self.length[position] < bounds.length[queries])
+                )
+                if not skip.any():
+                    break
+                start += skip
+            starts[queries] = start
+        return starts, stops
+
+    def __search(
+        self,
+        lo: int,
+        hi: int,
+        query_hi: np.ndarray,
+        query_lo: np.ndarray,
+        side: Literal["left", "right"],
+    ) -> np.ndarray:
+        """`searchsorted` in the positions [lo, hi) of the index."""
+        if len(query_hi) > 16:
+            return lo + searchsorted(
+                self.first_hi[lo:hi], self.first_lo[lo:hi], query_hi, query_lo, side
+            )
+        # a few queries: search the high, then the low words, as `searchsorted`
+        # scans the table to find the case
+        res = np.empty(len(query_hi), dtype=np.int64)
+        for i, (address_hi, address_lo) in enumerate(zip(query_hi, query_lo)):
+            start = lo + int(np.searchsorted(self.first_hi[lo:hi], address_hi, "left"))
+            stop = lo + int(np.searchsorted(self.first_hi[lo:hi], address_hi, "right"))
+            res[i] = start + np.searchsorted(
+                self.first_lo[start:stop], address_lo, side
+            )
+        return res
+
+
+class VersionedTrie(pytricia.PyTricia):
+    """
+    A pytricia trie that counts the modifications of its keys and values in
+    `version`, so that indexes derived from it can tell they are out of date.
+    """
+
+    version: int = 0
+
+    def __setitem__(self, prefix: Any, value: Any) -> None:
+        super().__setitem__(prefix, value)
+        self.version += 1
+
+    def __delitem__(self, prefix: Any) -> None:
+        super().__delitem__(prefix)
+        self.version += 1
+
+    def insert(self, *args: Any) -> Any:
+        res = super().insert(*args)
+        self.version += 1
+        return res
+
+    def delete(self, prefix: Any) -> None:
+        super().delete(prefix)
+        self.version += 1
+
+
+def freeze_trie(trie: pytricia.PyTricia) -> None:
+    """
+    Replace the sets in a trie by frozensets and freeze the trie itself, in place:
+    inserting or deleting keys afterwards raises `ValueError`.
+    """
+    for key in list(trie):
+        value = trie[key]
+        if isinstance(value, set):
+            trie[key] = frozenset(value)
+    trie.freeze()
+
+
+class Freezable(Protocol):
+    """A lookup that can be made immutable."""
+
+    @property
+    def frozen(self) -> bool:
+        """Whether the lookup is immutable."""
+
+    def freeze(self) -> Self:
+        """Make the lookup immutable, returns it."""
+
+
+class SwappableLookup[T: Freezable]:
+    """
+    A frozen lookup that is replaced instead of modified on reload.
+
+    Readers take `current` once per request and use it without locks, it never
+    changes. `reload` builds a new lookup, e.g. in a background thread or with
+    `asyncio.to_thread`, freezes it and swaps the reference. Readers that still
+    hold the previous lookup finish on it. Reloads are serialized, so `build` can
+    derive the new lookup from `current`.
+    """
+
+    def __init__(self, lookup: T) -> None:
+        self.__lock = threading.Lock()
+        self.__current = lookup.freeze()
+
+    @property
+    def current(self) -> T:
+        return self.__current
+
+    def reload(self, build: Callable[[], T]) -> T:
+        """Build, freeze and swap in a new lookup, returns it."""
+        with self.__lock:
+            lookup = build().freeze()
+            self.__current = lookup
+        return lookup
+
 
 class BasePytriciaLookup[V](ABC):
     """
@@ -19,6 +453,7 @@ class BasePytriciaLookup[V](ABC):
 
     __trie4: pytricia.PyTricia
     __trie6: pytricia.PyTricia
+    __frozen: bool = False
 
     def __init__(self, initial_value: Callable[[], V] | None = None) -> None:
         self.__trie4 = pytricia.PyTricia(32)
@@ -31,6 +466,21 @@ class BasePytriciaLookup[V](ABC):
     def __contains__(self, prefix: str) -> bool:
         return prefix in self.__trie4 or prefix in self.__trie6
 
+    @property
+    def frozen(self) -> bool:
+        return self.__frozen
+
+    def freeze(self) -> Self:
+        """
+        Make the lookup immutable so threads can share it: sets in the tries
+        become frozensets and modifying the tries raises `ValueError`. Returns
+        the lookup.
+        """
+        freeze_trie(self.__trie4)
+        freeze_trie(self.__trie6)
+        self.__frozen = True
+        return self
+
     def _trie(self, prefix: PrefixType) -> pytricia.PyTricia:
         """Get the relevant of trie."""
         match type(prefix):
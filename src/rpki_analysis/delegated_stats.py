@@ -2,18 +2,55 @@ import datetime
 import ipaddress
 import logging
 from dataclasses import dataclass
-from typing import Generator, List, TextIO, TypedDict, TypeVar
+from pathlib import Path
+from typing import (
+    Any,
+    Generator,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Self,
+    TextIO,
+    TypedDict,
+    TypeVar,
+)
 
 import netaddr
+import numpy as np
 import pandas as pd
 import polars as pl
+import pyarrow as pa
 import pytricia
 
+from rpki_analysis.datastructures import (
+    IntervalTable,
+    SubtreeIndex,
+    VersionedTrie,
+    freeze_trie,
+    load_arrays,
+    save_arrays,
+)
+from rpki_analysis.prefixes import (
+    AFI_IPV4,
+    AFI_IPV6,
+    PrefixBounds,
+    bounds_frame,
+    decrement,
+    host_masks,
+    less,
+    packed_addresses,
+    parse_prefix,
+    parse_prefixes,
+    range_cidrs,
+)
+
 LOG = logging.getLogger(__name__)
 
 PrefixType = str | netaddr.IPNetwork | ipaddress.IPv4Network | ipaddress.IPv6Network
 
 V = TypeVar("V")
+PolarsFrameT = TypeVar("PolarsFrameT", pl.DataFrame, pl.LazyFrame)
 
 
 @dataclass
@@ -62,8 +99,16 @@ def extract_resource(row) -> netaddr.IPNetwork | str:
             raise ValueError()
 
 
-def normalized_delegated_extended_stats(f: TextIO) -> pl.LazyFrame:
-    """Parse a delegated stats file into a dataframe"""
+def normalized_delegated_extended_stats(
+    f: TextIO, prefix_bounds: bool = False
+) -> pl.LazyFrame:
+    """
+    Parse a delegated stats file into a dataframe
+
+    With `prefix_bounds` the integer encoding of the IP prefixes in `resources`
+    is added as columns (see `rpki_analysis.prefixes.with_prefix_bounds`), these
+    are missing for ASNs.
+    """
     df_delegated_extended = pl.scan_csv(
         f,
         separator="|",
@@ -105,21 +150,34 @@ def normalized_delegated_extended_stats(f: TextIO) -> pl.LazyFrame:
         pl.col("date").str.strptime(pl.Date, "%Y%m%d", strict=False)
     )
 
-    # Create processed_resources column with the results from our function
-    df_with_resources = df_delegated_extended.with_columns(
-        pl.struct(["raw_resource", "length", "afi"])
+    # One row per resource: IPv4 ranges are split into CIDR blocks
+    df_resources = explode_ip_resources(df_delegated_extended).drop(
+        ["raw_resource", "length"]
+    )
+    if not prefix_bounds:
+        return df_resources
+
+    schema = bounds_frame(pl.Series([], dtype=pl.Utf8), "resources").schema
+    return df_resources.with_columns(
+        pl.when(pl.col("afi") != "asn")
+        .then(pl.col("resources"))
         .map_batches(
-            process_ip_resources, is_elementwise=True, return_dtype=pl.List(pl.Utf8)
+            lambda prefixes: bounds_frame(prefixes, "resources").to_struct(),
+            return_dtype=pl.Struct(schema),
         )
-        .alias("resources")
-    ).drop(["raw_resource", "length"])
+        .alias("resources_bounds")
+    ).unnest("resources_bounds")
 
-    # Explode the dataframe to create one row per resource
-    return df_with_resources.explode("resources")
 
+def read_delegated_extended_stats(
+    f: TextIO, resource_bounds: bool = False
+) -> pd.DataFrame:
+    """
+    Parse a delegated stats file into a dataframe
 
-def read_delegated_extended_stats(f: TextIO) -> pd.DataFrame:
-    """Parse a delegated stats file into a dataframe"""
+    With `resource_bounds` the resources are not parsed into netaddr objects in
+    `resource`, see `with_resource_bounds` for the columns that are added instead.
+    """
     df_delegated_extended = pd.read_csv(
         f,
         sep="|",
@@ -156,14 +214,20 @@ def read_delegated_extended_stats(f: TextIO) -> pd.DataFrame:
     df_delegated_extended.date = pd.to_datetime(
         df_delegated_extended.date, format="%Y%m%d", utc=True
     )
+    if resource_bounds:
+        return with_resource_bounds(df_delegated_extended)
     df_delegated_extended["resource"] = df_delegated_extended.apply(
         extract_resource, axis=1
     )
     return df_delegated_extended
 
 
-def read_delegated_stats(f: TextIO) -> pd.DataFrame:
-    """Parse a delegated stats file into a dataframe"""
+def read_delegated_stats(f: TextIO, resource_bounds: bool = False) -> pd.DataFrame:
+    """
+    Parse a delegated stats file into a dataframe
+
+    See `read_delegated_extended_stats` for `resource_bounds`.
+    """
     df_delegated = pd.read_csv(
         f,
         sep="|",
@@ -192,10 +256,95 @@ def read_delegated_stats(f: TextIO) -> pd.DataFrame:
     df_delegated.loc[df_delegated.date == "00000000", "date"] = "19700101"
 
     df_delegated.date = pd.to_datetime(df_delegated.date, format="%Y%m%d", utc=True)
+    if resource_bounds:
+        return with_resource_bounds(df_delegated)
     df_delegated["resource"] = df_delegated.apply(extract_resource, axis=1)
     return df_delegated
 
 
+class ResourceRanges(NamedTuple):
+    """
+    The address ranges of delegated IP resources, encoded like
+    `rpki_analysis.prefixes.PrefixBounds`.
+
+    IPv4 delegations are a number of addresses, so a range is not always a
+    prefix. Rows that are not IP resources (ASNs) have afi 0.
+    """
+
+    afi: np.ndarray
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    last_hi: np.ndarray
+    last_lo: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.afi)
+
+
+def resource_ranges(df: pd.DataFrame | pl.DataFrame) -> ResourceRanges:
+    """The `ResourceRanges` of the raw_resource and length of delegated stats."""
+    afi_names = (
+        df["afi"].astype(str)
+        if isinstance(df, pd.DataFrame)
+        else df["afi"].cast(pl.Utf8)
+    ).to_numpy()
+    lengths = np.asarray(df["length"], dtype=np.int64)
+
+    afi = np.zeros(len(df), dtype=np.uint8)
+    afi[afi_names == "ipv4"] = AFI_IPV4
+    afi[afi_names == "ipv6"] = AFI_IPV6
+    is_ip = afi != 0
+
+    ranges = ResourceRanges(
+        afi=afi,
+        first_hi=np.zeros(len(df), dtype=np.uint64),
+        first_lo=np.zeros(len(df), dtype=np.uint64),
+        last_hi=np.zeros(len(df), dtype=np.uint64),
+        last_lo=np.zeros(len(df), dtype=np.uint64),
+    )
+    start = parse_prefixes(np.asarray(df["raw_resource"], dtype=object)[is_ip])
+    length = lengths[is_ip]
+    is_v4 = start.afi == AFI_IPV4
+
+    # IPv4: a number of addresses, IPv6: a prefix length
+    mask_hi, mask_lo = host_masks(start.afi, np.where(is_v4, 32, length))
+    ranges.first_hi[is_ip] = start.first_hi & ~mask_hi
+    ranges.first_lo[is_ip] = start.first_lo & ~mask_lo
+    ranges.last_hi[is_ip] = start.first_hi | mask_hi
+    ranges.last_lo[is_ip] = np.where(
+        is_v4,
+        start.first_lo + (length - 1).astype(np.uint64),
+        start.first_lo | mask_lo,
+    )
+    return ranges
+
+
+def with_resource_bounds(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the address range of `raw_resource` and `length` as `resource_afi` (4,
+    6, or 0 for ASNs) and `resource_first`/`resource_last`: 16 byte binary
+    addresses (see `rpki_analysis.prefixes.packed_addresses`), null for ASNs.
+
+    Unlike netaddr objects these columns can be written to parquet and joined
+    on in duckdb. They are variable length binary: pandas can not read parquet
+    files back that it wrote with fixed size binary columns.
+    """
+    ranges = resource_ranges(df)
+    is_ip = ranges.afi != 0
+    df["resource_afi"] = ranges.afi
+    for column, hi, lo in [
+        ("resource_first", ranges.first_hi, ranges.first_lo),
+        ("resource_last", ranges.last_hi, ranges.last_lo),
+    ]:
+        df[column] = pd.Series(
+            pd.arrays.ArrowExtensionArray(
+                packed_addresses(hi, lo, is_ip).cast(pa.binary())
+            ),
+            index=df.index,
+        )
+    return df
+
+
 class ResourceFields(TypedDict):
     """
     Columns of delegated stats that describe a resource
@@ -255,6 +404,122 @@ def process_ip_resources(rows: pl.Series) -> pl.Series:
     return pl.Series(res)
 
 
+def _ipv4_address(address: pl.Expr) -> pl.Expr:
+    return pl.concat_str(
+        [(address // 2**shift) % 256 for shift in (24, 16, 8, 0)], separator="."
+    )
+
+
+def explode_ip_resources(df: PolarsFrameT) -> PolarsFrameT:
+    """
+    One row per resource of `raw_resource`, `length` and `afi`, in `resources`.
+
+    Like exploding the lists of `process_ip_resources`, but in polars
+    expressions. Rows with another afi get a null resource.
+
+    An IPv4 range [start, end) consists of the aligned blocks of 2**bits
+    addresses that are in the range while their aligned parent block is not. Per
+    size this can only be the first or the last aligned block in the range, so
+    each range is expanded into these candidates (or only the first block of the
+    size of a range that is a single block) and filtered.
+    """
+    afi, length = pl.col("afi"), pl.col("length")
+    raw_resource = pl.col("raw_resource")
+    start, asn = pl.col("_start"), pl.col("_asn")
+    # the largest block that fits in the range
+    max_bits = pl.col("_max_bits")
+
+    octets = raw_resource.str.split(".")
+    df = df.with_columns(
+        _start=pl.when(afi == "ipv4").then(
+            sum(
+                octets.list.get(idx, null_on_oob=True).cast(pl.Int64, strict=False)
+                * 2 ** (8 * (3 - idx))
+                for idx in range(4)
+            )
+        ),
+        _asn=pl.when(afi == "asn").then(raw_resource.cast(pl.Int64, strict=False)),
+        _max_bits=63 - length.bitwise_leading_zeros().cast(pl.Int64),
+    )
+    single = (length.bitwise_count_ones() == 1) & (start % length == 0)
+    df = df.with_columns(
+        _item=pl.when(afi == "ipv4")
+        .then(
+            pl.int_ranges(
+                pl.when(single).then(max_bits).otherwise(0),
+                pl.when(single).then(max_bits + 1).otherwise(2 * max_bits + 2),
+            )
+        )
+        # like process_ip_resources, ranges of ASNs include start + length
+        .when((afi == "asn") & (length > 1) & (length < 10000))
+        # (the branches are evaluated for all rows)
+        .then(pl.int_ranges(asn, asn + pl.when(length < 10000).then(length + 1)))
+        .otherwise(pl.int_ranges(0, 1))
+    ).explode("_item")
+
+    # IPv4: candidates by increasing size at the start, then decreasing at the end
+    item = pl.col("_item")
+    at_start = item <= max_bits
+    bits = (
+        pl.when(afi != "ipv4")
+        .then(None)
+        .when(at_start)
+        .then(item)
+        .otherwise(2 * max_bits + 1 - item)
+    )
+    size = pl.lit(2, dtype=pl.Int64).pow(pl.col("_bits"))
+    end = start + length
+    first_aligned = ((start + size - 1) // size) * size
+    df = df.with_columns(_bits=bits).with_columns(
+        _size=size,
+        _first=pl.when(at_start)
+        .then(first_aligned)
+        .otherwise((end // size) * size - size),
+        _duplicate=~at_start & ((end // size) * size - size == first_aligned),
+    )
+    size, first = pl.col("_size"), pl.col("_first")
+    parent = (first // (2 * size)) * (2 * size)
+    in_range = (
+        (first >= start)
+        & (first + size <= end)
+        & ((parent < start) | (parent + 2 * size > end))
+        & ~pl.col("_duplicate")
+    )
+
+    return (
+        df.filter((afi != "ipv4") | in_range)
+        .with_columns(
+            resources=pl.when(afi == "ipv4")
+            .then(
+                pl.concat_str(
+                    [_ipv4_address(first), 32 - pl.col("_bits")],
+                    separator="/",
+                )
+            )
+            .when(afi == "ipv6")
+            .then(pl.concat_str([raw_resource, length], separator="/"))
+            .when((afi == "asn") & (length == 1))
+            .then(raw_resource)
+            .when((afi == "asn") & (length < 10000))
+            .then(item.cast(pl.Utf8))
+            .when(afi == "asn")
+            .then(pl.concat_str([raw_resource, asn + length], separator="-"))
+        )
+        .drop(
+            [
+                "_start",
+                "_asn",
+                "_max_bits",
+                "_item",
+                "_bits",
+                "_size",
+                "_first",
+                "_duplicate",
+            ]
+        )
+    )
+
+
 class PytriciaLookup[V]:
     """
     Base type for lookup implementations.
@@ -262,12 +527,17 @@ class PytriciaLookup[V]:
     `__init__` should build the two tries by afi.
     """
 
-    trie4: pytricia.PyTricia
-    trie6: pytricia.PyTricia
+    trie4: VersionedTrie
+    trie6: VersionedTrie
+    # the delegations of the rows of the data, for `match`
+    table: Optional[IntervalTable] = None
+    __frozen: bool = False
+    # the index of `children`, with the versions of the tries it was built from
+    __subtrees: Optional[tuple[tuple[int, int], SubtreeIndex, list]] = None
 
     def __init__(self) -> None:
-        self.trie4 = pytricia.PyTricia(32)
-        self.trie6 = pytricia.PyTricia(128)
+        self.trie4 = VersionedTrie(32)
+        self.trie6 = VersionedTrie(128)
 
         # include 'root' element so children works
         self.trie4["0.0.0.0/0"] = None
@@ -276,6 +546,22 @@ class PytriciaLookup[V]:
     def __contains__(self, prefix: str) -> bool:
         return prefix in self.trie4 or prefix in self.trie6
 
+    @property
+    def frozen(self) -> bool:
+        return self.__frozen
+
+    def freeze(self) -> Self:
+        """
+        Make the lookup immutable so threads can share it: sets in the tries
+        become frozensets and modifying the tries raises `ValueError`. Other
+        values must not be modified afterwards. Returns the lookup.
+        """
+        freeze_trie(self.trie4)
+        freeze_trie(self.trie6)
+        self.__frozen = True
+        self.__subtree_index()
+        return self
+
     def __trie(self, prefix: PrefixType) -> pytricia.PyTricia:
         """Get the relevant of trie."""
         match type(prefix):
@@ -288,43 +574,102 @@ class PytriciaLookup[V]:
             case _:
                 return self.trie4 if "." in prefix else self.trie6
 
+    def _value(self, value: Any) -> Optional[V]:
+        """The value of an entry in the tries, which can be stored in another form."""
+        return value
+
     def get(self, prefix: PrefixType, default=None) -> V:
         """Get the value and default to None"""
         lookup = self.__trie(prefix)
 
-        res = lookup[str(prefix)]
+        res = self._value(lookup[str(prefix)])
         if res is None:
             return default
         return res
 
     def __getitem__(self, prefix: PrefixType) -> V:
-        res = self.__trie(prefix)[str(prefix)]
+        res = self._value(self.__trie(prefix)[str(prefix)])
 
         if res is None:
             raise KeyError(prefix)
 
         return res
 
+    def _build_table(self, data: pd.DataFrame) -> None:
+        """Build the interval table of `match` if the raw resources are present."""
+        if set(data.keys()) >= set(["afi", "raw_resource", "length"]):
+            self.table = IntervalTable(resource_ranges(data))
+
+    def match(self, addresses: Iterable[str] | PrefixBounds) -> np.ndarray:
+        """
+        The position of the row of the data that contains each address, -1 if
+        there is none. Vectorized over the interval table of the delegations.
+        """
+        if self.table is None:
+            raise ValueError("match requires raw_resource and length columns")
+        return self.table.match(addresses)
+
+    def __subtree_index(self) -> tuple[SubtreeIndex, list]:
+        """The index of the keys of the tries and their values, for `children`."""
+        versions = (self.trie4.version, self.trie6.version)
+        if self.__subtrees is None or self.__subtrees[0] != versions:
+            keys = list(self.trie4) + list(self.trie6)
+            values = [self.trie4[key] for key in self.trie4]
+            values.extend(self.trie6[key] for key in self.trie6)
+            self.__subtrees = (versions, SubtreeIndex(keys), values)
+        return self.__subtrees[1:]
+
     def children(self, prefix: PrefixType) -> Generator[V, None, None]:
-        """Recursively get all children of a prefix"""
-        lookup = self.__trie(prefix)
-        resource = ipaddress.ip_network(prefix)
-
-        keys = [lookup.get_key(str(prefix))]
-        while keys:
-            key = keys.pop()
-            # do not include super-nets of the resource being looked up
-            child_keys = [
-                k
-                for k in lookup.children(key)
-                if ipaddress.ip_network(k).overlaps(resource)
-            ]
-            keys.extend(child_keys)
+        """
+        Recursively get all children of a prefix: the value of the most specific
+        key that contains it, followed by the values of the keys within it in
+        address order.
 
-            # do not yield None elements
-            elem = lookup[key]
-            if elem is not None:
-                yield elem
+        The keys are found in an index that is built on the first call, and
+        again after the tries were modified (`freeze` builds it up front).
+        """
+        # parse_prefixes has a large per call overhead for a single prefix
+        afi, first, last, length = parse_prefix(prefix)
+        low = (1 << 64) - 1
+        bounds = PrefixBounds(
+            np.array([afi], dtype=np.uint8),
+            np.array([first >> 64], dtype=np.uint64),
+            np.array([first & low], dtype=np.uint64),
+            np.array([last >> 64], dtype=np.uint64),
+            np.array([last & low], dtype=np.uint64),
+            np.array([length], dtype=np.uint8),
+        )
+        yield from self.__children([str(prefix)], bounds)[0]
+
+    def children_many(self, prefixes: Iterable[PrefixType]) -> list[list[V]]:
+        """
+        The children of many prefixes at once: for each prefix, the value of the
+        most specific key that contains it, followed by the values of the keys
+        within it in address order. Super-nets other than the most specific one
+        are not included, neither are None values.
+        """
+        prefixes = [str(prefix) for prefix in prefixes]
+        return self.__children(prefixes, parse_prefixes(prefixes))
+
+    def __children(self, prefixes: list[str], bounds: PrefixBounds) -> list[list[V]]:
+        index, values = self.__subtree_index()
+        starts, stops = index.slices(bounds)
+
+        res = []
+        for prefix, length, start, stop in zip(
+            prefixes, bounds.length.tolist(), starts.tolist(), stops.tolist()
+        ):
+            lookup = self.__trie(prefix)
+            key = lookup.get_key(prefix)
+            ids = index.order[start:stop].tolist()
+            # the slice includes the prefix itself when it is a key
+            if key is not None and int(key.rsplit("/", 1)[1]) < length:
+                ids.insert(0, None)
+            elements = [
+                self._value(lookup[key] if i is None else values[i]) for i in ids
+            ]
+            res.append([elem for elem in elements if elem is not None])
+        return res
 
 
 class StatsEntryLookup(PytriciaLookup[DelegatedExtendedStatsEntry]):
@@ -348,6 +693,7 @@ class StatsEntryLookup(PytriciaLookup[DelegatedExtendedStatsEntry]):
             ]
         )
         data[data.afi != "asn"].apply(self.__build_trie, axis=1)
+        self._build_table(data)
 
     def __build_trie(self, row: pd.Series) -> None:
         # pytricia: has_key searches for exact match, in for prefix match
@@ -375,11 +721,59 @@ class StatsEntryLookup(PytriciaLookup[DelegatedExtendedStatsEntry]):
                 raise ValueError()
 
 
+def _merge_grouped(
+    group: np.ndarray, ranges: ResourceRanges
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge the overlapping and adjacent ranges of each group.
+
+    Returns the positions of the ranges with the first and the last address of
+    each merged range, ordered by group and address.
+    """
+    order = np.lexsort((ranges.first_lo, ranges.first_hi, group))
+    first_hi, first_lo = ranges.first_hi[order], ranges.first_lo[order]
+
+    # running maximum of the last address within the group, on the rank of
+    # (group, last address): ranks of a group are above those of earlier groups
+    by_last = np.lexsort((ranges.last_lo, ranges.last_hi, group))
+    rank = np.empty(len(by_last), dtype=np.int64)
+    rank[by_last] = np.arange(len(by_last))
+    reach = by_last[np.maximum.accumulate(rank[order])]
+
+    before_hi, before_lo = decrement(first_hi[1:], first_lo[1:])
+    starts = np.concatenate(
+        [
+            [len(order) > 0],
+            (group[order][1:] != group[order][:-1])
+            | (
+                less(
+                    ranges.last_hi[reach[:-1]],
+                    ranges.last_lo[reach[:-1]],
+                    before_hi,
+                    before_lo,
+                )
+                & ((first_hi[1:] != 0) | (first_lo[1:] != 0))
+            ),
+        ]
+    )
+    ends = np.append(starts[1:], True)
+    return order[starts], reach[ends]
+
+
 class StatsCombinedAllocations(PytriciaLookup[CombinedEntry]):
     """
     Lookup the combined allocation and delegated stats lines for a given resource.
+
+    The resources of the rows with the same (opaque_id, afi, rir) are merged with
+    integer interval merging. The rows are kept once, in `entries`, sorted by
+    group; the tries map the CIDRs of the merged resources to their group and
+    the `CombinedEntry` is created on lookup.
     """
 
+    # the non-ASN rows, the rows of group i are starts[i]:starts[i + 1]
+    entries: pd.DataFrame
+    starts: np.ndarray
+
     def __init__(self, data: pd.DataFrame) -> None:
         super().__init__()
         assert set(data.keys()) >= set(
@@ -387,36 +781,68 @@ class StatsCombinedAllocations(PytriciaLookup[CombinedEntry]):
                 "rir",
                 "country",
                 "afi",
+                "raw_resource",
                 "length",
                 "date",
                 "status",
                 "opaque_id",
                 "category",
-                "resource",
             ]
         )
-        data[data.afi != "asn"].groupby(["opaque_id", "afi", "rir"]).apply(
-            self.__build_trie
+        rows = data[data.afi != "asn"]
+        # numbered in the order of the keys, rows without opaque_id are skipped
+        group = (
+            rows.groupby(["opaque_id", "afi", "rir"], observed=True)
+            .ngroup()
+            .to_numpy(dtype=np.float64)
+        )
+        has_group = ~np.isnan(group)
+        order = np.argsort(group[has_group], kind="stable")
+        self.entries = rows[has_group].iloc[order].reset_index(drop=True)
+        group = group[has_group][order].astype(np.int64)
+        self.starts = np.searchsorted(group, np.arange(group.max(initial=-1) + 2))
+
+        # the entries of the CIDRs of a group share the list of its rows, which
+        # is created on the first lookup of the group
+        self.__group_records: list[Optional[list[DelegatedExtendedStatsEntry]]] = [
+            None
+        ] * (len(self.starts) - 1)
+
+        ranges = resource_ranges(self.entries)
+        first, last = _merge_grouped(group, ranges)
+        tries = {AFI_IPV4: self.trie4, AFI_IPV6: self.trie6}
+        for afi, row, first_hi, first_lo, last_hi, last_lo in zip(
+            ranges.afi[first].tolist(),
+            first.tolist(),
+            ranges.first_hi[first].tolist(),
+            ranges.first_lo[first].tolist(),
+            ranges.last_hi[last].tolist(),
+            ranges.last_lo[last].tolist(),
+        ):
+            for cidr in range_cidrs(
+                afi, first_hi << 64 | first_lo, last_hi << 64 | last_lo
+            ):
+                tries[afi][cidr] = (int(group[row]), cidr)
+
+    def _value(self, value: Optional[tuple[int, str]]) -> Optional[CombinedEntry]:
+        if value is None:
+            return None
+        group, cidr = value
+        records = self.__group_records[group]
+        if records is None:
+            records = self.__group_records[group] = self.__records(group)
+        return CombinedEntry(
+            rir=records[0].rir,
+            opaque_id=records[0].opaque_id,
+            entries=records,
+            resource=netaddr.IPNetwork(cidr),
         )
 
-    def __build_trie(self, rows: pd.Series) -> None:
-        """Build trie entries for the groups of rows.
-
-        @precondition grouped by opaque_id, afi, rir.
-        """
-        opaque_ids = rows.opaque_id.unique()
-        assert len(opaque_ids) == 1
-        opaque_id = opaque_ids[0]
-
-        afis = rows.afi.unique()
-        assert len(afis) == 1
-        afi = afis[0]
-
-        rirs = rows.rir.unique()
-        assert len(rirs) == 1
-        rir = rirs[0]
-
-        records = [
+    def __records(self, group: int) -> list[DelegatedExtendedStatsEntry]:
+        """The rows of a group, shared by the entries of its CIDRs"""
+        rows = self.entries.iloc[self.starts[group] : self.starts[group + 1]]
+        has_resource = "resource" in rows.columns
+        return [
             DelegatedExtendedStatsEntry(
                 rir=row.rir,
                 country=row.country,
@@ -426,29 +852,19 @@ class StatsCombinedAllocations(PytriciaLookup[CombinedEntry]):
                 status=row.status,
                 opaque_id=row.opaque_id,
                 category=row.category,
-                resource=row.resource,
+                resource=row.resource if has_resource else extract_resource(row),
             )
-            for _, row in rows.iterrows()
+            for row in rows.itertuples()
         ]
 
-        resources = netaddr.IPSet([entry.resource for entry in records])
-        for cidr in resources.iter_cidrs():
-            combined = CombinedEntry(
-                rir=rir, opaque_id=opaque_id, entries=records, resource=cidr
-            )
-            if afi == "ipv4":
-                self.trie4[str(cidr)] = combined
-            elif afi == "ipv6":
-                self.trie6[str(cidr)] = combined
-            else:
-                raise ValueError()
-
 
 class RirLookup(PytriciaLookup[str]):
     """
     Just find the RIR responsible for the range
     """
 
+    rir_table: Optional["RirTable"]
+
     def __init__(self, data: pd.DataFrame) -> None:
         super().__init__()
         assert set(data.keys()) >= set(
@@ -464,7 +880,19 @@ class RirLookup(PytriciaLookup[str]):
                 "resource",
             ]
         )
-        data[data.afi != "asn"].groupby(["afi", "rir"]).apply(self.__build_trie)
+        # iterate: apply does not pass the grouping columns (pandas >= 3)
+        for _, rows in data[data.afi != "asn"].groupby(["afi", "rir"], observed=True):
+            self.__build_trie(rows)
+        self._build_table(data)
+        self.rir_table = (
+            None if self.table is None else RirTable.from_table(self.table, data.rir)
+        )
+
+    def attribute(self, addresses: Iterable[str] | PrefixBounds) -> pd.Categorical:
+        """The RIR of each address, see `RirTable.attribute`."""
+        if self.rir_table is None:
+            raise ValueError("attribute requires raw_resource and length columns")
+        return self.rir_table.attribute(addresses)
 
     def __build_trie(self, rows: pd.Series) -> None:
         """Build trie entries for the groups of rows.
@@ -486,3 +914,70 @@ class RirLookup(PytriciaLookup[str]):
                 self.trie6[str(cidr)] = rir
             else:
                 raise ValueError()
+
+
+class RirTable:
+    """
+    Attribute addresses to the RIR that delegated them.
+
+    The delegations are a sorted table of non-overlapping address ranges per
+    afi, labelled with the code of the RIR: attributing a column of addresses
+    is a binary search per address. The table is a few arrays, `save` stores
+    it as a file that `load` memory maps.
+    """
+
+    table: IntervalTable
+    rirs: list[str]
+
+    def __init__(self, table: IntervalTable, rirs: list[str]) -> None:
+        """`table` matches addresses to the position of their RIR in `rirs`."""
+        self.table = table
+        self.rirs = rirs
+
+    @classmethod
+    def from_table(cls, table: IntervalTable, rir: pd.Series) -> Self:
+        """From an interval table of the rows of the data and their rir column."""
+        rir = rir.astype("category").cat.remove_unused_categories()
+        return cls(
+            table.relabel(rir.cat.codes.to_numpy().astype(np.int8)),
+            [str(name) for name in rir.cat.categories],
+        )
+
+    @classmethod
+    def from_delegated_stats(cls, data: pd.DataFrame) -> Self:
+        """
+        From (extended) delegated stats, only the rir, afi, raw_resource and
+        length columns are used.
+        """
+        return cls.from_table(IntervalTable(resource_ranges(data)), data.rir)
+
+    def __len__(self) -> int:
+        """The number of ranges."""
+        return len(self.table)
+
+    def codes(self, addresses: Iterable[str] | PrefixBounds) -> np.ndarray:
+        """The position of the RIR of each address in `rirs`, -1 if there is none."""
+        return self.table.match(addresses)
+
+    def attribute(self, addresses: Iterable[str] | PrefixBounds) -> pd.Categorical:
+        """The RIR of each address (or the first address of a prefix), or NaN."""
+        return pd.Categorical.from_codes(self.codes(addresses), categories=self.rirs)
+
+    _ARRAYS = ["afi", "start_hi", "start_lo", "owner"]
+
+    def save(self, path: str | Path) -> None:
+        """Store the table in a single file that `load` memory maps."""
+        save_arrays(
+            path,
+            {name: getattr(self.table, name) for name in self._ARRAYS},
+            {"rirs": self.rirs},
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """Open a table stored with `save`, the arrays are read-only."""
+        arrays, metadata = load_arrays(path)
+        return cls(
+            IntervalTable.from_arrays(*(arrays[name] for name in cls._ARRAYS)),
+            metadata["rirs"],
+        )
@@ -0,0 +1,52 @@
+"""
+Integer encoding of the origins of announcements.
+
+Origins in RIS dumps are strings, as they can be AS sets (e.g. ``{12703}``). They
+are encoded as a uint32 ASN and a flag for origins that are not a single ASN,
+which can never be RPKI valid.
+"""
+
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+
+def encode_origins(
+    origin: pd.Series | pl.Series | Iterable,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode origins as (uint32 ASN, AS set flag) arrays.
+
+    AS sets (e.g. {12703}) and other origins that are not a single ASN are flagged
+    and have ASN 0, they can never be RPKI valid.
+    """
+    match origin:
+        case pd.Series() if pd.api.types.is_integer_dtype(origin.dtype):
+            asn = origin.to_numpy(dtype=np.int64)
+        case pd.Series():
+            asn = _parse_asns(pl.from_pandas(origin.astype(str)))
+        case pl.Series() if origin.dtype.is_integer():
+            asn = origin.cast(pl.Int64).fill_null(-1).to_numpy()
+        case pl.Series():
+            # not `cast(pl.Int64)` directly, that gives the codes of categoricals
+            asn = _parse_asns(origin.cast(pl.Utf8))
+        case _:
+            asn = _parse_asns(
+                pl.Series([str(value) for value in origin], dtype=pl.Utf8)
+            )
+    as_set = (asn < 0) | (asn >= 2**32)
+    return np.where(as_set, 0, asn).astype(np.uint32), as_set
+
+
+def is_as_set(origin: str) -> bool:
+    """The origin is an AS set, or otherwise not a single ASN (`encode_origins`)."""
+    return not (origin.isdigit() and int(origin) < 2**32)
+
+
+def _parse_asns(origin: pl.Series) -> np.ndarray:
+    """ASNs of a string series, -1 if it is not an ASN."""
+    return (
+        origin.str.strip_chars().cast(pl.Int64, strict=False).fill_null(-1).to_numpy()
+    )
@@ -0,0 +1,367 @@
+"""
+Integer encoding of IP prefixes.
+
+A prefix is represented by its address family, the first and last address as a
+128 bit integer that is split into two uint64 halves (``hi``, ``lo``), and the
+prefix length. IPv4 addresses live in the low 32 bits, the same layout as the
+16 byte ``prefix_first``/``resource_first`` columns in the duckdb workbooks.
+
+All functions work on numpy arrays so that lookups and joins over millions of
+prefixes do not need a Python call per row. Frames carry the encoding of a prefix
+column in `{column}_afi`, `{column}_first_hi`, ..., `{column}_length` columns (see
+`with_prefix_bounds`), so they only need to be parsed once.
+"""
+
+import functools
+import ipaddress
+import socket
+from typing import Iterable, Literal, NamedTuple, TypeVar
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+AFI_IPV4 = 4
+AFI_IPV6 = 6
+
+ALL_ONES = np.uint64(0xFFFF_FFFF_FFFF_FFFF)
+
+FrameT = TypeVar("FrameT", pd.DataFrame, pl.DataFrame)
+
+
+class PrefixBounds(NamedTuple):
+    """Columnar representation of a sequence of prefixes."""
+
+    afi: np.ndarray
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    last_hi: np.ndarray
+    last_lo: np.ndarray
+    length: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.afi)
+
+
+def address_bits(afi: np.ndarray | int) -> np.ndarray:
+    """Number of bits in an address of the family."""
+    return np.where(afi == AFI_IPV4, 32, 128).astype(np.uint8)
+
+
+def _low_bits(bits: np.ndarray) -> np.ndarray:
+    """uint64 mask with the lowest `bits` (0..64) bits set."""
+    bits = np.asarray(bits, dtype=np.uint64)
+    # shifting by 64 is undefined, so special case it
+    shifted = np.left_shift(np.uint64(1), np.minimum(bits, np.uint64(63)))
+    return np.where(bits >= 64, ALL_ONES, shifted - np.uint64(1)).astype(np.uint64)
+
+
+def host_masks(
+    afi: np.ndarray | int, length: np.ndarray | int
+) -> tuple[np.ndarray, np.ndarray]:
+    """The (hi, lo) masks of the host part of prefixes of `length`."""
+    host_bits = address_bits(afi).astype(np.int64) - np.asarray(length, dtype=np.int64)
+    return (
+        _low_bits(np.clip(host_bits - 64, 0, 64)),
+        _low_bits(np.clip(host_bits, 0, 64)),
+    )
+
+
+def truncate(
+    afi: np.ndarray | int, hi: np.ndarray, lo: np.ndarray, length: np.ndarray | int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Truncate addresses to the network address of a prefix of `length`."""
+    mask_hi, mask_lo = host_masks(afi, length)
+    return hi & ~mask_hi, lo & ~mask_lo
+
+
+def less(
+    a_hi: np.ndarray, a_lo: np.ndarray, b_hi: np.ndarray, b_lo: np.ndarray
+) -> np.ndarray:
+    """`a < b` for 128 bit values stored as (hi, lo)."""
+    return (a_hi < b_hi) | ((a_hi == b_hi) & (a_lo < b_lo))
+
+
+def minimum(
+    a_hi: np.ndarray, a_lo: np.ndarray, b_hi: np.ndarray, b_lo: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Element-wise minimum of 128 bit values stored as (hi, lo)."""
+    is_a = less(a_hi, a_lo, b_hi, b_lo)
+    return np.where(is_a, a_hi, b_hi), np.where(is_a, a_lo, b_lo)
+
+
+def maximum(
+    a_hi: np.ndarray, a_lo: np.ndarray, b_hi: np.ndarray, b_lo: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Element-wise maximum of 128 bit values stored as (hi, lo)."""
+    is_a = less(b_hi, b_lo, a_hi, a_lo)
+    return np.where(is_a, a_hi, b_hi), np.where(is_a, a_lo, b_lo)
+
+
+def increment(hi: np.ndarray, lo: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Add one to 128 bit values stored as (hi, lo), wrapping around."""
+    carry = (lo == ALL_ONES).astype(np.uint64)
+    return hi + carry, lo + np.uint64(1)
+
+
+def decrement(hi: np.ndarray, lo: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Subtract one from 128 bit values stored as (hi, lo), wrapping around."""
+    borrow = (lo == 0).astype(np.uint64)
+    return hi - borrow, lo - np.uint64(1)
+
+
+def searchsorted(
+    table_hi: np.ndarray,
+    table_lo: np.ndarray,
+    hi: np.ndarray,
+    lo: np.ndarray,
+    side: Literal["left", "right"] = "left",
+) -> np.ndarray:
+    """
+    `np.searchsorted` for 128 bit values stored as (hi, lo).
+
+    The table must be sorted on (hi, lo).
+    """
+    if not table_hi.any() and not hi.any():
+        return np.searchsorted(table_lo, lo, side=side)
+    if not table_lo.any() and not lo.any():
+        return np.searchsorted(table_hi, hi, side=side)
+
+    # General case: sort the queries into the table. For "left" a query sorts
+    # before an equal table entry, for "right" after it.
+    n = len(table_hi)
+    is_query = np.concatenate(
+        [np.zeros(n, dtype=np.int8), np.ones(len(hi), dtype=np.int8)]
+    )
+    if side == "left":
+        is_query = 1 - is_query
+    order = np.lexsort(
+        (is_query, np.concatenate([table_lo, lo]), np.concatenate([table_hi, hi]))
+    )
+    table_before = np.cumsum(order < n)
+
+    res = np.empty(len(hi), dtype=np.int64)
+    query_pos = order >= n
+    res[order[query_pos] - n] = table_before[query_pos]
+    return res
+
+
+def _as_utf8(prefixes: Iterable) -> pl.Series:
+    match prefixes:
+        case pl.Series():
+            series = prefixes.cast(pl.Utf8)
+        case pd.Series() if pd.api.types.is_string_dtype(prefixes.dtype):
+            series = pl.from_pandas(prefixes).cast(pl.Utf8)
+        case _:
+            series = pl.Series([str(p) for p in prefixes], dtype=pl.Utf8)
+    if series.null_count():
+        raise ValueError("prefixes may not contain missing values")
+    return series
+
+
+def _packed(family: int, addresses: list[str]) -> bytes:
+    """Concatenated network order addresses, `ipaddress` reports invalid ones."""
+    try:
+        return b"".join(map(functools.partial(socket.inet_pton, family), addresses))
+    except OSError:
+        for address in addresses:
+            ipaddress.ip_address(address)
+        raise
+
+
+def parse_prefixes(prefixes: Iterable) -> PrefixBounds:
+    """
+    Parse prefix strings (or addresses, as a host prefix) into `PrefixBounds`.
+
+    The addresses are packed by `socket.inet_pton` and read as integers by numpy,
+    so there is no Python level work per row. Bits beyond the prefix length are
+    ignored, like pytricia does. Raises `ValueError` for invalid input.
+    """
+    series = _as_utf8(prefixes)
+    parts = series.str.split_exact("/", 1).struct.unnest()
+    addresses, lengths = parts["field_0"], parts["field_1"]
+
+    is_v6 = addresses.str.contains(":", literal=True).to_numpy()
+    afi = np.where(is_v6, AFI_IPV6, AFI_IPV4).astype(np.uint8)
+    hi = np.zeros(len(series), dtype=np.uint64)
+    lo = np.zeros(len(series), dtype=np.uint64)
+
+    v4 = _packed(socket.AF_INET, addresses.filter(~is_v6).to_list())
+    lo[~is_v6] = np.frombuffer(v4, dtype=">u4")
+    v6 = np.frombuffer(
+        _packed(socket.AF_INET6, addresses.filter(is_v6).to_list()), dtype=">u8"
+    ).reshape(-1, 2)
+    hi[is_v6] = v6[:, 0]
+    lo[is_v6] = v6[:, 1]
+
+    bits = address_bits(afi)
+    length = lengths.str.to_integer(strict=False).to_numpy()
+    has_length = lengths.is_not_null().to_numpy()
+    invalid = has_length & ~((length >= 0) & (length <= bits))
+    if invalid.any():
+        raise ValueError(f"Invalid prefix length: {series[int(np.argmax(invalid))]}")
+    length = np.where(has_length, length, bits).astype(np.uint8)
+
+    mask_hi, mask_lo = host_masks(afi, length)
+    return PrefixBounds(
+        afi=afi,
+        first_hi=hi & ~mask_hi,
+        first_lo=lo & ~mask_lo,
+        last_hi=hi | mask_hi,
+        last_lo=lo | mask_lo,
+        length=length,
+    )
+
+
+def parse_prefix(prefix: object) -> tuple[int, int, int, int]:
+    """
+    Parse a single prefix (or address) into (afi, first, last, length), with the
+    addresses as 128 bit integers.
+
+    For scalar lookups, this avoids the per call overhead of `parse_prefixes`.
+    """
+    address, slash, length = str(prefix).partition("/")
+    family, bits = (socket.AF_INET6, 128) if ":" in address else (socket.AF_INET, 32)
+    try:
+        value = int.from_bytes(socket.inet_pton(family, address))
+    except OSError:
+        value = None
+    if not slash:
+        length = str(bits)
+    if (
+        value is not None
+        and length.isascii()
+        and length.isdigit()
+        and int(length) <= bits
+    ):
+        length = int(length)
+        host = (1 << (bits - length)) - 1
+        return (
+            AFI_IPV6 if bits == 128 else AFI_IPV4,
+            value & ~host,
+            value | host,
+            length,
+        )
+
+    # ipaddress reports invalid prefixes, and parses the forms inet_pton does not
+    network = ipaddress.ip_network(str(prefix), strict=False)
+    return (
+        network.version,
+        int(network.network_address),
+        int(network.broadcast_address),
+        network.prefixlen,
+    )
+
+
+def range_cidrs(afi: int, first: int, last: int) -> list[str]:
+    """The CIDR blocks of the addresses [first, last], in address order."""
+    family, bits = (socket.AF_INET, 32) if afi == AFI_IPV4 else (socket.AF_INET6, 128)
+    res = []
+    while first <= last:
+        # the largest aligned block that fits
+        size = (first & -first) or (1 << bits)
+        while size > last - first + 1:
+            size >>= 1
+        address = socket.inet_ntop(family, first.to_bytes(bits // 8))
+        res.append(f"{address}/{bits + 1 - size.bit_length()}")
+        first += size
+    return res
+
+
+# dtypes of the columns of a prefix in a frame, by `PrefixBounds` field
+BOUNDS_DTYPES = {
+    "afi": np.uint8,
+    "first_hi": np.uint64,
+    "first_lo": np.uint64,
+    "last_hi": np.uint64,
+    "last_lo": np.uint64,
+    "length": np.int64,
+}
+
+
+def packed_addresses(
+    hi: np.ndarray, lo: np.ndarray, valid: np.ndarray | None = None
+) -> pa.FixedSizeBinaryArray:
+    """
+    Addresses as 16 byte big endian binary, that compares like the addresses
+    (e.g. `resource_first <= prefix_first` in duckdb). Null where not `valid`.
+    """
+    data = np.empty((len(hi), 2), dtype=">u8")
+    data[:, 0], data[:, 1] = hi, lo
+    validity = None if valid is None else pa.array(valid, type=pa.bool_()).buffers()[1]
+    return pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(16),
+        len(hi),
+        [validity, pa.py_buffer(data.tobytes())],
+        null_count=0 if valid is None else int(len(hi) - np.count_nonzero(valid)),
+    )
+
+
+def bounds_columns(column: str) -> dict[str, str]:
+    """The names of the columns with the bounds of `column`, by field."""
+    return {field: f"{column}_{field}" for field in PrefixBounds._fields}
+
+
+def bounds_frame(prefixes: pl.Series, column: str) -> pl.DataFrame:
+    """
+    The bounds of `prefixes` as the columns of `column`.
+
+    Missing prefixes (e.g. the ASN rows of delegated stats) have missing bounds.
+    """
+    present = prefixes.is_not_null().to_numpy()
+    bounds = parse_prefixes(prefixes.filter(present))
+    columns = {}
+    for field, name in bounds_columns(column).items():
+        values = np.zeros(len(prefixes), dtype=BOUNDS_DTYPES[field])
+        values[present] = getattr(bounds, field)
+        columns[name] = pl.Series(name, values)
+    frame = pl.DataFrame(columns)
+    if present.all():
+        return frame
+    return frame.select(pl.when(pl.Series(present)).then(pl.all()).name.keep())
+
+
+def with_prefix_bounds(df: FrameT, column: str = "prefix") -> FrameT:
+    """Add the integer encoding of the prefixes in `column` as columns."""
+    if isinstance(df, pl.DataFrame):
+        return df.with_columns(bounds_frame(df[column], column))
+
+    bounds = parse_prefixes(df[column])
+    return df.assign(
+        **{
+            name: getattr(bounds, field).astype(BOUNDS_DTYPES[field])
+            for field, name in bounds_columns(column).items()
+        }
+    )
+
+
+def prefix_bounds(
+    df: pd.DataFrame | pl.DataFrame, column: str = "prefix"
+) -> PrefixBounds:
+    """
+    The `PrefixBounds` of a prefix column, from its bounds columns if the frame
+    has them (see `with_prefix_bounds`), otherwise by parsing it.
+
+    Raises `ValueError` for missing bounds, e.g. of the missing prefixes of a
+    polars frame: they can not be represented in the arrays.
+    """
+    names = bounds_columns(column)
+    if not set(names.values()) <= set(df.columns):
+        return parse_prefixes(df[column])
+    for name in names.values():
+        values = df[name]
+        if (
+            values.null_count()
+            if isinstance(values, pl.Series)
+            else values.isna().any()
+        ):
+            raise ValueError(f"Missing values in bounds column {name}")
+    return PrefixBounds(
+        afi=np.asarray(df[names["afi"]], dtype=np.uint8),
+        first_hi=np.asarray(df[names["first_hi"]], dtype=np.uint64),
+        first_lo=np.asarray(df[names["first_lo"]], dtype=np.uint64),
+        last_hi=np.asarray(df[names["last_hi"]], dtype=np.uint64),
+        last_lo=np.asarray(df[names["last_lo"]], dtype=np.uint64),
+        length=np.asarray(df[names["length"]], dtype=np.uint8),
+    )
@@ -1,80 +1,601 @@
-import ipaddress
+import datetime
 import logging
+import multiprocessing
+import os
+import re
 from abc import abstractmethod
-from typing import Generator, NamedTuple, Set
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Generator, Iterable, Literal, NamedTuple, Optional, Self, Set
 
-import netaddr
+import numpy as np
 import pandas as pd
+import polars as pl
 
-from rpki_analysis.datastructures import BasePytriciaLookup, PrefixType
+from rpki_analysis.datastructures import BasePytriciaLookup, IntervalTable, PrefixType
+from rpki_analysis.delegated_stats import resource_ranges
+from rpki_analysis.origins import encode_origins, is_as_set
+from rpki_analysis.prefixes import (
+    AFI_IPV4,
+    AFI_IPV6,
+    ALL_ONES,
+    PrefixBounds,
+    address_bits,
+    bounds_columns,
+    decrement,
+    host_masks,
+    increment,
+    less,
+    maximum,
+    minimum,
+    parse_prefix,
+    parse_prefixes,
+    prefix_bounds,
+    searchsorted,
+    truncate,
+    with_prefix_bounds,
+)
 
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
 
 class ExpandedRisEntry(NamedTuple):
-    """Because this can contain AS sets (e.g. {12703}), origins are strings."""
+    """
+    Because this can contain AS sets (e.g. {12703}), origins are strings. See
+    `origin_asn` for the origin as an integer.
+    """
 
     origin: str
     prefix: str
     seen_by_peers: int
     prefix_length: int
 
+    @property
+    def origin_as_set(self) -> bool:
+        """The origin is an AS set, or otherwise not a single ASN."""
+        return is_as_set(self.origin)
 
-def read_ris_dump(url: str) -> pd.DataFrame:
-    # Get file, accept that there are comment lines in there
-    df = pd.read_csv(
-        url, compression="gzip", sep="\t", names=["origin", "prefix", "seen_by_peers"]
+    @property
+    def origin_asn(self) -> int:
+        """The origin ASN, 0 for AS sets (see `encode_origins`)."""
+        return 0 if self.origin_as_set else int(self.origin)
+
+
+def read_ris_dump_batches(
+    url: str,
+    visibility_threshold: int = 0,
+    afi: Optional[int] = None,
+    batch_size: int = 1_000_000,
+    prefix_bounds: bool = False,
+) -> Generator[pd.DataFrame, None, None]:
+    """
+    Read a riswhoisdump file in batches of at most `batch_size` rows.
+
+    Only rows seen by at least `visibility_threshold` peers and, if set, of
+    address family `afi` (4 or 6) are parsed further, so memory use is bounded by
+    the batch size and not by the size of the dump.
+
+    The origin is encoded as integer in `origin_asn` and `origin_as_set` (see
+    `encode_origins`), the `origin` column can be dropped if the AS sets are not
+    needed. With `prefix_bounds` the integer encoding of the prefix is added as
+    columns (see `rpki_analysis.prefixes.with_prefix_bounds`).
+    """
+    warned = False
+    with pd.read_csv(
+        url,
+        compression="gzip",
+        sep="\t",
+        names=["origin", "prefix", "seen_by_peers"],
+        dtype={"origin": str, "prefix": str, "seen_by_peers": int},
+        # skip the header comment lines
+        comment="%",
+        chunksize=batch_size,
+    ) as reader:
+        for df in reader:
+            if not warned and df.origin.str.startswith("{").any():
+                LOG.warning(
+                    "RIS dump contains row(s) with AS_SET! These will never be RPKI valid (https://tools.ietf.org/html/rfc6907#section-7.1.8)"
+                )
+                warned = True
+
+            if visibility_threshold:
+                df = df[df.seen_by_peers >= visibility_threshold]
+            if afi is not None:
+                is_v6 = df.prefix.str.contains(":", regex=False)
+                df = df[is_v6 if afi == AFI_IPV6 else ~is_v6]
+            if not len(df):
+                continue
+            yield _with_ris_dump_columns(df, prefix_bounds)
+
+
+def _with_ris_dump_columns(df: pd.DataFrame, prefix_bounds: bool) -> pd.DataFrame:
+    """Add the encoded origin and the prefix length (or bounds) to rows of a dump."""
+    df["origin_asn"], df["origin_as_set"] = encode_origins(df.origin)
+    # separate prefix length, the bounds include it
+    df = with_prefix_bounds(df)
+    if not prefix_bounds:
+        df = df.drop(
+            columns=[
+                name
+                for name in bounds_columns("prefix").values()
+                if name != "prefix_length"
+            ]
+        )
+    return df
+
+
+def _concat_ris_dump_batches(
+    batches: Iterable[pd.DataFrame], prefix_bounds: bool = False
+) -> pd.DataFrame:
+    """
+    Concatenate the batches of `read_ris_dump_batches`, an empty frame with the
+    same columns if there are none (e.g. for a dump with only comments).
+    """
+    batches = list(batches)
+    if not batches:
+        empty = pd.DataFrame(
+            {
+                "origin": pd.Series([], dtype=str),
+                "prefix": pd.Series([], dtype=str),
+                "seen_by_peers": pd.Series([], dtype=int),
+            }
+        )
+        return _with_ris_dump_columns(empty, prefix_bounds)
+    return pd.concat(batches, ignore_index=True)
+
+
+def read_ris_dump(url: str, prefix_bounds: bool = False) -> pd.DataFrame:
+    """
+    Read a riswhoisdump file.
+
+    See `read_ris_dump_batches` to filter while reading.
+    """
+    return _concat_ris_dump_batches(
+        read_ris_dump_batches(url, prefix_bounds=prefix_bounds), prefix_bounds
     )
 
-    if df.origin.str.startswith("{").any():
-        LOG.warning(
-            "RIS dump contains row(s) with AS_SET! These will never be RPKI valid (https://tools.ietf.org/html/rfc6907#section-7.1.8)"
+
+# dates in paths of archived dumps, e.g. 2024/01/31, 2024-01-31 or 20240131
+RIS_DUMP_DATE = re.compile(r"(\d{4})[-/]?(\d{2})[-/]?(\d{2})")
+
+
+def _ris_dump_date(path: str) -> Optional[datetime.date]:
+    """The (last) date in the path of a dump."""
+    for match in reversed(list(RIS_DUMP_DATE.finditer(path))):
+        try:
+            return datetime.date(*map(int, match.groups()))
+        except ValueError:
+            continue
+    return None
+
+
+def _ris_parquet_name(relative: Path) -> str:
+    """Output file name of a dump, unique within the input directory."""
+    return "_".join(relative.parts).removesuffix(".gz") + ".parquet"
+
+
+def _ris_empty_marker(destination: Path, date: datetime.date, name: str) -> Path:
+    """The file that records that a dump has no rows, it has no afi partition."""
+    return destination / f"date={date.isoformat()}" / (name + ".empty")
+
+
+def _convert_ris_dump(
+    path: Path, destination: Path, date: datetime.date, name: str
+) -> list[Path]:
+    """Convert one dump into a parquet file per afi, see `convert_ris_dumps`."""
+    with path.open("rb") as f:
+        df = pl.from_pandas(
+            _concat_ris_dump_batches(
+                read_ris_dump_batches(f, prefix_bounds=True), prefix_bounds=True
+            )
+        ).with_columns(pl.col("origin").cast(pl.Categorical))
+    if not len(df):
+        marker = _ris_empty_marker(destination, date, name)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        return []
+
+    # write everything before renaming, so a dump is converted completely or not
+    written = []
+    for (afi,), part in df.partition_by("prefix_afi", as_dict=True).items():
+        target = destination / f"date={date.isoformat()}" / f"afi={afi}" / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_suffix(".tmp")
+        part.drop("prefix_afi").write_parquet(tmp_path)
+        written.append((tmp_path, target))
+    for tmp_path, target in written:
+        os.replace(tmp_path, target)
+    return [target for _, target in written]
+
+
+def convert_ris_dumps(
+    source: str | Path,
+    destination: str | Path,
+    workers: Optional[int] = None,
+    pattern: str = "**/riswhoisdump.IPv[46]*.gz",
+) -> list[Path]:
+    """
+    Convert a directory of archived riswhoisdump files into parquet, partitioned
+    by date and afi (`date=2024-01-31/afi=4/...`). Read the result with
+    `scan_ris_parquet`, or with duckdb.
+
+    The date of a dump is taken from its path, dumps without one are skipped. The
+    files include the prefix bounds columns and a dictionary encoded origin. Dumps
+    are converted in `workers` processes, dumps that were converted before are
+    skipped. Dumps without rows have no files, but an empty `.empty` marker so
+    they are skipped as well. Returns the written files.
+    """
+    source, destination = Path(source), Path(destination)
+    todo = []
+    for path in sorted(source.glob(pattern)):
+        relative = path.relative_to(source)
+        date = _ris_dump_date(str(relative))
+        if date is None:
+            LOG.warning("No date in the path of %s, skipping it", path)
+            continue
+        name = _ris_parquet_name(relative)
+        if _ris_empty_marker(destination, date, name).exists() or any(
+            destination.glob(f"date={date.isoformat()}/afi=*/{name}")
+        ):
+            continue
+        todo.append((path, date, name))
+
+    LOG.info("Converting %d RIS dumps", len(todo))
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        # polars is multi-threaded, forking it can deadlock
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        futures = [
+            pool.submit(_convert_ris_dump, path, destination, date, name)
+            for path, date, name in todo
+        ]
+        return [target for future in futures for target in future.result()]
+
+
+def scan_ris_parquet(destination: str | Path) -> pl.LazyFrame:
+    """Scan the output of `convert_ris_dumps`, with `date` and `afi` columns."""
+    return pl.scan_parquet(f"{destination}/**/*.parquet", hive_partitioning=True)
+
+
+RIS_SUMMARY_STATISTICS = ["origin", "prefix_length", "seen_by_peers"]
+RIS_SUMMARY_QUANTILES = [0.0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1.0]
+RIS_SUMMARY_SCHEMA = {
+    "afi": pl.UInt8,
+    "statistic": pl.Enum(RIS_SUMMARY_STATISTICS),
+    "origin": pl.Categorical,
+    "prefix_length": pl.UInt8,
+    "quantile": pl.Float64,
+    "prefixes": pl.UInt64,
+    "seen_by_peers": pl.Int64,
+}
+
+
+def _quantiles(histogram: pl.DataFrame, quantiles: list[float]) -> pl.DataFrame:
+    """Quantiles (inverted cdf) of `seen_by_peers` from its counts, per afi."""
+    parts = []
+    for (afi,), counts in (
+        histogram.sort("seen_by_peers").partition_by("afi", as_dict=True).items()
+    ):
+        cumulative = counts["prefixes"].cum_sum().to_numpy()
+        ranks = np.maximum(np.ceil(np.array(quantiles) * cumulative[-1]), 1)
+        parts.append(
+            pl.DataFrame(
+                {
+                    "afi": pl.Series([afi] * len(quantiles), dtype=pl.UInt8),
+                    "quantile": quantiles,
+                    "seen_by_peers": counts["seen_by_peers"].gather(
+                        np.searchsorted(cumulative, ranks)
+                    ),
+                }
+            )
         )
-    # select the rows that do not have the '%' prefix
-    df = df[~df.origin.str.startswith("%")].copy()
+    return pl.concat(parts)
 
-    # separate prefix length
-    df["prefix_length"] = df.prefix.map(lambda p: ipaddress.ip_network(p).prefixlen)
 
-    return df
+def summarize_ris_dump_batches(
+    batches: Iterable[pd.DataFrame], quantiles: list[float] = RIS_SUMMARY_QUANTILES
+) -> pl.DataFrame:
+    """
+    Aggregates of a RIS dump per afi, in long format by `statistic`:
+      * origin: the number of `prefixes` and total `seen_by_peers` by `origin`
+      * prefix_length: the same by `prefix_length`
+      * seen_by_peers: the `seen_by_peers` at each `quantile` of the entries
 
+    The batches, e.g. of `read_ris_dump_batches`, are aggregated one at a time.
+    """
+    parts: dict[str, list[pl.DataFrame]] = {key: [] for key in RIS_SUMMARY_STATISTICS}
+    for batch in batches:
+        assert set(batch.keys()) >= set(
+            ["origin", "prefix", "seen_by_peers", "prefix_length"]
+        )
+        df = pl.from_pandas(
+            batch[["origin", "prefix_length", "seen_by_peers"]].assign(
+                afi=np.where(
+                    batch.prefix.str.contains(":", regex=False), AFI_IPV6, AFI_IPV4
+                ).astype(np.uint8)
+            )
+        )
+        for key in RIS_SUMMARY_STATISTICS:
+            parts[key].append(
+                df.group_by("afi", key).agg(
+                    prefixes=pl.len(), total=pl.col("seen_by_peers").sum()
+                )
+            )
 
-class RisWhoisLookupTrie(BasePytriciaLookup[Set[ExpandedRisEntry]]):
-    def __init__(self, data: pd.DataFrame, visibility_threshold: int = 10) -> None:
-        super().__init__(initial_value=set)
+    counts = {
+        key: pl.concat(frames)
+        .group_by("afi", key)
+        .agg(pl.col("prefixes").sum(), pl.col("total").sum())
+        .sort("afi", key)
+        for key, frames in parts.items()
+        if frames
+    }
+    if not counts:
+        return pl.DataFrame(schema=RIS_SUMMARY_SCHEMA)
+    return pl.concat(
+        [
+            counts[key]
+            .rename({"total": "seen_by_peers"})
+            .with_columns(statistic=pl.lit(key))
+            for key in ["origin", "prefix_length"]
+        ]
+        + [
+            _quantiles(counts["seen_by_peers"].drop("total"), quantiles).with_columns(
+                statistic=pl.lit("seen_by_peers")
+            )
+        ],
+        how="diagonal_relaxed",
+    ).select(pl.col(name).cast(dtype) for name, dtype in RIS_SUMMARY_SCHEMA.items())
 
-        assert set(data.keys()) >= set(
-            [
-                "origin",
-                "prefix",
-                "seen_by_peers",
-                "prefix_length",
-            ]
+
+def ris_summary_path(path: str | Path) -> Path:
+    """The summary next to a dump, e.g. riswhoisdump.IPv6.summary.parquet."""
+    path = Path(path)
+    return path.with_name(path.name.removesuffix(".gz") + ".summary.parquet")
+
+
+def summarize_ris_dump(path: str | Path) -> pl.DataFrame:
+    """
+    The aggregates of a dump (see `summarize_ris_dump_batches`).
+
+    They are computed once and stored next to the dump (`ris_summary_path`),
+    later calls read the stored summary unless the dump changed.
+    """
+    path = Path(path)
+    target = ris_summary_path(path)
+    if target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+        return pl.read_parquet(target)
+
+    with path.open("rb") as f:
+        summary = summarize_ris_dump_batches(read_ris_dump_batches(f))
+    tmp_path = target.with_suffix(".tmp")
+    summary.write_parquet(tmp_path)
+    os.replace(tmp_path, target)
+    return summary
+
+
+def _expand_ranges(start: np.ndarray, end: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The (range index, position) pairs of the ranges [start, end)."""
+    counts = end - start
+    idx = np.repeat(np.arange(len(start)), counts)
+    pos = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts - start, counts
+    )
+    return idx, pos
+
+
+class RisWhoisMoreSpecificIndex:
+    """
+    Enumerate the entries that are equal to or more specific than a prefix.
+
+    Entries are sorted by (afi, first address, length). The more specifics of a
+    prefix are the entries that start in its range and are at least as long, so a
+    lookup is a range scan between two binary searches instead of a trie walk.
+    """
+
+    afi: np.ndarray
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    length: np.ndarray
+    origin_asn: np.ndarray
+    # the origins that are not an ASN (AS sets), by position
+    origin_sets: dict[int, str]
+    prefix: np.ndarray
+    seen_by_peers: np.ndarray
+    # [start, end) of the entries of each afi
+    __afi_ranges: dict[int, tuple[int, int]]
+
+    def __init__(self, data: pd.DataFrame) -> None:
+        """Build the index from a dump, bounds columns are used if present."""
+        assert set(data.keys()) >= set(["origin", "prefix", "seen_by_peers"])
+
+        bounds = prefix_bounds(data)
+        order = np.lexsort(
+            (bounds.length, bounds.first_lo, bounds.first_hi, bounds.afi)
+        )
+        self.afi = bounds.afi[order]
+        self.first_hi = bounds.first_hi[order]
+        self.first_lo = bounds.first_lo[order]
+        self.length = bounds.length[order]
+        if set(["origin_asn", "origin_as_set"]) <= set(data.keys()):
+            asn = data.origin_asn.to_numpy(dtype=np.uint32)
+            as_set = data.origin_as_set.to_numpy(dtype=bool)
+        else:
+            asn, as_set = encode_origins(data.origin)
+        self.origin_asn = asn[order]
+        as_set = as_set[order]
+        self.origin_sets = dict(
+            zip(
+                np.flatnonzero(as_set).tolist(),
+                data.origin.to_numpy(dtype=object)[order][as_set].tolist(),
+            )
+        )
+        self.prefix = data.prefix.to_numpy(dtype=object)[order]
+        self.seen_by_peers = data.seen_by_peers.to_numpy()[order]
+
+        self.__afi_ranges = {
+            afi: (
+                int(np.searchsorted(self.afi, afi, side="left")),
+                int(np.searchsorted(self.afi, afi, side="right")),
+            )
+            for afi in (AFI_IPV4, AFI_IPV6)
+        }
+
+    def __len__(self) -> int:
+        return len(self.afi)
+
+    def __position(self, afi: int, address: int, side: Literal["left", "right"]) -> int:
+        """Position of a single address: binary search on hi, then on lo."""
+        hi, lo = np.uint64(address >> 64), np.uint64(address & int(ALL_ONES))
+        start, end = self.__afi_ranges[afi]
+        table_hi = self.first_hi[start:end]
+        start, end = (
+            start + int(np.searchsorted(table_hi, hi, side="left")),
+            start + int(np.searchsorted(table_hi, hi, side="right")),
         )
-        data[(data.seen_by_peers >= visibility_threshold)].apply(
-            self.__build_trie, axis=1
+        return start + int(np.searchsorted(self.first_lo[start:end], lo, side=side))
+
+    def __entry(self, idx: int) -> ExpandedRisEntry:
+        return ExpandedRisEntry(
+            self.origin_sets.get(idx) or str(self.origin_asn[idx]),
+            self.prefix[idx],
+            int(self.seen_by_peers[idx]),
+            int(self.length[idx]),
         )
 
-    def __build_trie(self, row: pd.Series) -> None:
-        # pytricia: has_key searches for exact match, in for prefix match
-        # we want exact match.
+    def entries(self, start: int, stop: int) -> Generator[ExpandedRisEntry, None, None]:
+        """The entries at the positions [start, stop)."""
+        for idx in range(start, stop):
+            yield self.__entry(idx)
 
-        trie = self._trie(row.prefix)
+    def lookup(self, prefix: PrefixType) -> Generator[ExpandedRisEntry, None, None]:
+        afi, first, last, length = parse_prefix(prefix)
+        start = self.__position(afi, first, "left")
+        end = self.__position(afi, last, "right")
+
+        # entries that start at the first address can be less specifics
+        for idx in start + np.flatnonzero(self.length[start:end] >= length):
+            yield self.__entry(idx)
 
-        if not trie.has_key(row.prefix):  # noqa: W601
-            # Add entry
-            trie[row.prefix] = set()
+    def __getitem__(self, prefix: PrefixType) -> Set[ExpandedRisEntry]:
+        return set(self.lookup(prefix))
 
-        trie[row.prefix].add(
-            ExpandedRisEntry(
-                row.origin,
-                row.prefix,
-                row.seen_by_peers,
-                row.prefix_length,
+    def matches(self, bounds: PrefixBounds) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The (query, entry) index pairs of the more specifics of each prefix in
+        `bounds`, ordered by query.
+        """
+        start = np.zeros(len(bounds), dtype=np.int64)
+        end = np.zeros(len(bounds), dtype=np.int64)
+        for afi, (lo, hi) in self.__afi_ranges.items():
+            is_afi = bounds.afi == afi
+            if not is_afi.any():
+                continue
+            table = (self.first_hi[lo:hi], self.first_lo[lo:hi])
+            start[is_afi] = lo + searchsorted(
+                *table, bounds.first_hi[is_afi], bounds.first_lo[is_afi], side="left"
+            )
+            end[is_afi] = lo + searchsorted(
+                *table, bounds.last_hi[is_afi], bounds.last_lo[is_afi], side="right"
             )
+
+        query, entry = _expand_ranges(start, end)
+        keep = self.length[entry] >= bounds.length[query]
+        return query[keep], entry[keep]
+
+    def lookup_many(self, prefixes: Iterable[str]) -> pd.DataFrame:
+        """
+        The more specifics of many prefixes at once, with the position of the
+        queried prefix in `query`.
+        """
+        return self.frame(*self.matches(parse_prefixes(prefixes)))
+
+    def frame(self, query: np.ndarray, entry: np.ndarray) -> pd.DataFrame:
+        """The entries at the positions in `entry`, for the queries in `query`."""
+        origin = self.origin_asn[entry].astype(str).astype(object)
+        if self.origin_sets:
+            as_set = np.isin(entry, list(self.origin_sets))
+            origin[as_set] = [self.origin_sets[idx] for idx in entry[as_set].tolist()]
+        return pd.DataFrame(
+            {
+                "query": query,
+                "origin": origin,
+                "origin_asn": self.origin_asn[entry],
+                "prefix": self.prefix[entry],
+                "seen_by_peers": self.seen_by_peers[entry],
+                "prefix_length": self.length[entry].astype(np.int64),
+            }
         )
 
+
+class RisWhoisLookupTrie(BasePytriciaLookup[tuple[int, int]]):
+    """
+    Tries of RIS entries.
+
+    The entries are stored in columns, sorted by prefix (a
+    `RisWhoisMoreSpecificIndex`). The tries map each distinct prefix to the range
+    of its entries, the entries are only created on lookup. Pass batches read
+    with `prefix_bounds` to avoid parsing the prefixes again.
+    """
+
+    entries: RisWhoisMoreSpecificIndex
+    # the [start, stop) range of the entries of each distinct prefix
+    starts: np.ndarray
+    stops: np.ndarray
+
+    def __init__(
+        self,
+        data: pd.DataFrame | Iterable[pd.DataFrame],
+        visibility_threshold: int = 10,
+    ) -> None:
+        """Build the trie from a dump, or the batches of `read_ris_dump_batches`."""
+        # the root has an empty range of entries
+        super().__init__(initial_value=lambda: (0, 0))
+
+        batches = []
+        for batch in [data] if isinstance(data, pd.DataFrame) else data:
+            assert set(batch.keys()) >= set(
+                [
+                    "origin",
+                    "prefix",
+                    "seen_by_peers",
+                    "prefix_length",
+                ]
+            )
+            batches.append(batch[(batch.seen_by_peers >= visibility_threshold)])
+
+        data = _concat_ris_dump_batches(batches).drop_duplicates(
+            ["origin", "prefix", "seen_by_peers"]
+        )
+        self.entries = RisWhoisMoreSpecificIndex(data)
+        self.__build_trie()
+
+    def __build_trie(self) -> None:
+        entries = self.entries
+        # identical prefixes are adjacent: same afi, first address and length
+        changed = (
+            (entries.afi[1:] != entries.afi[:-1])
+            | (entries.first_hi[1:] != entries.first_hi[:-1])
+            | (entries.first_lo[1:] != entries.first_lo[:-1])
+            | (entries.length[1:] != entries.length[:-1])
+        )
+        self.starts = np.flatnonzero(np.concatenate([[len(entries) > 0], changed]))
+        self.stops = np.append(self.starts[1:], len(entries))
+
+        tries = {AFI_IPV4: self._trie("0.0.0.0/0"), AFI_IPV6: self._trie("::/0")}
+        for afi, start, stop in zip(
+            entries.afi[self.starts].tolist(),
+            self.starts.tolist(),
+            self.stops.tolist(),
+        ):
+            tries[afi][entries.prefix[start]] = (start, stop)
+
+    def _entries(self, key: str) -> Generator[ExpandedRisEntry, None, None]:
+        """The entries of a key in the trie."""
+        return self.entries.entries(*self._trie(key)[key])
+
     @abstractmethod
     def lookup(self, prefix: PrefixType) -> Generator[ExpandedRisEntry, None, None]:
         pass
@@ -85,67 +606,436 @@ class RisWhoisLookupTrie(BasePytriciaLookup[Set[ExpandedRisEntry]]):
     def __getitem__(self, prefix) -> Set[ExpandedRisEntry]:
         return set(self.lookup(prefix))
 
+    def get(self, prefix: PrefixType, default=None) -> Set[ExpandedRisEntry]:
+        """The entries of the longest matching prefix in the trie."""
+        res = super().get(prefix)
+        return default if res is None else set(self.entries.entries(*res))
+
 
 class RisWhoisLookup(RisWhoisLookupTrie):
+    __table: Optional[IntervalTable] = None
+
     def lookup(self, prefix) -> Generator[ExpandedRisEntry, None, None]:
         trie = self._trie(prefix)
         key = trie.get_key(prefix)
         while key is not None:
-            yield from trie[key]
+            yield from self._entries(key)
             key = trie.parent(key)
 
+    def match(self, addresses: Iterable[str] | PrefixBounds) -> np.ndarray:
+        """
+        The longest matching prefix of many addresses at once, as the position
+        of the prefix in `starts`/`stops`, -1 if there is none.
 
-class RisWhoisLookupMoreSpecific(RisWhoisLookupTrie):
-    """Lookup more or equally specific elements."""
+        The interval table is built on first use, or by `freeze`.
+        """
+        if self.__table is None:
+            self.__build_table()
+        return self.__table.match(addresses)
 
-    def lookup(self, prefix) -> Generator[ExpandedRisEntry, None, None]:
-        resource = netaddr.IPSet(netaddr.IPNetwork(prefix))
-        trie = self._trie(prefix)
-
-        keys = [trie.get_key(str(prefix))]
-        while keys:
-            key = keys.pop()
-            # Do not include children of elements that are not in the resource
-            # (it would be a less specific).
-            if not resource.issuperset(netaddr.IPSet(netaddr.IPNetwork(key))):
-                continue
+    def __build_table(self) -> None:
+        entries, starts = self.entries, self.starts
+        afi, length = entries.afi[starts], entries.length[starts]
+        mask_hi, mask_lo = host_masks(afi, length)
+        self.__table = IntervalTable(
+            PrefixBounds(
+                afi,
+                entries.first_hi[starts],
+                entries.first_lo[starts],
+                entries.first_hi[starts] | mask_hi,
+                entries.first_lo[starts] | mask_lo,
+                length,
+            )
+        )
 
-            child_keys = list(trie.children(key))
-            keys.extend(child_keys)
+    def freeze(self) -> Self:
+        """Like `BasePytriciaLookup.freeze`, the interval table is built as well."""
+        if self.__table is None:
+            self.__build_table()
+        return super().freeze()
 
-            # do not yield None elements
-            elem = trie[key]
-            if elem is not None:
-                yield from elem
+    def lookup_addresses(self, addresses: Iterable[str] | PrefixBounds) -> pd.DataFrame:
+        """
+        The entries of the longest matching prefix of many addresses at once,
+        with the position of the address in `query`.
+        """
+        matched = self.match(addresses)
+        found = np.flatnonzero(matched >= 0)
+        idx, entry = _expand_ranges(
+            self.starts[matched[found]], self.stops[matched[found]]
+        )
+        return self.entries.frame(found[idx], entry)
 
 
-class RisWhoisLookupMoreLessSpecific(RisWhoisLookupTrie):
+class RisWhoisLookupMoreSpecific(RisWhoisLookupTrie):
     """Lookup more or equally specific elements."""
 
     def lookup(self, prefix) -> Generator[ExpandedRisEntry, None, None]:
-        # We _could_ cannonicalise the prefix here, for example changing '::' to '::/128' by using str(IPNetwork(..))
-        resource = netaddr.IPSet(netaddr.IPNetwork(prefix))
-        trie = self._trie(prefix)
+        return self.entries.lookup(prefix)
+
+    def lookup_many(self, prefixes: Iterable[str]) -> pd.DataFrame:
+        """See `RisWhoisMoreSpecificIndex.lookup_many`."""
+        return self.entries.lookup_many(prefixes)
 
-        keys = [trie.get_key(str(prefix))]
-        # Gather the more specifics
-        while keys:
-            key = keys.pop()
-            # Do not include children of elements that are not in the resource
-            # (it would be a less specific).
-            if not resource.issuperset(netaddr.IPSet(netaddr.IPNetwork(key))):
-                continue
 
-            child_keys = list(trie.children(key))
-            keys.extend(child_keys)
+class RisWhoisLookupMoreLessSpecific(RisWhoisLookupMoreSpecific):
+    """Lookup more or equally specific elements, and less specific elements."""
 
-            # do not yield None elements
-            elem = trie[key]
-            if elem is not None:
-                yield from elem
+    def lookup(self, prefix) -> Generator[ExpandedRisEntry, None, None]:
+        # We _could_ cannonicalise the prefix here, for example changing '::' to '::/128' by using str(IPNetwork(..))
+        yield from super().lookup(prefix)
 
         # exact match + less specific
+        trie = self._trie(prefix)
         key = trie.get_key(str(prefix))
         while key is not None:
-            yield from trie[key]
+            yield from self._entries(key)
             key = trie.parent(key)
+
+
+DELEGATION_RELATIONS = ["exact", "covered", "covering", "overlapping"]
+
+
+def join_delegations(
+    announcements: pd.DataFrame, delegated: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Join announcements with the delegated IP resources that they overlap.
+
+    Returns a row per pair with the index labels of the `announcement` and the
+    `delegation`, and the `relation` of the announcement to the delegation:
+    `exact`, `covered` (more specific), `covering` (less specific), or
+    `overlapping` for IPv4 delegations that are not a prefix.
+
+    This is a sort-merge join over the announcements sorted by first address:
+    the announcements that start inside a delegation are a range scan, those that
+    start before it contain its first address and are matched per prefix length.
+    """
+    assert set(delegated.keys()) >= set(["afi", "raw_resource", "length"])
+    ranges = resource_ranges(delegated)
+    bounds = prefix_bounds(announcements)
+    order = np.lexsort((bounds.length, bounds.first_lo, bounds.first_hi, bounds.afi))
+    bounds = PrefixBounds(*(field[order] for field in bounds))
+
+    pairs: list[tuple[np.ndarray, np.ndarray]] = []
+    for afi in (AFI_IPV4, AFI_IPV6):
+        lo = int(np.searchsorted(bounds.afi, afi, side="left"))
+        hi = int(np.searchsorted(bounds.afi, afi, side="right"))
+        queries = np.flatnonzero(ranges.afi == afi)
+        if lo == hi or not len(queries):
+            continue
+        first = (ranges.first_hi[queries], ranges.first_lo[queries])
+
+        table = (bounds.first_hi[lo:hi], bounds.first_lo[lo:hi])
+        start = searchsorted(*table, *first, side="left")
+        end = searchsorted(
+            *table, ranges.last_hi[queries], ranges.last_lo[queries], side="right"
+        )
+        idx, pos = _expand_ranges(start, end)
+        pairs.append((queries[idx], lo + pos))
+
+        for length in np.unique(bounds.length[lo:hi]):
+            level = lo + np.flatnonzero(bounds.length[lo:hi] == length)
+            network = truncate(afi, *first, length)
+            before = np.flatnonzero(less(*network, *first))
+            table = (bounds.first_hi[level], bounds.first_lo[level])
+            start = searchsorted(
+                *table, network[0][before], network[1][before], side="left"
+            )
+            end = searchsorted(
+                *table, network[0][before], network[1][before], side="right"
+            )
+            idx, pos = _expand_ranges(start, end)
+            pairs.append((queries[before[idx]], level[pos]))
+
+    delegation = np.concatenate([d for d, _ in pairs] + [np.zeros(0, dtype=np.int64)])
+    announcement = np.concatenate([a for _, a in pairs] + [np.zeros(0, dtype=np.int64)])
+
+    starts_before = less(
+        bounds.first_hi[announcement],
+        bounds.first_lo[announcement],
+        ranges.first_hi[delegation],
+        ranges.first_lo[delegation],
+    )
+    starts_after = less(
+        ranges.first_hi[delegation],
+        ranges.first_lo[delegation],
+        bounds.first_hi[announcement],
+        bounds.first_lo[announcement],
+    )
+    ends_before = less(
+        bounds.last_hi[announcement],
+        bounds.last_lo[announcement],
+        ranges.last_hi[delegation],
+        ranges.last_lo[delegation],
+    )
+    ends_after = less(
+        ranges.last_hi[delegation],
+        ranges.last_lo[delegation],
+        bounds.last_hi[announcement],
+        bounds.last_lo[announcement],
+    )
+    inside = ~starts_before & ~ends_after
+    contains = ~starts_after & ~ends_before
+    relation = np.select(
+        [inside & contains, inside, contains],
+        [0, 1, 2],
+        default=3,
+    )
+
+    # by delegation, then by address
+    result_order = np.lexsort((announcement, delegation))
+    return pd.DataFrame(
+        {
+            "announcement": announcements.index[order[announcement[result_order]]],
+            "delegation": delegated.index[delegation[result_order]],
+            "relation": pd.Categorical.from_codes(
+                relation[result_order], categories=DELEGATION_RELATIONS
+            ),
+        }
+    )
+
+
+class AddressRanges(NamedTuple):
+    """Sorted, disjoint [first, last] address ranges of one address family."""
+
+    first_hi: np.ndarray
+    first_lo: np.ndarray
+    last_hi: np.ndarray
+    last_lo: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.first_hi)
+
+
+def _empty_ranges() -> AddressRanges:
+    return AddressRanges(*(np.zeros(0, dtype=np.uint64) for _ in range(4)))
+
+
+def _merge(ranges: AddressRanges) -> AddressRanges:
+    """Merge overlapping and adjacent ranges."""
+    if not len(ranges):
+        return _empty_ranges()
+    order = np.lexsort((ranges.first_lo, ranges.first_hi))
+    first_hi, first_lo = ranges.first_hi[order], ranges.first_lo[order]
+    last_hi, last_lo = ranges.last_hi[order], ranges.last_lo[order]
+
+    # running maximum of the last address, on the rank of the last addresses
+    by_last = np.lexsort((last_lo, last_hi))
+    rank = np.empty(len(by_last), dtype=np.int64)
+    rank[by_last] = np.arange(len(by_last))
+    reach = by_last[np.maximum.accumulate(rank)]
+    reach_hi, reach_lo = last_hi[reach], last_lo[reach]
+
+    # a range starts a new one if there is a gap with all the ranges before it
+    before_hi, before_lo = decrement(first_hi[1:], first_lo[1:])
+    starts = np.concatenate(
+        [
+            [True],
+            less(reach_hi[:-1], reach_lo[:-1], before_hi, before_lo)
+            & ((first_hi[1:] != 0) | (first_lo[1:] != 0)),
+        ]
+    )
+    ends = np.append(starts[1:], True)
+    return AddressRanges(
+        first_hi[starts], first_lo[starts], reach_hi[ends], reach_lo[ends]
+    )
+
+
+def _overlaps(lhs: AddressRanges, rhs: AddressRanges) -> tuple[np.ndarray, np.ndarray]:
+    """The (lhs, rhs) index pairs of overlapping ranges, rhs must be disjoint."""
+    # the rhs ranges that end after a lhs range starts, and start before it ends
+    start = searchsorted(rhs.last_hi, rhs.last_lo, lhs.first_hi, lhs.first_lo)
+    end = searchsorted(
+        rhs.first_hi, rhs.first_lo, lhs.last_hi, lhs.last_lo, side="right"
+    )
+    return _expand_ranges(start, end)
+
+
+def _clip(
+    lhs: AddressRanges, rhs: AddressRanges, idx: np.ndarray, pos: np.ndarray
+) -> AddressRanges:
+    """The intersection of the overlapping ranges lhs[idx] and rhs[pos]."""
+    return AddressRanges(
+        *maximum(
+            lhs.first_hi[idx], lhs.first_lo[idx], rhs.first_hi[pos], rhs.first_lo[pos]
+        ),
+        *minimum(
+            lhs.last_hi[idx], lhs.last_lo[idx], rhs.last_hi[pos], rhs.last_lo[pos]
+        ),
+    )
+
+
+def _intersection(lhs: AddressRanges, rhs: AddressRanges) -> AddressRanges:
+    return _clip(lhs, rhs, *_overlaps(lhs, rhs))
+
+
+def _complement(ranges: AddressRanges, afi: int) -> AddressRanges:
+    last_hi, last_lo = host_masks(afi, 0)
+    if not len(ranges):
+        return AddressRanges(
+            np.zeros(1, dtype=np.uint64),
+            np.zeros(1, dtype=np.uint64),
+            last_hi[None],
+            last_lo[None],
+        )
+    # the gaps before, between, and after the ranges
+    gaps = AddressRanges(
+        *(
+            np.concatenate([[np.uint64(0)], value])
+            for value in increment(ranges.last_hi, ranges.last_lo)
+        ),
+        *(
+            np.concatenate([value, [bound]])
+            for value, bound in zip(
+                decrement(ranges.first_hi, ranges.first_lo), [last_hi, last_lo]
+            )
+        ),
+    )
+    present = np.ones(len(gaps), dtype=bool)
+    present[0] = ranges.first_hi[0] != 0 or ranges.first_lo[0] != 0
+    present[-1] = ranges.last_hi[-1] != last_hi or ranges.last_lo[-1] != last_lo
+    return AddressRanges(*(value[present] for value in gaps))
+
+
+def _total(hi: np.ndarray, lo: np.ndarray) -> int:
+    """The sum of 128 bit values, summed in 32 bit parts to not overflow."""
+    low = np.uint64(0xFFFF_FFFF)
+    res = 0
+    for shift, value in [(96, hi >> 32), (64, hi & low), (32, lo >> 32), (0, lo & low)]:
+        res += int(value.sum(dtype=np.uint64)) << shift
+    return res
+
+
+def _sizes(
+    first_hi: np.ndarray, first_lo: np.ndarray, last_hi: np.ndarray, last_lo: np.ndarray
+) -> np.ndarray:
+    """The number of addresses in ranges, as float."""
+    borrow = (last_lo < first_lo).astype(np.uint64)
+    return (last_hi - first_hi - borrow) * 2.0**64 + (last_lo - first_lo) + 1.0
+
+
+class AddressSpace:
+    """
+    A set of addresses, as sorted and merged address ranges per address family.
+
+    Replaces `netaddr.IPSet` for large sets, e.g. all the announced address space
+    in a RIS dump: set operations and sizes work on all the ranges at once. Ranges
+    include their last address, so that ::/0 fits in 128 bits.
+    """
+
+    ranges: dict[int, AddressRanges]
+
+    def __init__(self, ranges: dict[int, AddressRanges]) -> None:
+        """Build from ranges per afi, these do not need to be sorted or merged."""
+        self.ranges = {
+            afi: _merge(ranges.get(afi, _empty_ranges()))
+            for afi in (AFI_IPV4, AFI_IPV6)
+        }
+
+    @classmethod
+    def from_prefixes(cls, prefixes: Iterable[str] | PrefixBounds) -> Self:
+        """The addresses in the prefixes (or their `PrefixBounds`)."""
+        bounds = (
+            prefixes if isinstance(prefixes, PrefixBounds) else parse_prefixes(prefixes)
+        )
+        return cls(
+            {
+                afi: AddressRanges(
+                    bounds.first_hi[is_afi],
+                    bounds.first_lo[is_afi],
+                    bounds.last_hi[is_afi],
+                    bounds.last_lo[is_afi],
+                )
+                for afi in (AFI_IPV4, AFI_IPV6)
+                if (is_afi := bounds.afi == afi).any()
+            }
+        )
+
+    def __len__(self) -> int:
+        """The number of ranges."""
+        return sum(len(ranges) for ranges in self.ranges.values())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, AddressSpace):
+            return NotImplemented
+        return all(
+            all(
+                np.array_equal(lhs, rhs)
+                for lhs, rhs in zip(self.ranges[afi], other.ranges[afi])
+            )
+            for afi in self.ranges
+        )
+
+    def size(self, afi: Optional[int] = None) -> int:
+        """The number of addresses (of an address family)."""
+        return sum(
+            _total(ranges.last_hi, ranges.last_lo)
+            - _total(ranges.first_hi, ranges.first_lo)
+            + len(ranges)
+            for ranges_afi, ranges in self.ranges.items()
+            if afi is None or ranges_afi == afi
+        )
+
+    def __or__(self, other: "AddressSpace") -> "AddressSpace":
+        return AddressSpace(
+            {
+                afi: AddressRanges(
+                    *(
+                        np.concatenate([lhs, rhs])
+                        for lhs, rhs in zip(ranges, other.ranges[afi])
+                    )
+                )
+                for afi, ranges in self.ranges.items()
+            }
+        )
+
+    def __and__(self, other: "AddressSpace") -> "AddressSpace":
+        return AddressSpace(
+            {
+                afi: _intersection(ranges, other.ranges[afi])
+                for afi, ranges in self.ranges.items()
+            }
+        )
+
+    def __sub__(self, other: "AddressSpace") -> "AddressSpace":
+        return AddressSpace(
+            {
+                afi: _intersection(ranges, _complement(other.ranges[afi], afi))
+                for afi, ranges in self.ranges.items()
+            }
+        )
+
+    def union(self, other: "AddressSpace") -> "AddressSpace":
+        return self | other
+
+    def intersection(self, other: "AddressSpace") -> "AddressSpace":
+        return self & other
+
+    def difference(self, other: "AddressSpace") -> "AddressSpace":
+        return self - other
+
+    def fraction(self, prefixes: Iterable[str] | PrefixBounds) -> np.ndarray:
+        """The fraction of the addresses of each prefix that are in the set."""
+        bounds = (
+            prefixes if isinstance(prefixes, PrefixBounds) else parse_prefixes(prefixes)
+        )
+        covered = np.zeros(len(bounds), dtype=np.float64)
+        for afi, ranges in self.ranges.items():
+            queries = np.flatnonzero(bounds.afi == afi)
+            if not len(queries) or not len(ranges):
+                continue
+            query_ranges = AddressRanges(
+                bounds.first_hi[queries],
+                bounds.first_lo[queries],
+                bounds.last_hi[queries],
+                bounds.last_lo[queries],
+            )
+            idx, pos = _overlaps(query_ranges, ranges)
+            overlap = _clip(query_ranges, ranges, idx, pos)
+            covered[queries] = np.bincount(
+                idx, weights=_sizes(*overlap), minlength=len(queries)
+            )
+
+        host_bits = address_bits(bounds.afi).astype(np.int64) - bounds.length
+        return covered / np.exp2(host_bits)
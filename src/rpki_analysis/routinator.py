@@ -5,9 +5,16 @@ from typing import Generator
 import aiohttp
 import pandas as pd
 
+from rpki_analysis.prefixes import with_prefix_bounds
 
-def read_csv(buffer: Buffer) -> pd.DataFrame:
-    """Read routinator/rpki-client csv output into a dataframe"""
+
+def read_csv(buffer: Buffer, prefix_bounds: bool = False) -> pd.DataFrame:
+    """
+    Read routinator/rpki-client csv output into a dataframe
+
+    With `prefix_bounds` the integer encoding of the prefix is added as columns
+    (see `rpki_analysis.prefixes.with_prefix_bounds`).
+    """
     df = pd.read_csv(buffer).rename(
         columns={
             "ASN": "asn",
@@ -24,11 +31,12 @@ def read_csv(buffer: Buffer) -> pd.DataFrame:
 
     df["asn"] = df["asn"].str.replace("AS", "")
 
-    return df.astype({"asn": int, "max_length": int})
+    df = df.astype({"asn": int, "max_length": int})
+    return with_prefix_bounds(df) if prefix_bounds else df
 
 
-def read_csvext(buffer: Buffer) -> pd.DataFrame:
-    """Read routinator csvext output into a dataframe"""
+def read_csvext(buffer: Buffer, prefix_bounds: bool = False) -> pd.DataFrame:
+    """Read routinator csvext output into a dataframe, see `read_csv`"""
     df = pd.read_csv(buffer).rename(
         columns={
             "URI": "uri",
@@ -41,7 +49,8 @@ def read_csvext(buffer: Buffer) -> pd.DataFrame:
     )
     df["asn"] = df["asn"].str.replace("AS", "")
 
-    return df.astype({"asn": int, "max_length": int})
+    df = df.astype({"asn": int, "max_length": int})
+    return with_prefix_bounds(df) if prefix_bounds else df
 
 
 async def read_csvext_url(url: str) -> pd.DataFrame:
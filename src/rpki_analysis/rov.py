@@ -1,16 +1,57 @@
+import bisect
 import ipaddress
 import logging
-from typing import Generator, Literal, NamedTuple, Optional, Protocol, Set, Union
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import (
+    Callable,
+    Generator,
+    Hashable,
+    Iterable,
+    Literal,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Self,
+    Set,
+    Union,
+)
 
 import netaddr
+import numpy as np
 import pandas as pd
+import polars as pl
 import pytricia
 
+from rpki_analysis.datastructures import freeze_trie, load_arrays, save_arrays
+from rpki_analysis.origins import encode_origins
+from rpki_analysis.prefixes import (
+    AFI_IPV6,
+    PrefixBounds,
+    parse_prefix,
+    parse_prefixes,
+    prefix_bounds,
+    searchsorted,
+    truncate,
+)
+
 LOG = logging.getLogger(__name__)
 LOG.setLevel(logging.DEBUG)
 
 
 PrefixType = Union[str, ipaddress.IPv4Network, ipaddress.IPv6Network, netaddr.IPNetwork]
+FrameType = Union[pd.DataFrame, pl.DataFrame]
+
+ROV_STATES = ["valid", "invalid", "unknown"]
+# Why an announcement is invalid: no covering VRP for the origin AS, or only
+# covering VRPs for the origin AS with a max length below the prefix length.
+ROV_REASONS = ["as-mismatch", "length-exceeded"]
 
 
 class ValidatedRoaPayload(Protocol):
@@ -22,7 +63,12 @@ class ValidatedRoaPayload(Protocol):
 
 
 class Announcement(Protocol):
-    """The shape of a BGP announcement (or RIS entry)."""
+    """
+    The shape of a BGP announcement (or RIS entry).
+
+    Announcements may also have the integer `origin_asn` and `origin_as_set` of
+    `rpki_analysis.origins.encode_origins`, these are used when present.
+    """
 
     """The origin, without 'AS' prefix, but potentially as a AS set."""
     prefix: str
@@ -30,6 +76,17 @@ class Announcement(Protocol):
     prefix_length: int
 
 
+def _announcement_asn(announcement: Announcement) -> int:
+    """The origin ASN, -1 for origins that can not match a VRP (e.g. AS sets)."""
+    asn = getattr(announcement, "origin_asn", None)
+    if asn is not None:
+        return -1 if getattr(announcement, "origin_as_set", False) else int(asn)
+    origin = announcement.origin
+    if isinstance(origin, (int, np.integer)):
+        return int(origin)
+    return int(origin) if str(origin).isdigit() else -1
+
+
 class RouteOriginAuthorization(NamedTuple):
     """A ROA"""
 
@@ -49,10 +106,14 @@ class RouteOriginAuthorizationLookup:
 
     To lookup all applicable ROAs for a value, first retrieve the most specific entry,
     followed by looking up the parents.
+
+    A frozen lookup (`freeze`) can be shared by threads, use `copy` to apply a
+    diff while it is in use (see `rpki_analysis.datastructures.SwappableLookup`).
     """
 
     trie4: pytricia.PyTricia
     trie6: pytricia.PyTricia
+    __frozen: bool = False
 
     def __init__(self, data: pd.DataFrame) -> None:
         # expected columns
@@ -84,6 +145,67 @@ class RouteOriginAuthorizationLookup:
             )
         )
 
+    def __remove(self, row: ValidatedRoaPayload) -> None:
+        trie = self.__trie(row.prefix)
+        if trie.has_key(row.prefix):  # noqa: W601
+            vrps = trie[row.prefix]
+            vrps.discard(
+                RouteOriginAuthorization(
+                    row.asn,
+                    row.prefix,
+                    row.max_length,
+                    getattr(row, "prefix_length", None),
+                )
+            )
+            if not vrps:
+                trie.delete(row.prefix)
+
+    def apply_diff(self, added: FrameType, removed: FrameType) -> None:
+        """
+        Update the lookup in place with the VRPs added and removed between two
+        snapshots (see `vrp_diff`), instead of building a new lookup.
+        """
+        if self.__frozen:
+            raise ValueError("The lookup is frozen, apply the diff to a copy")
+        # vrp_diff of polars snapshots gives polars frames
+        added, removed = (
+            diff.to_pandas() if isinstance(diff, pl.DataFrame) else diff
+            for diff in (added, removed)
+        )
+        for diff in [added, removed]:
+            assert set(diff.keys()) >= set(["asn", "prefix", "max_length"])
+            assert diff.asn.dtype == int
+
+        if len(removed):
+            removed.apply(self.__remove, axis=1)
+        if len(added):
+            added.apply(self.__build_trie, axis=1)
+
+    @property
+    def frozen(self) -> bool:
+        return self.__frozen
+
+    def freeze(self) -> Self:
+        """
+        Make the lookup immutable so threads can share it: the VRPs of a prefix
+        become a frozenset, modifying the tries and `apply_diff` fail. Returns the
+        lookup.
+        """
+        freeze_trie(self.trie4)
+        freeze_trie(self.trie6)
+        self.__frozen = True
+        return self
+
+    def copy(self) -> "RouteOriginAuthorizationLookup":
+        """A mutable copy of the lookup."""
+        lookup = self.__class__.__new__(self.__class__)
+        lookup.trie4 = pytricia.PyTricia(32)
+        lookup.trie6 = pytricia.PyTricia(128)
+        for source, target in [(self.trie4, lookup.trie4), (self.trie6, lookup.trie6)]:
+            for key in source:
+                target[key] = set(source[key])
+        return lookup
+
     def __contains__(self, prefix: PrefixType) -> bool:
         return prefix in self.__trie(str(prefix))
 
@@ -123,14 +245,14 @@ def rov_validity(
     #    prefix in the route.  This selection forms the set of
     #    "candidate ROAs".
     vrp: Optional[RouteOriginAuthorization] = None
+    # announcement entries may have a string origin, but the lookup has int
+    origin = _announcement_asn(announcement)
     # Lookup only returns objects that have a identical or less specific prefix.
     for vrp in lookup.lookup(announcement.prefix):
         # 3. If the route's origin AS can be determined and any of the set
         #    of candidate ROAs has an asID value that matches the origin AS
         #    in the route, and
-
-        # announcement entries may have a string origin, but the lookup has int
-        if str(vrp.asn) == str(announcement.origin):
+        if vrp.asn == origin:
             #    the route's address prefix matches a ROAIPAddress in the ROA
             #
             #    (where "match" is defined as where the route's address precisely
@@ -165,9 +287,10 @@ def rov_validity_verbose(
     if not roas:
         return "unknown"
     was_valid = False
+    origin = _announcement_asn(announcement)
     for roa in roas:
         print(roa)
-        if roa.asn != announcement.origin:
+        if roa.asn != origin:
             LOG.info(
                 "invalid as: %s ris origin: %d for %s",
                 roa,
@@ -175,7 +298,13 @@ def rov_validity_verbose(
                 announcement.prefix,
             )
         else:
-            assert roa.prefix_length <= announcement.prefix_length
+            # prefix_length is None for VRPs that were read without it
+            roa_length = (
+                roa.prefix_length
+                if roa.prefix_length is not None
+                else ipaddress.ip_network(roa.prefix).prefixlen
+            )
+            assert roa_length <= announcement.prefix_length
             if roa.max_length >= announcement.prefix_length:
                 LOG.info(
                     "valid roa: %s for %s announced by %s",
@@ -192,3 +321,1061 @@ def rov_validity_verbose(
                 )
 
     return "valid" if was_valid else "invalid"
+
+
+class CompactRouteOriginAuthorizationLookup:
+    """
+    Lookup for VRPs backed by parallel numpy arrays instead of a patricia trie.
+
+    Has the same `lookup`, `__getitem__` and `__contains__` API as
+    `RouteOriginAuthorizationLookup` at a fraction of the memory, and can
+    validate a whole frame of announcements at once (`rov_validity_batch`). A
+    built lookup can be stored with `save` and memory mapped with `load`.
+
+    The distinct VRP prefixes ("nodes") are sorted by (afi, prefix length, first
+    address), so the nodes of one prefix length are a contiguous "level". The VRPs
+    of node `i` are `offsets[i]:offsets[i + 1]`, sorted by (asn, max length
+    descending). Each VRP is keyed on `node << 32 | asn`.
+
+    A covering VRP prefix of a prefix has to be the prefix truncated to the length
+    of a level, so a lookup is one binary search per level.
+
+    The VRPs from `lookup` have the prefix in normalized form, as `ipaddress`
+    formats it, not the prefix string of the input.
+    """
+
+    node_afi: np.ndarray
+    node_length: np.ndarray
+    node_hi: np.ndarray
+    node_lo: np.ndarray
+    offsets: np.ndarray
+    key: np.ndarray
+    max_length: np.ndarray
+    has_prefix_length: bool
+    # built on first use by scalar lookups
+    __addresses: Optional[list[list[int]]] = None
+    __prefixes: Optional[dict[int, str]] = None
+
+    def __init__(self, data: FrameType) -> None:
+        # expected columns
+        assert set(data.columns) >= set(["asn", "prefix", "max_length"])
+        # Like RouteOriginAuthorizationLookup, only set prefix_length when present
+        self.has_prefix_length = "prefix_length" in data.columns
+        self._build(
+            prefix_bounds(data),
+            np.asarray(data["asn"], dtype=np.uint64),
+            np.asarray(data["max_length"], dtype=np.int64),
+        )
+
+    def _build(
+        self, bounds: PrefixBounds, asn: np.ndarray, max_length: np.ndarray
+    ) -> np.ndarray:
+        """Build the arrays, returns the index of the VRP of every input row."""
+        order = np.lexsort(
+            (
+                -max_length,
+                asn,
+                bounds.first_lo,
+                bounds.first_hi,
+                bounds.length,
+                bounds.afi,
+            )
+        )
+        afi, length = bounds.afi[order], bounds.length[order]
+        hi, lo = bounds.first_hi[order], bounds.first_lo[order]
+        asn, max_length = asn[order], max_length[order]
+
+        new_node = np.ones(len(order), dtype=bool)
+        new_node[1:] = (
+            (np.diff(afi) != 0)
+            | (np.diff(length) != 0)
+            | (hi[1:] != hi[:-1])
+            | (lo[1:] != lo[:-1])
+        )
+        # Like the sets in the trie based lookup, keep one of each duplicate VRP
+        distinct = new_node.copy()
+        distinct[1:] |= (asn[1:] != asn[:-1]) | (max_length[1:] != max_length[:-1])
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.cumsum(distinct) - 1
+
+        afi, length, hi, lo = (
+            afi[distinct],
+            length[distinct],
+            hi[distinct],
+            lo[distinct],
+        )
+        asn, max_length, new_node = (
+            asn[distinct],
+            max_length[distinct],
+            new_node[distinct],
+        )
+
+        node_start = np.flatnonzero(new_node)
+        self.node_afi = afi[node_start]
+        self.node_length = length[node_start]
+        self.node_hi = hi[node_start]
+        self.node_lo = lo[node_start]
+        self.offsets = np.append(node_start, len(new_node))
+
+        node = np.cumsum(new_node) - 1
+        self.key = (node.astype(np.uint64) << np.uint64(32)) | asn
+        self.max_length = max_length.astype(np.uint8)
+
+        self._init_levels()
+        return positions
+
+    _ARRAYS = [
+        "node_afi",
+        "node_length",
+        "node_hi",
+        "node_lo",
+        "offsets",
+        "key",
+        "max_length",
+    ]
+
+    def save(self, path: str | Path) -> None:
+        """Store the lookup in a single file that `load` memory maps."""
+        save_arrays(
+            path,
+            {name: getattr(self, name) for name in self._ARRAYS},
+            {"has_prefix_length": self.has_prefix_length, "levels": self.levels},
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """
+        Open a lookup stored with `save` without parsing or rebuilding it.
+
+        The arrays are read-only views on a memory map of the file, so loading
+        takes milliseconds and worker processes that load the same file share
+        its pages.
+        """
+        arrays, metadata = load_arrays(path)
+        lookup = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(lookup, name, arrays[name])
+        lookup.has_prefix_length = metadata["has_prefix_length"]
+        lookup.levels = [tuple(level) for level in metadata["levels"]]
+        return lookup
+
+    def _init_levels(self) -> None:
+        """(afi, prefix length, first node, end node) of each level."""
+        self.__addresses = None
+        self.__prefixes = None
+        new_level = np.ones(len(self.node_afi), dtype=bool)
+        new_level[1:] = (np.diff(self.node_afi) != 0) | (np.diff(self.node_length) != 0)
+        level_start = np.flatnonzero(new_level)
+        self.levels = list(
+            zip(
+                self.node_afi[level_start].tolist(),
+                self.node_length[level_start].tolist(),
+                level_start.tolist(),
+                np.append(level_start[1:], len(self.node_afi)).tolist(),
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.key)
+
+    @property
+    def frozen(self) -> bool:
+        return not any(getattr(self, name).flags.writeable for name in self._ARRAYS)
+
+    def freeze(self) -> Self:
+        """Make the arrays read-only (as after `load`), returns the lookup."""
+        for name in self._ARRAYS:
+            getattr(self, name).flags.writeable = False
+        return self
+
+    def __level_addresses(self) -> list[list[int]]:
+        """
+        The first addresses of the nodes of every level as Python ints, for
+        `bisect` in scalar lookups. Built on first use.
+        """
+        if self.__addresses is None:
+            self.__addresses = [
+                (
+                    self.node_lo[start:end].tolist()
+                    if afi != AFI_IPV6
+                    else [
+                        hi << 64 | lo
+                        for hi, lo in zip(
+                            self.node_hi[start:end].tolist(),
+                            self.node_lo[start:end].tolist(),
+                        )
+                    ]
+                )
+                for afi, _, start, end in self.levels
+            ]
+        return self.__addresses
+
+    def __covering_nodes(self, prefix: PrefixType) -> Generator[int, None, None]:
+        """The nodes for prefix and all less specifics, most specific first."""
+        afi, address, _, prefix_length = parse_prefix(prefix)
+        addresses = self.__level_addresses()
+        bits = 128 if afi == AFI_IPV6 else 32
+
+        # only the levels of the afi that are not more specific than the prefix
+        start = bisect.bisect_left(self.levels, (afi,))
+        end = bisect.bisect_left(self.levels, (afi, prefix_length + 1))
+        for level in reversed(range(start, end)):
+            host_bits = bits - self.levels[level][1]
+            truncated = address >> host_bits << host_bits
+            nodes = addresses[level]
+            idx = bisect.bisect_left(nodes, truncated)
+            if idx < len(nodes) and nodes[idx] == truncated:
+                yield self.levels[level][2] + idx
+
+    def _node_prefix(self, node: int) -> str:
+        """
+        The prefix of a node in normalized form (as `ipaddress` formats it),
+        which can differ from the prefix string of the VRP that was loaded.
+        Formatted prefixes are cached for scalar lookups.
+        """
+        if self.__prefixes is None:
+            self.__prefixes = {}
+        prefix = self.__prefixes.get(node)
+        if prefix is None:
+            address = (int(self.node_hi[node]) << 64) | int(self.node_lo[node])
+            prefix = self.__prefixes[node] = str(
+                ipaddress.ip_network((address, int(self.node_length[node])))
+                if self.node_afi[node] == AFI_IPV6
+                else ipaddress.IPv4Network((address, int(self.node_length[node])))
+            )
+        return prefix
+
+    def __contains__(self, prefix: PrefixType) -> bool:
+        return next(self.__covering_nodes(prefix), None) is not None
+
+    def __getitem__(self, prefix: PrefixType) -> Set[RouteOriginAuthorization]:
+        return set(self.lookup(prefix))
+
+    def lookup(
+        self, prefix: PrefixType
+    ) -> Generator[RouteOriginAuthorization, None, None]:
+        """Lookup VRPs for prefix and all less specifics."""
+        for node in self.__covering_nodes(prefix):
+            vrp_prefix = self._node_prefix(node)
+            prefix_length = (
+                int(self.node_length[node]) if self.has_prefix_length else None
+            )
+            start, end = self.offsets[node : node + 2].tolist()
+            for key, max_length in zip(
+                self.key[start:end].tolist(), self.max_length[start:end].tolist()
+            ):
+                yield RouteOriginAuthorization(
+                    key & 0xFFFF_FFFF, vrp_prefix, max_length, prefix_length
+                )
+
+    def _covering(
+        self, bounds: PrefixBounds
+    ) -> Generator[tuple[int, np.ndarray, np.ndarray], None, None]:
+        """
+        (level prefix length, announcements, node) for every covering node.
+
+        Yields per level the indices of the announcements in `bounds` that have a
+        covering VRP prefix in the level and the node of that prefix.
+        """
+        for afi, length, start, end in self.levels:
+            candidates = np.flatnonzero((bounds.afi == afi) & (bounds.length >= length))
+            hi, lo = truncate(
+                afi, bounds.first_hi[candidates], bounds.first_lo[candidates], length
+            )
+            idx = start + searchsorted(
+                self.node_hi[start:end], self.node_lo[start:end], hi, lo
+            )
+            idx = np.minimum(idx, end - 1)
+            found = (self.node_hi[idx] == hi) & (self.node_lo[idx] == lo)
+            yield length, candidates[found], idx[found]
+
+    def validity(self, bounds: PrefixBounds, origin: np.ndarray) -> np.ndarray:
+        """The index into `ROV_STATES` for every announcement."""
+        covered = np.zeros(len(bounds), dtype=bool)
+        valid = np.zeros(len(bounds), dtype=bool)
+
+        for length, candidates, idx in self._covering(bounds):
+            covered[candidates] = True
+
+            # The first VRP for (node, asn) has the largest max length
+            key = (idx.astype(np.uint64) << np.uint64(32)) | origin[candidates].astype(
+                np.uint64
+            )
+            pos = np.minimum(np.searchsorted(self.key, key), len(self.key) - 1)
+            announced_length = bounds.length[candidates]
+            matches = (
+                (origin[candidates] >= 0)
+                & (self.key[pos] == key)
+                & (
+                    (self.max_length[pos] >= announced_length)
+                    | (announced_length == length)
+                )
+            )
+            valid[candidates[matches]] = True
+
+        return np.where(valid, 0, np.where(covered, 1, 2)).astype(np.int8)
+
+    def explain(
+        self, bounds: PrefixBounds, origin: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        `validity` with the reason for every announcement.
+
+        Returns (state, reason, vrp, covering): the index into `ROV_STATES`, the
+        index into `ROV_REASONS` (-1 if not invalid), the index of the VRP that
+        matches the origin AS (-1 if none; the most specific one) and the number
+        of covering VRPs.
+        """
+        covering = np.zeros(len(bounds), dtype=np.int64)
+        valid = np.full(len(bounds), -1, dtype=np.int64)
+        same_asn = np.full(len(bounds), -1, dtype=np.int64)
+
+        # levels are sorted from less to more specific, so the most specific
+        # VRP is the last one assigned
+        for length, candidates, idx in self._covering(bounds):
+            covering[candidates] += self.offsets[idx + 1] - self.offsets[idx]
+
+            key = (idx.astype(np.uint64) << np.uint64(32)) | origin[candidates].astype(
+                np.uint64
+            )
+            pos = np.minimum(np.searchsorted(self.key, key), len(self.key) - 1)
+            announced_length = bounds.length[candidates]
+            key_match = (origin[candidates] >= 0) & (self.key[pos] == key)
+            matches = key_match & (
+                (self.max_length[pos] >= announced_length)
+                | (announced_length == length)
+            )
+            same_asn[candidates[key_match]] = pos[key_match]
+            valid[candidates[matches]] = pos[matches]
+
+        state = np.where(valid >= 0, 0, np.where(covering > 0, 1, 2)).astype(np.int8)
+        reason = np.where(
+            state == 1,
+            np.where(same_asn >= 0, ROV_REASONS.index("length-exceeded"), 0),
+            -1,
+        ).astype(np.int8)
+        vrp = np.where(valid >= 0, valid, same_asn)
+        return state, reason, vrp, covering
+
+    def vrp_prefixes(self, vrp: np.ndarray) -> np.ndarray:
+        """The prefix (or None for -1) of VRPs by index, e.g. from `explain`."""
+        node = np.searchsorted(self.offsets, vrp, side="right") - 1
+        nodes, inverse = np.unique(node[vrp >= 0], return_inverse=True)
+        res = np.full(len(vrp), None, dtype=object)
+        res[vrp >= 0] = np.array(
+            [self._node_prefix(n) for n in nodes.tolist()], dtype=object
+        )[inverse]
+        return res
+
+
+def _origin_asns(origin: pd.Series | pl.Series) -> np.ndarray:
+    """Origins as integers, -1 for origins that can not match a VRP (e.g. AS sets)."""
+    asn, as_set = encode_origins(origin)
+    return np.where(as_set, -1, asn.astype(np.int64))
+
+
+def _announcement_asns(announcements: FrameType) -> np.ndarray:
+    """`_origin_asns`, from the encoded origin columns if present."""
+    if set(["origin_asn", "origin_as_set"]) <= set(announcements.columns):
+        return np.where(
+            np.asarray(announcements["origin_as_set"], dtype=bool),
+            -1,
+            np.asarray(announcements["origin_asn"], dtype=np.int64),
+        )
+    return _origin_asns(announcements["origin"])
+
+
+def rov_validity_batch(
+    announcements: FrameType, vrps: FrameType | CompactRouteOriginAuthorizationLookup
+) -> pd.Series | pl.Series:
+    """
+    Determine the ROA validation outcome of every (prefix, origin) in a frame.
+
+    Gives the same result as `rov_validity` for each row, but validates all rows
+    with vectorized searches over the VRPs sorted by integer prefix bounds. Pass a
+    `CompactRouteOriginAuthorizationLookup` to validate multiple frames against
+    the same VRPs without rebuilding the index. Returns a categorical series
+    (polars: enum) of `ROV_STATES` that matches the type and index of
+    `announcements`.
+    """
+    assert set(announcements.columns) >= set(["prefix", "origin"])
+
+    if not isinstance(vrps, CompactRouteOriginAuthorizationLookup):
+        vrps = CompactRouteOriginAuthorizationLookup(vrps)
+
+    states = vrps.validity(
+        prefix_bounds(announcements), _announcement_asns(announcements)
+    )
+    return _validity_series(announcements, states)
+
+
+def rov_validity_explain(
+    announcements: FrameType, vrps: FrameType | CompactRouteOriginAuthorizationLookup
+) -> pd.DataFrame | pl.DataFrame:
+    """
+    `rov_validity_batch` with the reason of every outcome as columns.
+
+    * `validity`: the outcome, as in `rov_validity_batch`
+    * `reason`: for invalids, "as-mismatch" when no covering VRP has the origin
+      AS, "length-exceeded" when the covering VRPs for the origin AS have a max
+      length below the prefix length (see `ROV_REASONS`)
+    * `matched_vrp`, `matched_max_length`: the prefix and max length of the VRP
+      for the origin AS that made the announcement valid, or the most specific
+      one that was too short
+    * `covering_vrps`: the number of VRPs for the prefix and less specifics
+
+    Returns a frame of the type (and index) of `announcements`.
+    """
+    assert set(announcements.columns) >= set(["prefix", "origin"])
+
+    if not isinstance(vrps, CompactRouteOriginAuthorizationLookup):
+        vrps = CompactRouteOriginAuthorizationLookup(vrps)
+
+    state, reason, vrp, covering = vrps.explain(
+        prefix_bounds(announcements), _announcement_asns(announcements)
+    )
+    # only index the matched VRPs, there may be none at all
+    max_length = np.full(len(vrp), None, dtype=object)
+    max_length[vrp >= 0] = vrps.max_length[vrp[vrp >= 0]]
+    columns = {
+        "validity": state,
+        "reason": np.array(ROV_REASONS + [None], dtype=object)[reason].tolist(),
+        "matched_vrp": vrps.vrp_prefixes(vrp).tolist(),
+        "matched_max_length": max_length.tolist(),
+        "covering_vrps": covering,
+    }
+
+    if isinstance(announcements, pl.DataFrame):
+        return pl.DataFrame(columns).cast(
+            {
+                "validity": pl.Enum(ROV_STATES),
+                "reason": pl.Enum(ROV_REASONS),
+                "matched_vrp": pl.Utf8,
+                "matched_max_length": pl.Int64,
+            }
+        )
+    return pd.DataFrame(
+        {
+            **columns,
+            "validity": pd.Categorical.from_codes(state, categories=ROV_STATES),
+            "reason": pd.Categorical.from_codes(reason, categories=ROV_REASONS),
+            "matched_max_length": pd.array(
+                columns["matched_max_length"], dtype="Int64"
+            ),
+        },
+        index=announcements.index,
+    )
+
+
+def _validity_series(
+    announcements: FrameType, states: np.ndarray
+) -> pd.Series | pl.Series:
+    """Series of `ROV_STATES` for the codes in `states`, like `announcements`."""
+    if isinstance(announcements, pl.DataFrame):
+        return pl.Series("validity", states).cast(pl.Enum(ROV_STATES))
+    return pd.Series(
+        pd.Categorical.from_codes(states, categories=ROV_STATES),
+        index=announcements.index,
+        name="validity",
+    )
+
+
+VRP_KEY = ["asn", "prefix", "max_length"]
+
+
+def _anti_join(left: FrameType, right: FrameType) -> FrameType:
+    """Rows of `left` without a VRP with the same `VRP_KEY` in `right`."""
+    if isinstance(left, pl.DataFrame):
+        return left.join(right.select(VRP_KEY).unique(), on=VRP_KEY, how="anti")
+    joined = left.merge(
+        right[VRP_KEY].drop_duplicates(), on=VRP_KEY, how="left", indicator=True
+    )
+    return left[(joined["_merge"] == "left_only").to_numpy()]
+
+
+def vrp_diff(before: FrameType, after: FrameType) -> tuple[FrameType, FrameType]:
+    """
+    The (added, removed) VRPs between two snapshots, e.g. from `read_csv` or
+    `read_dump`.
+
+    VRPs are compared on (asn, prefix, max_length). The added (removed) frame has
+    the rows of `after` (`before`) for VRPs that are not in the other snapshot.
+    """
+    for df in [before, after]:
+        assert set(df.columns) >= set(VRP_KEY)
+    return _anti_join(after, before), _anti_join(before, after)
+
+
+def affected_by_diff(
+    announcements: FrameType, added: FrameType, removed: FrameType
+) -> np.ndarray:
+    """
+    Mask of the announcements whose validity may change by a VRP diff.
+
+    Only announcements with a VRP in the diff for their prefix or a less specific
+    can change state.
+    """
+    assert set(announcements.columns) >= set(["prefix"])
+    diff = pd.concat(
+        [
+            df[VRP_KEY].to_pandas() if isinstance(df, pl.DataFrame) else df[VRP_KEY]
+            for df in [added, removed]
+        ]
+    )
+    if not len(diff):
+        return np.zeros(len(announcements), dtype=bool)
+
+    # every announcement with a covering VRP prefix is "invalid" for origin -1
+    states = CompactRouteOriginAuthorizationLookup(diff).validity(
+        prefix_bounds(announcements),
+        np.full(len(announcements), -1, dtype=np.int64),
+    )
+    return states != ROV_STATES.index("unknown")
+
+
+def rov_revalidate(
+    announcements: pd.DataFrame,
+    validity: pd.Series,
+    lookup: RouteOriginAuthorizationLookup,
+    added: pd.DataFrame,
+    removed: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Apply a VRP diff to `lookup` and re-validate the affected announcements.
+
+    `validity` is the previous outcome for the announcements (e.g. from
+    `rov_validity_batch`). Only announcements that are affected by the diff are
+    validated again, with `rov_validity_batch` against the VRPs that cover them.
+    Returns the announcements that changed state, with their
+    `validity_before` and `validity_after`.
+    """
+    assert set(announcements.columns) >= set(["prefix", "origin"])
+    assert len(validity) == len(announcements)
+    affected = announcements[affected_by_diff(announcements, added, removed)]
+    lookup.apply_diff(added, removed)
+
+    # validate against the VRPs that cover the affected prefixes after the diff
+    vrps = {
+        vrp for prefix in affected.prefix.unique() for vrp in lookup.lookup(str(prefix))
+    }
+    covering = pd.DataFrame(
+        {
+            "asn": [vrp.asn for vrp in vrps],
+            "prefix": [vrp.prefix for vrp in vrps],
+            "max_length": [vrp.max_length or 0 for vrp in vrps],
+        }
+    )
+    before = validity.loc[affected.index]
+    after = rov_validity_batch(affected, covering)
+    changed = (before.astype(str) != after.astype(str)).to_numpy()
+    return affected[changed].assign(
+        validity_before=before[changed], validity_after=after[changed]
+    )
+
+
+class CachedRovValidator:
+    """
+    Memoize ROV outcomes per (prefix, origin) in a bounded LRU cache.
+
+    Repeated (prefix, origin) pairs, within a RIS dump and across consecutive
+    dumps, are validated once. `update` switches to a new VRP snapshot and only
+    evicts the entries for prefixes that are affected by the diff between the
+    snapshots; all entries in the cache are for `snapshot`, which defaults to the
+    SHA-256 digest of the sorted distinct VRPs.
+
+    `hits` and `misses` count the (distinct per call) pairs that were or were not
+    in the cache.
+    """
+
+    snapshot: Hashable
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        vrps: FrameType,
+        snapshot: Optional[Hashable] = None,
+        maxsize: int = 1_000_000,
+    ) -> None:
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__cache: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self.__set_vrps(vrps, snapshot)
+
+    def __set_vrps(self, vrps: FrameType, snapshot: Optional[Hashable]) -> None:
+        assert set(vrps.columns) >= set(VRP_KEY)
+        self.__vrps = (
+            vrps if isinstance(vrps, pl.DataFrame) else pl.from_pandas(vrps[VRP_KEY])
+        ).select(
+            pl.col("asn").cast(pl.Int64),
+            pl.col("prefix").cast(pl.Utf8),
+            pl.col("max_length").cast(pl.Int64),
+        )
+        # By default a snapshot is identified by a digest of its (distinct) VRPs.
+        # Row hashes are not stable across polars versions and sums of them
+        # collide too easily.
+        self.snapshot = (
+            snapshot
+            if snapshot is not None
+            else sha256(
+                self.__vrps.unique().sort(VRP_KEY).write_csv().encode()
+            ).hexdigest()
+        )
+        self.__lookup = CompactRouteOriginAuthorizationLookup(self.__vrps)
+
+    def __len__(self) -> int:
+        return len(self.__cache)
+
+    def update(self, vrps: FrameType, snapshot: Optional[Hashable] = None) -> int:
+        """
+        Validate against a new VRP snapshot, returns the number of evicted entries.
+
+        Nothing is evicted when the snapshot is the current one.
+        """
+        previous, previous_snapshot = self.__vrps, self.snapshot
+        self.__set_vrps(vrps, snapshot)
+        if self.snapshot == previous_snapshot or not self.__cache:
+            return 0
+
+        added, removed = vrp_diff(previous, self.__vrps)
+        keys = list(self.__cache)
+        affected = affected_by_diff(
+            pl.DataFrame({"prefix": [prefix for prefix, _ in keys]}), added, removed
+        )
+        for idx in np.flatnonzero(affected).tolist():
+            del self.__cache[keys[idx]]
+        LOG.info(
+            "VRP snapshot %s: evicted %d of %d cached outcomes",
+            self.snapshot,
+            int(affected.sum()),
+            len(keys),
+        )
+        return int(affected.sum())
+
+    def validate(self, announcements: FrameType) -> pd.Series | pl.Series:
+        """Like `rov_validity_batch(announcements, vrps)`."""
+        assert set(announcements.columns) >= set(["prefix", "origin"])
+        frame = pl.DataFrame(
+            {
+                name: (
+                    announcements[name]
+                    if isinstance(announcements, pl.DataFrame)
+                    else pl.from_pandas(announcements[name].astype(str))
+                ).cast(pl.Utf8)
+                for name in ["prefix", "origin"]
+            }
+        )
+        # number the distinct pairs
+        code = (
+            frame.select(pl.struct("prefix", "origin").rank("dense").cast(pl.Int64) - 1)
+            .to_series()
+            .to_numpy()
+        )
+        distinct = (
+            frame.with_columns(code=code)
+            .unique("code")
+            .sort("code")
+            .select("prefix", "origin")
+            .rows()
+        )
+
+        states = np.empty(len(distinct), dtype=np.int8)
+        missing = []
+        for idx, key in enumerate(distinct):
+            state = self.__cache.get(key)
+            if state is None:
+                missing.append(idx)
+            else:
+                self.__cache.move_to_end(key)
+                states[idx] = state
+        self.hits += len(distinct) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            keys = [distinct[idx] for idx in missing]
+            validated = self.__lookup.validity(
+                parse_prefixes([prefix for prefix, _ in keys]),
+                _origin_asns(pl.Series([origin for _, origin in keys])),
+            )
+            states[missing] = validated
+            for key, state in zip(keys, validated.tolist()):
+                self.__cache[key] = state
+            while len(self.__cache) > self.maxsize:
+                self.__cache.popitem(last=False)
+
+        return _validity_series(announcements, states[code])
+
+
+def _timestamps(values: Iterable) -> np.ndarray:
+    """Timestamps as a numpy array, timezone aware timestamps as naive UTC."""
+    match values:
+        case pl.Series():
+            series = values
+        case pd.Series():
+            series = pl.from_pandas(values)
+        case _:
+            series = pl.Series(list(values))
+    if isinstance(series.dtype, pl.Datetime) and series.dtype.time_zone:
+        series = series.dt.convert_time_zone("UTC").dt.replace_time_zone(None)
+    return series.to_numpy()
+
+
+class RouteOriginAuthorizationHistory(CompactRouteOriginAuthorizationLookup):
+    """
+    VRPs of a series of snapshots, each VRP with the snapshots it was seen in.
+
+    Every distinct VRP is stored once, like in
+    `CompactRouteOriginAuthorizationLookup`, with its validity intervals: the
+    (first seen, last seen) snapshot of each run of consecutive snapshots that
+    contain it. This answers ROV at any point in time, or the full validity
+    timeline of an announcement, without building a lookup per snapshot.
+
+    A timestamp is validated against the latest snapshot at or before it; before
+    the first snapshot there are no VRPs. `lookup` and friends return the VRPs
+    of all snapshots.
+    """
+
+    snapshots: np.ndarray
+    interval_vrp: np.ndarray
+    interval_first: np.ndarray
+    interval_last: np.ndarray
+
+    _ARRAYS = CompactRouteOriginAuthorizationLookup._ARRAYS + [
+        "snapshots",
+        "interval_vrp",
+        "interval_first",
+        "interval_last",
+    ]
+
+    def __init__(self, data: FrameType, timestamp: str = "timestamp") -> None:
+        """
+        Build the history from the concatenated VRPs of all snapshots.
+
+        `timestamp` is the column that identifies the snapshot, e.g. the
+        generation or capture time.
+        """
+        # expected columns
+        assert set(data.columns) >= set(["asn", "prefix", "max_length", timestamp])
+        self.has_prefix_length = "prefix_length" in data.columns
+
+        frame = (
+            data
+            if isinstance(data, pl.DataFrame)
+            else pl.from_pandas(
+                data[["asn", "prefix", "max_length", timestamp]].astype({"prefix": str})
+            )
+        ).select(
+            pl.col("asn").cast(pl.Int64),
+            pl.col("prefix").cast(pl.Utf8),
+            pl.col("max_length").cast(pl.Int64),
+            pl.col(timestamp),
+        )
+        # Only parse each VRP once, not once per snapshot
+        distinct = (
+            frame.select("asn", "prefix", "max_length")
+            .unique(maintain_order=True)
+            .with_row_index("row")
+        )
+        row = (
+            frame.join(distinct, on=["asn", "prefix", "max_length"], how="left")
+            .get_column("row")
+            .to_numpy()
+        )
+        vrp = self._build(
+            parse_prefixes(distinct["prefix"]),
+            distinct["asn"].to_numpy().astype(np.uint64),
+            distinct["max_length"].to_numpy(),
+        )[row]
+
+        ts = _timestamps(frame[timestamp])
+        self.snapshots, snapshot = np.unique(ts, return_inverse=True)
+        seen = np.unique(vrp * len(self.snapshots) + snapshot)
+        vrp, snapshot = seen // len(self.snapshots), seen % len(self.snapshots)
+
+        # An interval starts at a new VRP or after a snapshot without the VRP
+        new_interval = np.ones(len(seen), dtype=bool)
+        new_interval[1:] = (np.diff(vrp) != 0) | (np.diff(snapshot) != 1)
+        interval_start = np.flatnonzero(new_interval)
+        interval_end = np.append(interval_start[1:], len(seen)) - 1
+        self.interval_vrp = vrp[interval_start]
+        self.interval_first = snapshot[interval_start]
+        self.interval_last = snapshot[interval_end]
+
+    def snapshot_index(self, timestamps: Iterable) -> np.ndarray:
+        """Index of the snapshot that is current at each timestamp, -1 if none."""
+        return (
+            np.searchsorted(self.snapshots, _timestamps(timestamps), side="right") - 1
+        )
+
+    def intervals(self) -> pd.DataFrame:
+        """Every VRP with the first and last snapshot of each validity interval."""
+        node = (self.key[self.interval_vrp] >> np.uint64(32)).astype(np.int64)
+        prefixes = pd.Series(
+            [self._node_prefix(n) for n in range(len(self.node_afi))]
+        ).iloc[node]
+        return pd.DataFrame(
+            {
+                "asn": (self.key[self.interval_vrp] & np.uint64(0xFFFF_FFFF)).astype(
+                    np.int64
+                ),
+                "prefix": prefixes.to_numpy(),
+                "max_length": self.max_length[self.interval_vrp].astype(np.int64),
+                "first_seen": self.snapshots[self.interval_first],
+                "last_seen": self.snapshots[self.interval_last],
+            }
+        )
+
+    def __any_interval(
+        self,
+        start: np.ndarray,
+        end: np.ndarray,
+        snapshot: np.ndarray,
+        accept: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Whether the intervals `start[i]:end[i]` contain one that contains
+        `snapshot[i]` and is accepted by `accept(interval, i)`.
+        """
+        res = np.zeros(len(start), dtype=bool)
+        rows = np.flatnonzero(start < end)
+        pos = start[rows]
+        # One step per interval: the ranges are short, except for nodes with
+        # many VRPs, and rows drop out as soon as they have a match
+        while len(rows):
+            hit = (
+                (self.interval_first[pos] <= snapshot[rows])
+                & (self.interval_last[pos] >= snapshot[rows])
+                & accept(pos, rows)
+            )
+            res[rows[hit]] = True
+            pos = pos + 1
+            keep = ~hit & (pos < end[rows])
+            rows, pos = rows[keep], pos[keep]
+        return res
+
+    def validity_at(
+        self, bounds: PrefixBounds, origin: np.ndarray, snapshot: np.ndarray
+    ) -> np.ndarray:
+        """The index into `ROV_STATES` for every announcement at its snapshot."""
+        covered = np.zeros(len(bounds), dtype=bool)
+        valid = np.zeros(len(bounds), dtype=bool)
+
+        for length, candidates, idx in self._covering(bounds):
+            at = snapshot[candidates]
+            # all intervals of the VRPs of the node
+            start = np.searchsorted(self.interval_vrp, self.offsets[idx])
+            end = np.searchsorted(self.interval_vrp, self.offsets[idx + 1])
+            covered[candidates] |= self.__any_interval(
+                start, end, at, lambda pos, rows: True
+            )
+
+            # the intervals of the VRPs for (node, origin)
+            key = (idx.astype(np.uint64) << np.uint64(32)) | origin[candidates].astype(
+                np.uint64
+            )
+            start = np.searchsorted(
+                self.interval_vrp, np.searchsorted(self.key, key, side="left")
+            )
+            end = np.where(
+                origin[candidates] >= 0,
+                np.searchsorted(
+                    self.interval_vrp, np.searchsorted(self.key, key, side="right")
+                ),
+                start,
+            )
+            announced_length = bounds.length[candidates]
+            valid[candidates] |= self.__any_interval(
+                start,
+                end,
+                at,
+                lambda pos, rows: (
+                    self.max_length[self.interval_vrp[pos]] >= announced_length[rows]
+                )
+                | (announced_length[rows] == length),
+            )
+
+        return np.where(valid, 0, np.where(covered, 1, 2)).astype(np.int8)
+
+    def rov_validity(
+        self, prefix: PrefixType, origin: int | str, timestamp
+    ) -> Literal["valid", "invalid", "unknown"]:
+        """ROA validation outcome of an announcement at `timestamp`."""
+        state = self.validity_at(
+            parse_prefixes([prefix]),
+            _origin_asns(pl.Series([str(origin)])),
+            self.snapshot_index([timestamp]),
+        )[0]
+        return ROV_STATES[state]  # type: ignore[return-value]
+
+    def timeline(self, prefix: PrefixType, origin: int | str) -> pd.DataFrame:
+        """
+        The ROA validation outcome of an announcement over time.
+
+        One row per run of snapshots with the same outcome, with the first and
+        last snapshot of the run.
+        """
+        count = len(self.snapshots)
+        states = self.validity_at(
+            parse_prefixes([str(prefix)] * count),
+            _origin_asns(pl.Series([str(origin)] * count)),
+            np.arange(count),
+        )
+        new_run = np.ones(count, dtype=bool)
+        new_run[1:] = states[1:] != states[:-1]
+        run_start = np.flatnonzero(new_run)
+        run_end = np.append(run_start[1:], count) - 1
+        return pd.DataFrame(
+            {
+                "first_seen": self.snapshots[run_start],
+                "last_seen": self.snapshots[run_end],
+                "validity": pd.Categorical.from_codes(
+                    states[run_start], categories=ROV_STATES
+                ),
+            }
+        )
+
+
+def rov_validity_history(
+    announcements: FrameType,
+    history: FrameType | RouteOriginAuthorizationHistory,
+    timestamp: str = "timestamp",
+) -> pd.Series | pl.Series:
+    """
+    Determine the ROA validation outcome of every (prefix, origin, timestamp).
+
+    Like `rov_validity_batch`, but every announcement is validated against the
+    VRPs at its `timestamp` column.
+    """
+    assert set(announcements.columns) >= set(["prefix", "origin", timestamp])
+
+    if not isinstance(history, RouteOriginAuthorizationHistory):
+        history = RouteOriginAuthorizationHistory(history, timestamp=timestamp)
+
+    states = history.validity_at(
+        prefix_bounds(announcements),
+        _announcement_asns(announcements),
+        history.snapshot_index(announcements[timestamp]),
+    )
+    return _validity_series(announcements, states)
+
+
+# The VRPs of a validation worker process, memory mapped from a snapshot
+_WORKER_VRPS: Optional[CompactRouteOriginAuthorizationLookup] = None
+
+
+def _init_worker(snapshot: Path) -> None:
+    global _WORKER_VRPS  # pylint: disable=global-statement
+    _WORKER_VRPS = CompactRouteOriginAuthorizationLookup.load(snapshot)
+
+
+def _validate_chunk(prefix: pl.Series, origin: np.ndarray) -> np.ndarray:
+    assert _WORKER_VRPS is not None
+    return _WORKER_VRPS.validity(parse_prefixes(prefix), origin)
+
+
+class ParallelRovValidator:
+    """
+    Validate frames of announcements with `rov_validity_batch` in worker processes.
+
+    The VRPs are saved as a snapshot (or a snapshot path is passed) that every
+    worker memory maps once, so the index is shared through the page cache instead
+    of being pickled to each worker. Frames are split into chunks of `chunk_size`
+    rows, the results are merged in order.
+
+    `rows`, `seconds` and `rows_per_second` report the throughput of all
+    `validate` calls so far. Use as a context manager, or call `close`, to stop
+    the workers.
+    """
+
+    rows: int
+    seconds: float
+
+    def __init__(
+        self,
+        vrps: FrameType | CompactRouteOriginAuthorizationLookup | str | os.PathLike,
+        workers: Optional[int] = None,
+        chunk_size: int = 100_000,
+    ) -> None:
+        assert chunk_size > 0
+        self.__tmpdir: Optional[tempfile.TemporaryDirectory] = None
+        if isinstance(vrps, (str, os.PathLike)):
+            self.snapshot = Path(vrps)
+        else:
+            if not isinstance(vrps, CompactRouteOriginAuthorizationLookup):
+                vrps = CompactRouteOriginAuthorizationLookup(vrps)
+            self.__tmpdir = tempfile.TemporaryDirectory(prefix="rpki-analysis-")
+            self.snapshot = Path(self.__tmpdir.name) / "vrps.arrays"
+            vrps.save(self.snapshot)
+
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.seconds = 0.0
+        self.__pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            # polars is multi-threaded, forking it can deadlock
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.snapshot,),
+        )
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def validate(self, announcements: FrameType) -> pd.Series | pl.Series:
+        """Like `rov_validity_batch(announcements, vrps)`."""
+        assert set(announcements.columns) >= set(["prefix", "origin"])
+        start = time.perf_counter()
+
+        prefix = announcements["prefix"]
+        if isinstance(prefix, pd.Series):
+            prefix = pl.from_pandas(prefix.astype(str))
+        origin = _announcement_asns(announcements)
+
+        bounds = range(0, len(announcements), self.chunk_size)
+        chunks = list(
+            self.__pool.map(
+                _validate_chunk,
+                (prefix.slice(i, self.chunk_size) for i in bounds),
+                (origin[i : i + self.chunk_size] for i in bounds),
+            )
+        )
+        states = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int8)
+
+        elapsed = time.perf_counter() - start
+        self.rows += len(states)
+        self.seconds += elapsed
+        LOG.info(
+            "Validated %d announcements in %.2fs (%d workers, %.0f rows/s)",
+            len(states),
+            elapsed,
+            self.workers,
+            len(states) / elapsed,
+        )
+        return _validity_series(announcements, states)
+
+    def close(self) -> None:
+        self.__pool.shutdown()
+        if self.__tmpdir is not None:
+            self.__tmpdir.cleanup()
+            self.__tmpdir = None
+
+    def __enter__(self) -> "ParallelRovValidator":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def rov_validity_parallel(
+    announcements: FrameType,
+    vrps: FrameType | CompactRouteOriginAuthorizationLookup | str | os.PathLike,
+    workers: Optional[int] = None,
+    chunk_size: int = 100_000,
+) -> pd.Series | pl.Series:
+    """`rov_validity_batch` in `workers` processes, see `ParallelRovValidator`."""
+    with ParallelRovValidator(vrps, workers=workers, chunk_size=chunk_size) as rov:
+        return rov.validate(announcements)
@@ -6,6 +6,8 @@ from typing import Generator
 import aiohttp
 import pandas as pd
 
+from rpki_analysis.prefixes import with_prefix_bounds
+
 
 async def read_dump_url(url: str) -> pd.DataFrame:
     """Read rpki-client dump format"""
@@ -49,13 +51,19 @@ def read_dump_generator(row: object) -> Generator[object, None, None]:
         yield vrp
 
 
-def read_dump(dump: io.StringIO) -> pd.DataFrame:
-    """Read rpki-client dump format"""
+def read_dump(dump: io.StringIO, prefix_bounds: bool = False) -> pd.DataFrame:
+    """
+    Read rpki-client dump format
+
+    With `prefix_bounds` the integer encoding of the prefix is added as columns
+    (see `rpki_analysis.prefixes.with_prefix_bounds`).
+    """
     lines = dump.read().splitlines()
 
     df = pd.DataFrame(
         itertools.chain.from_iterable(map(read_dump_generator, map(json.loads, lines)))
     )
-    return df.rename(columns={"maxlen": "max_length", "asid": "asn"}).astype(
+    df = df.rename(columns={"maxlen": "max_length", "asid": "asn"}).astype(
         {"asn": int, "max_length": int}
     )
+    return with_prefix_bounds(df) if prefix_bounds else df
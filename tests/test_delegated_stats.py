@@ -5,17 +5,25 @@ import itertools
 import time
 from pathlib import Path
 
+import duckdb
 import netaddr
+import numpy as np
 import pandas as pd
+import polars as pl
 import pytest
 
 from rpki_analysis.delegated_stats import (
+    PytriciaLookup,
     RirLookup,
+    RirTable,
     StatsCombinedAllocations,
     StatsEntryLookup,
+    explode_ip_resources,
     normalized_delegated_extended_stats,
+    process_ip_resources,
     read_delegated_extended_stats,
     read_delegated_stats,
+    resource_ranges,
 )
 
 
@@ -50,6 +58,33 @@ def test_normalized_delegated_extended_stats() -> None:
         )
 
 
+def test_explode_ip_resources() -> None:
+    """The expressions give the resources of process_ip_resources"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        df = read_delegated_stats(io.StringIO(f.read()))
+    rows = [
+        (row.raw_resource, int(row.length), str(row.afi)) for row in df.itertuples()
+    ] + [
+        ("0.0.0.0", 2**32, "ipv4"),
+        ("255.255.255.255", 1, "ipv4"),
+        ("193.0.0.3", 1021, "ipv4"),
+        ("64512", 5, "asn"),
+        ("4200000000", 94967295, "asn"),
+    ]
+    frame = pl.DataFrame(
+        rows,
+        schema={"raw_resource": pl.Utf8, "length": pl.Int64, "afi": pl.Utf8},
+        orient="row",
+    ).with_columns(pl.col("afi").cast(pl.Categorical))
+
+    expected = process_ip_resources(frame.to_struct()).explode()
+    res = explode_ip_resources(frame.lazy()).collect()
+    assert res["resources"].to_list() == expected.to_list()
+    assert res.columns == frame.columns + ["resources"]
+
+
 def test_delegated_stats_parsing() -> None:
     """Basic parsing of delegated stats"""
     with bz2.open(
@@ -77,6 +112,238 @@ def test_delegated_stats_parsing() -> None:
     )
 
 
+def test_resource_ranges() -> None:
+    """Ranges match the parsed resources"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        df = read_delegated_stats(io.StringIO(f.read()))
+
+    ranges = resource_ranges(df)
+    assert len(ranges) == len(df)
+    for idx, row in enumerate(df.itertuples()):
+        if row.afi == "asn":
+            assert ranges.afi[idx] == 0
+            continue
+        assert ranges.afi[idx] == row.resource.version
+        assert (int(ranges.first_hi[idx]) << 64 | int(ranges.first_lo[idx])) == (
+            row.resource.first
+        )
+        assert (int(ranges.last_hi[idx]) << 64 | int(ranges.last_lo[idx])) == (
+            row.resource.last
+        )
+
+
+@pytest.mark.parametrize("lookup_type", [StatsEntryLookup, RirLookup])
+def test_lookup_children_many(lookup_type) -> None:
+    """The children are the most specific covering value and the more specifics"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        df = read_delegated_stats(io.StringIO(f.read()))
+    df["opaque_id"] = df["category"] = ""
+    lookup = lookup_type(df)
+
+    prefixes = ["0.0.0.0/0", "41.0.0.0/8", "196.216.2.0/24", "8.0.0.0/8", "2c0f::/16"]
+    prefixes += [
+        str(ipaddress.ip_network(f"{row.raw_resource}/{length}", strict=False))
+        for row, length in zip(
+            df[df.afi == "ipv4"].sample(40, random_state=1).itertuples(),
+            itertools.cycle([16, 22, 24, 28]),
+        )
+    ]
+    keys = {
+        version: [(key, ipaddress.ip_network(key)) for key in trie]
+        for version, trie in ((4, lookup.trie4), (6, lookup.trie6))
+    }
+    unfrozen = lookup.children_many(prefixes)
+    lookup.freeze()
+    assert lookup.children_many(prefixes) == unfrozen
+    for prefix, children in zip(prefixes, unfrozen):
+        assert children == list(lookup.children(prefix))
+
+        network = ipaddress.ip_network(prefix)
+        trie = lookup.trie6 if network.version == 6 else lookup.trie4
+        covering = trie.get_key(prefix)
+        expected = [
+            trie[key]
+            for key, key_network in keys[network.version]
+            if key_network.subnet_of(network)
+            or (key == covering and key_network != network)
+        ]
+        assert sorted(map(str, children)) == sorted(
+            str(value) for value in expected if value is not None
+        )
+
+    assert lookup.children_many([]) == []
+    assert len(lookup.children_many(["0.0.0.0/0"])[0]) == len(lookup.trie4) - 1
+
+    # the index is rebuilt after the tries are modified
+    lookup = lookup_type(df)
+    before = list(lookup.children("0.0.0.0/0"))
+    lookup.trie4.delete(next(key for key in lookup.trie4 if key != "0.0.0.0/0"))
+    assert len(list(lookup.children("0.0.0.0/0"))) == len(before) - 1
+
+
+def test_lookup_children_nested() -> None:
+    """Nested keys are returned once, in address order, frozen or not"""
+    lookup: PytriciaLookup[str] = PytriciaLookup()
+    for prefix in ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.1.1.128/25"]:
+        lookup.trie4[prefix] = prefix
+    lookup.trie6["2001:db8::/32"] = "2001:db8::/32"
+
+    assert list(lookup.children("10.0.0.0/8")) == [
+        "10.0.0.0/8",
+        "10.1.0.0/16",
+        "10.1.1.0/24",
+        "10.1.1.128/25",
+    ]
+    # only the most specific super-net is included
+    assert list(lookup.children("10.1.1.0/25")) == ["10.1.1.0/24"]
+    assert list(lookup.children("10.1.1.0/24")) == ["10.1.1.0/24", "10.1.1.128/25"]
+
+    lookup.trie4["10.2.0.0/16"] = "10.2.0.0/16"
+    del lookup.trie4["10.1.1.128/25"]
+    prefixes = ["0.0.0.0/0", "10.1.0.0/16", "10.2.3.0/24", "::/0"]
+    expected = [
+        ["10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24", "10.2.0.0/16"],
+        ["10.1.0.0/16", "10.1.1.0/24"],
+        ["10.2.0.0/16"],
+        ["2001:db8::/32"],
+    ]
+    assert lookup.children_many(prefixes) == expected
+    assert lookup.freeze().children_many(prefixes) == expected
+    assert [list(lookup.children(prefix)) for prefix in prefixes] == expected
+
+
+@pytest.mark.parametrize("lookup_type", [StatsEntryLookup, RirLookup])
+def test_lookup_match(lookup_type) -> None:
+    """Batched address lookups match the trie"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        df = read_delegated_stats(io.StringIO(f.read()))
+    df["opaque_id"] = df["category"] = ""
+    lookup = lookup_type(df).freeze()
+    assert lookup.frozen
+    with pytest.raises(ValueError):
+        lookup.trie4["192.0.2.0/24"] = None
+    with pytest.raises(ValueError):
+        lookup.trie6.delete("::/0")
+
+    resources = df[df.afi != "asn"].resource.sample(500, random_state=1)
+    addresses = [str(netaddr.IPAddress(resource.last)) for resource in resources]
+    addresses = [f"{address}/{32 if '.' in address else 128}" for address in addresses]
+    matched = lookup.match(addresses + ["8.8.8.8", "2001:db8::1"])
+
+    assert (matched[-2:] == -1).all()
+    for address, idx, resource in zip(addresses, matched, resources):
+        if lookup_type is RirLookup:
+            assert lookup[address] == df.rir.iloc[idx]
+        else:
+            assert lookup[address].resource == df.resource.iloc[idx] == resource
+
+
+def test_combined_allocations_merge() -> None:
+    """The merged resources of each opaque_id are the union of its resources"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        df = read_delegated_stats(io.StringIO(f.read()))
+    df["opaque_id"] = df.country
+    df["category"] = ""
+    lookup = StatsCombinedAllocations(df)
+
+    ip_resources = df[df.afi != "asn"]
+    for (opaque_id, afi), group in ip_resources.groupby(["opaque_id", "afi"]):
+        resources = sorted(group.resource.astype(str))
+        for cidr in netaddr.IPSet(group.resource).iter_cidrs():
+            entry = lookup[str(cidr)]
+            assert entry.resource == cidr
+            assert entry.opaque_id == opaque_id
+        assert sorted(str(e.resource) for e in entry.entries) == resources
+
+    assert len(list(lookup.children("0.0.0.0/0"))) == sum(
+        len(netaddr.IPSet(group.resource).iter_cidrs())
+        for _, group in ip_resources[ip_resources.afi == "ipv4"].groupby("opaque_id")
+    )
+
+
+def test_rir_table(tmp_path: Path) -> None:
+    """The interval table attributes addresses like the trie"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        text = f.read()
+    df = read_delegated_stats(io.StringIO(text))
+    df["opaque_id"] = df["category"] = ""
+    # more than one RIR, that is the same for duplicate resources
+    df["rir"] = pd.Categorical(
+        np.array(["afrinic", "arin", "ripencc"])[df.raw_resource.str.len() % 3]
+    )
+    lookup = RirLookup(df)
+    # the adjacent delegations of a RIR are merged
+    assert len(lookup.rir_table) < len(lookup.table)
+
+    resources = df[df.afi != "asn"].resource
+    addresses = [str(netaddr.IPAddress(resource.first)) for resource in resources]
+    addresses += [str(netaddr.IPAddress(resource.last)) for resource in resources]
+    addresses += ["8.8.8.8", "2001:db8::1", "0.0.0.0", "ffff::1"]
+    expected = [lookup.get(address) for address in addresses]
+
+    attributed = lookup.attribute(addresses)
+    assert list(attributed.categories) == ["afrinic", "arin", "ripencc"]
+    assert [None if pd.isna(rir) else rir for rir in attributed] == expected
+
+    # from the columns of the file, without the resource column
+    df_bounds = read_delegated_stats(io.StringIO(text), resource_bounds=True)
+    df_bounds["rir"] = df.rir
+    table = RirTable.from_delegated_stats(df_bounds)
+    assert (table.codes(addresses) == lookup.rir_table.codes(addresses)).all()
+
+    table.save(tmp_path / "rir.bin")
+    loaded = RirTable.load(tmp_path / "rir.bin")
+    assert loaded.rirs == table.rirs
+    assert (loaded.codes(addresses) == table.codes(addresses)).all()
+
+
+def test_resource_bounds(tmp_path: Path) -> None:
+    """Binary bounds compare like the resources, also in duckdb"""
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        text = f.read()
+    df = read_delegated_stats(io.StringIO(text))
+    df_bounds = read_delegated_stats(io.StringIO(text), resource_bounds=True)
+    assert "resource" not in df_bounds.columns
+
+    for row, first, last in zip(
+        df.itertuples(), df_bounds.resource_first, df_bounds.resource_last
+    ):
+        if row.afi == "asn":
+            assert first is pd.NA and last is pd.NA
+        else:
+            assert int.from_bytes(first) == row.resource.first
+            assert int.from_bytes(last) == row.resource.last
+
+    df_bounds.to_parquet(tmp_path / "delegated.parquet")
+    df_read = pd.read_parquet(tmp_path / "delegated.parquet")
+    assert df_read.resource_first.equals(df_bounds.resource_first)
+    assert df_read.resource_last.equals(df_bounds.resource_last)
+
+    address = netaddr.IPAddress("196.216.2.1")
+    res = duckdb.execute(
+        f"""SELECT raw_resource FROM '{tmp_path / "delegated.parquet"}'
+        WHERE resource_first <= $address AND resource_last >= $address""",
+        {"address": int(address).to_bytes(16)},
+    ).fetchall()
+    assert [raw_resource for (raw_resource,) in res] == [
+        row.raw_resource
+        for row in df.itertuples()
+        if row.afi == "ipv4" and address in row.resource
+    ]
+
+
 def test_delegated_extended_stats_parsing(
     df_delext_stats: pd.DataFrame, caplog
 ) -> None:  # pylint: disable=redefined-outer-name
@@ -0,0 +1,146 @@
+import gzip
+import ipaddress
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+from rpki_analysis.prefixes import (
+    AFI_IPV4,
+    AFI_IPV6,
+    parse_prefix,
+    parse_prefixes,
+    prefix_bounds,
+    searchsorted,
+    with_prefix_bounds,
+)
+
+
+def as_int(hi: np.uint64, lo: np.uint64) -> int:
+    return (int(hi) << 64) | int(lo)
+
+
+@pytest.mark.parametrize(
+    "prefixes",
+    [
+        [
+            "193.0.0.0/21",
+            "0.0.0.0/0",
+            "193.0.0.1",
+            "::/0",
+            "::1",
+            "2001:db8::/32",
+            "2001:DB8::/33",
+            "2001:67c:2e8:25::c100:b34/128",
+            "::ffff:92.47.144.56/127",
+        ],
+    ],
+)
+def test_parse_prefixes(prefixes) -> None:
+    for values in [prefixes, pd.Series(prefixes), pl.Series(prefixes)]:
+        bounds = parse_prefixes(values)
+        assert len(bounds) == len(prefixes)
+
+        for idx, prefix in enumerate(prefixes):
+            network = ipaddress.ip_network(prefix)
+            assert bounds.afi[idx] == network.version
+            assert bounds.length[idx] == network.prefixlen
+            assert as_int(bounds.first_hi[idx], bounds.first_lo[idx]) == int(
+                network.network_address
+            )
+            assert as_int(bounds.last_hi[idx], bounds.last_lo[idx]) == int(
+                network.broadcast_address
+            )
+            assert parse_prefix(prefix) == (
+                bounds.afi[idx],
+                as_int(bounds.first_hi[idx], bounds.first_lo[idx]),
+                as_int(bounds.last_hi[idx], bounds.last_lo[idx]),
+                bounds.length[idx],
+            )
+
+
+def test_parse_prefixes_ris_dump() -> None:
+    """A full IPv6 RIS dump round trips"""
+    with gzip.open(Path(__file__).parent / "data/riswhoisdump.IPv6.gz", "rt") as f:
+        prefixes = [line.split("\t")[1] for line in f if "\t" in line]
+
+    bounds = parse_prefixes(prefixes)
+    assert (bounds.afi == AFI_IPV6).all()
+    for idx in range(0, len(prefixes), 101):
+        network = ipaddress.ip_network(prefixes[idx])
+        assert bounds.length[idx] == network.prefixlen
+        assert as_int(bounds.first_hi[idx], bounds.first_lo[idx]) == int(
+            network.network_address
+        )
+
+
+def test_parse_prefixes_host_bits() -> None:
+    """Like pytricia, bits beyond the prefix length are ignored"""
+    bounds = parse_prefixes(["193.0.0.1/21"])
+    assert bounds.afi[0] == AFI_IPV4
+    assert bounds.first_lo[0] == int(ipaddress.ip_address("193.0.0.0"))
+    assert bounds.last_lo[0] == int(ipaddress.ip_address("193.0.7.255"))
+
+
+@pytest.mark.parametrize(
+    "prefix",
+    ["193.0.0.0/33", "193.0.0/24", "2001:db8::1::/32", "foo", "::/-1", "193.0.0.0/"],
+)
+def test_parse_prefixes_invalid(prefix) -> None:
+    with pytest.raises(ValueError):
+        parse_prefixes(["193.0.0.0/21", prefix])
+    with pytest.raises(ValueError):
+        parse_prefix(prefix)
+
+
+def test_searchsorted() -> None:
+    """128 bit searchsorted matches Python integers"""
+    rng = np.random.default_rng(1)
+    table = sorted(
+        set(int(x) << 64 | int(y) for x, y in rng.integers(0, 8, size=(100, 2)))
+    )
+    queries = [int(x) << 64 | int(y) for x, y in rng.integers(0, 9, size=(100, 2))]
+
+    def split(values: list[int]) -> tuple[np.ndarray, np.ndarray]:
+        return (
+            np.array([v >> 64 for v in values], dtype=np.uint64),
+            np.array([v & 0xFFFF_FFFF_FFFF_FFFF for v in values], dtype=np.uint64),
+        )
+
+    for side in ["left", "right"]:
+        res = searchsorted(*split(table), *split(queries), side=side)
+        assert (
+            res.tolist()
+            == np.searchsorted(
+                np.array(table, dtype=object),
+                np.array(queries, dtype=object),
+                side=side,
+            ).tolist()
+        )
+
+
+def test_with_prefix_bounds() -> None:
+    """Bounds columns round trip to the parsed bounds"""
+    prefixes = ["193.0.0.0/21", "2001:db8::/32", "::/0"]
+    expected = parse_prefixes(prefixes)
+
+    df = with_prefix_bounds(pd.DataFrame({"resource": prefixes}), "resource")
+    assert df.resource_length.tolist() == [21, 32, 0]
+    df_pl = with_prefix_bounds(pl.DataFrame({"resource": prefixes}), "resource")
+    assert df_pl.columns == list(df.columns)
+
+    for frame in [df, df_pl]:
+        bounds = prefix_bounds(frame, "resource")
+        for field in expected._fields:
+            assert (getattr(bounds, field) == getattr(expected, field)).all()
+
+    # missing prefixes have missing bounds (polars)
+    df_pl = with_prefix_bounds(pl.DataFrame({"prefix": [None, "10.0.0.0/8"]}))
+    assert df_pl["prefix_length"].to_list() == [None, 8]
+    assert df_pl["prefix_last_lo"].to_list() == [None, 0x0AFF_FFFF]
+    for frame in [df_pl, df_pl.to_pandas()]:
+        with pytest.raises(ValueError, match="prefix_afi"):
+            prefix_bounds(frame)
+    assert prefix_bounds(df_pl.drop_nulls()).length.tolist() == [8]
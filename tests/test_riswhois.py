@@ -1,15 +1,33 @@
+import bz2
+import datetime
+import gzip
+import io
+import ipaddress
 from pathlib import Path
 
 import netaddr
+import numpy as np
 import pandas as pd
+import polars as pl
 import pytest
 
+from rpki_analysis.delegated_stats import read_delegated_stats
+from rpki_analysis.origins import encode_origins
 from rpki_analysis.riswhois import (
+    AddressSpace,
     ExpandedRisEntry,
     RisWhoisLookup,
     RisWhoisLookupMoreLessSpecific,
     RisWhoisLookupMoreSpecific,
+    RisWhoisMoreSpecificIndex,
+    convert_ris_dumps,
+    join_delegations,
     read_ris_dump,
+    read_ris_dump_batches,
+    ris_summary_path,
+    scan_ris_parquet,
+    summarize_ris_dump,
+    summarize_ris_dump_batches,
 )
 
 
@@ -29,6 +47,117 @@ def test_riswhois_parsing(input_file) -> None:
         assert "origin" in df.keys()
         assert "prefix" in df.keys()
         assert "prefix_length" in df.keys()
+        assert "prefix_first_lo" not in df.keys()
+
+
+def test_riswhois_origins() -> None:
+    """Origins are encoded as integers, AS sets are flagged"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f)
+
+    assert df.origin_asn.dtype == np.uint32
+    as_sets = df[df.origin_as_set]
+    assert len(as_sets) > 0
+    assert as_sets.origin.str.startswith("{").all()
+    assert (as_sets.origin_asn == 0).all()
+    asns = df[~df.origin_as_set]
+    assert (asns.origin_asn.astype(str) == asns.origin).all()
+
+    asn, as_set = encode_origins(["3333", "{12703}", "{1,2}", "4294967296", 0])
+    assert asn.tolist() == [3333, 0, 0, 0, 0]
+    assert as_set.tolist() == [False, True, True, True, False]
+
+    # the entries of the lookups have them as well
+    entry = ExpandedRisEntry("{12703}", "2001:db8::/32", 10, 32)
+    assert entry.origin_as_set and entry.origin_asn == 0
+    entry = ExpandedRisEntry("3333", "2001:db8::/32", 10, 32)
+    assert not entry.origin_as_set and entry.origin_asn == 3333
+
+    # the index stores AS sets next to the ASNs
+    sample = pd.concat([as_sets.head(50), asns.head(50)])
+    index = RisWhoisMoreSpecificIndex(sample)
+    assert index["::/0"] == set(
+        ExpandedRisEntry(*row)
+        for row in sample[
+            ["origin", "prefix", "seen_by_peers", "prefix_length"]
+        ].itertuples(index=False)
+    )
+    assert sorted(index.lookup_many(["::/0"]).origin) == sorted(sample.origin)
+
+
+def test_riswhois_batches() -> None:
+    """Filters are applied while reading, batches are bounded"""
+    path = Path(__file__).parent / "data/riswhoisdump.IPv6.gz"
+    with path.open("rb") as f:
+        df = read_ris_dump(f)
+    visible = df[df.seen_by_peers >= 10]
+
+    with path.open("rb") as f:
+        batches = list(
+            read_ris_dump_batches(f, visibility_threshold=10, afi=6, batch_size=50_000)
+        )
+    assert len(batches) > 1
+    assert all(len(batch) <= 50_000 for batch in batches)
+    res = pd.concat(batches, ignore_index=True)
+    assert res.equals(visible.reset_index(drop=True))
+
+    with path.open("rb") as f:
+        assert not list(read_ris_dump_batches(f, afi=4))
+
+    # the tries can be built from the batches
+    with path.open("rb") as f:
+        lookup = RisWhoisLookup(
+            read_ris_dump_batches(f, batch_size=20_000), visibility_threshold=420
+        )
+    expected = RisWhoisLookup(df, visibility_threshold=420)
+    for prefix in df[df.seen_by_peers >= 420].prefix.sample(100, random_state=1):
+        assert lookup[prefix] == expected[prefix]
+
+
+def test_riswhois_parsing_prefix_bounds() -> None:
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+
+    assert set(df.prefix_afi) == set([6])
+    sample = df.sample(100, random_state=1)
+    for row in sample.itertuples():
+        network = ipaddress.ip_network(row.prefix)
+        assert row.prefix_length == network.prefixlen
+        assert (int(row.prefix_first_hi) << 64 | int(row.prefix_first_lo)) == int(
+            network.network_address
+        )
+
+
+def test_riswhois_empty_dump(tmp_path) -> None:
+    """A dump without rows gives empty frames with the columns of a dump"""
+    path = tmp_path / "dumps/2024/01/31/riswhoisdump.IPv6.gz"
+    path.parent.mkdir(parents=True)
+    with gzip.open(path, "wt") as f:
+        f.write("% only a comment\n")
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        expected = next(read_ris_dump_batches(f, batch_size=10, prefix_bounds=True))
+
+    df = read_ris_dump(path, prefix_bounds=True)
+    assert not len(df)
+    assert df.dtypes.to_dict() == expected.dtypes.to_dict()
+    assert list(read_ris_dump(path).columns) == [
+        "origin",
+        "prefix",
+        "seen_by_peers",
+        "origin_asn",
+        "origin_as_set",
+        "prefix_length",
+    ]
+
+    assert list(RisWhoisLookup(read_ris_dump_batches(path)).lookup("::/0")) == []
+    assert convert_ris_dumps(tmp_path / "dumps", tmp_path / "parquet", workers=1) == []
+    # it is marked as converted, a second run skips it
+    assert (
+        tmp_path / "parquet/date=2024-01-31/2024_01_31_riswhoisdump.IPv6.parquet.empty"
+    ).exists()
+    with gzip.open(path, "wt") as f:
+        f.write("3333\t2001:db8::/32\t100\n")
+    assert convert_ris_dumps(tmp_path / "dumps", tmp_path / "parquet", workers=1) == []
 
 
 def test_riswhois_lookup(df_v4) -> None:
@@ -53,6 +182,68 @@ def test_riswhois_lookup(df_v4) -> None:
     assert all(r[1] == "0.0.0.0/0" for r in res)
 
 
+def test_riswhois_lookup_covering() -> None:
+    """Lookups match the entries with covering prefixes"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+    # duplicate rows are stored once
+    lookup = RisWhoisLookup(pd.concat([df, df.head(10)]), visibility_threshold=0)
+    assert len(lookup.entries) == len(df)
+
+    networks = [ipaddress.ip_network(prefix) for prefix in df.prefix]
+    first = np.array([int(net.network_address) for net in networks], dtype=object)
+    last = np.array([int(net.broadcast_address) for net in networks], dtype=object)
+    for query in list(df.prefix.sample(20, random_state=1)) + ["2001:db8::1"]:
+        network = ipaddress.ip_network(query)
+        covering = (first <= int(network.network_address)) & (
+            last >= int(network.broadcast_address)
+        )
+        assert lookup[query] == set(
+            ExpandedRisEntry(*row)
+            for row in df.loc[
+                covering, ["origin", "prefix", "seen_by_peers", "prefix_length"]
+            ].itertuples(index=False)
+        )
+
+    # get returns the entries of the longest match
+    prefix = df.prefix.iloc[0]
+    assert lookup.get(prefix) == set(
+        ExpandedRisEntry(*row)
+        for row in df.loc[
+            df.prefix == prefix, ["origin", "prefix", "seen_by_peers", "prefix_length"]
+        ].itertuples(index=False)
+    )
+
+
+def test_riswhois_lookup_addresses() -> None:
+    """Batched address lookups match the longest match of the trie"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+    # frozen lookups build the interval table up front
+    lookup = RisWhoisLookup(df, visibility_threshold=0).freeze()
+    assert lookup.frozen
+
+    rng = np.random.default_rng(1)
+    addresses = ["2001:db8::1", "193.0.0.1"]
+    for prefix in df.prefix.sample(500, random_state=1):
+        network = ipaddress.ip_network(prefix)
+        offset = int(rng.integers(0, min(network.num_addresses, 2**62)))
+        addresses.append(str(network.network_address + offset))
+
+    res = lookup.lookup_addresses(addresses)
+    assert set(res.keys()) >= set(["query", "origin", "prefix", "seen_by_peers"])
+    for idx, address in enumerate(addresses):
+        assert lookup.get(address, set()) == set(
+            ExpandedRisEntry(*row)
+            for row in res.loc[
+                res["query"] == idx,
+                ["origin", "prefix", "seen_by_peers", "prefix_length"],
+            ].itertuples(index=False)
+        )
+    # no IPv4 entries
+    assert lookup.match(["193.0.0.1"]).tolist() == [-1]
+
+
 def test_riswhois_lookup_more_specific(df_v4) -> None:
     lookup = RisWhoisLookupMoreSpecific(df_v4)
 
@@ -95,7 +286,269 @@ def test_riswhois_lookup_more_less_specific(df_v4) -> None:
     assert all(r[1] == "0.0.0.0/0" for r in res)
 
 
+def test_riswhois_more_specific_index() -> None:
+    """Range scans match containment of the networks"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+    networks = [ipaddress.ip_network(prefix) for prefix in df.prefix]
+    first = np.array([int(net.network_address) for net in networks], dtype=object)
+    last = np.array([int(net.broadcast_address) for net in networks], dtype=object)
+    index = RisWhoisMoreSpecificIndex(df)
+    assert len(index) == len(df)
+
+    queries = ["2001:67c::/32", "2001:db8::/32", "2a00::/12", "::/0"] + list(
+        df.prefix.sample(20, random_state=1)
+    )
+    for query in queries:
+        network = ipaddress.ip_network(query)
+        subnets = (first >= int(network.network_address)) & (
+            last <= int(network.broadcast_address)
+        )
+        expected = set(
+            ExpandedRisEntry(*row)
+            for row in df.loc[
+                subnets, ["origin", "prefix", "seen_by_peers", "prefix_length"]
+            ].itertuples(index=False)
+        )
+        assert index[query] == expected
+
+    # batch form
+    res = index.lookup_many(queries)
+    assert set(res.columns) == set(
+        ["query", "origin", "origin_asn", "prefix", "seen_by_peers", "prefix_length"]
+    )
+    for idx, query in enumerate(queries):
+        entries = res[res["query"] == idx].drop(columns=["query", "origin_asn"])
+        assert (
+            set(ExpandedRisEntry(*row) for row in entries.itertuples(index=False))
+            == index[query]
+        )
+
+    # IPv4 queries on an IPv6 dump match nothing
+    assert index["193.0.0.0/8"] == set()
+    assert len(index.lookup_many(["0.0.0.0/0", "193.0.0.0/21"])) == 0
+
+    # more specifics of a prefix that is not announced itself
+    visible = df[df.seen_by_peers >= 420]
+    lookup = RisWhoisLookupMoreSpecific(visible, visibility_threshold=420)
+    expected = RisWhoisMoreSpecificIndex(visible)["2001:600::/23"]
+    assert lookup["2001:600::/23"] == expected
+    assert len(expected) > 0
+
+
 def test_riswhois_lookup_netaddr_types(df_v4) -> None:
     lookup = RisWhoisLookupMoreLessSpecific(df_v4)
 
     assert len(lookup[netaddr.IPNetwork("193.0.0.0/21")]) >= 1
+
+
+def test_join_delegations() -> None:
+    """The join matches overlap of the address ranges"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+    with bz2.open(
+        Path(__file__).parent / "data/delegated-afrinic-20240219.bz2", "rt"
+    ) as f:
+        delegated = read_delegated_stats(io.StringIO(f.read()))
+
+    res = join_delegations(df, delegated)
+    assert list(res.columns) == ["announcement", "delegation", "relation"]
+    assert set(delegated.loc[res.delegation].afi) == set(["ipv6"])
+
+    networks = [ipaddress.ip_network(prefix) for prefix in df.prefix]
+    first = np.array([int(net.network_address) for net in networks], dtype=object)
+    last = np.array([int(net.broadcast_address) for net in networks], dtype=object)
+    sample = delegated[delegated.afi == "ipv6"].sample(20, random_state=1)
+    for label, row in sample.iterrows():
+        resource = row.resource
+        overlaps = (first <= resource.last) & (last >= resource.first)
+        matches = res[res.delegation == label]
+        assert set(matches.announcement) == set(df.index[overlaps])
+
+        for match in matches.itertuples():
+            network = networks[match.announcement]
+            if network == ipaddress.ip_network(str(resource)):
+                assert match.relation == "exact"
+            elif network.subnet_of(ipaddress.ip_network(str(resource))):
+                assert match.relation == "covered"
+            else:
+                assert match.relation == "covering"
+
+    # IPv4 delegations are not always a prefix
+    announcements = pd.DataFrame(
+        {
+            "origin": ["1", "2", "3", "4", "5"],
+            "prefix": [
+                "41.0.0.0/8",
+                "41.0.0.0/16",
+                "41.0.0.0/23",
+                "41.0.2.0/24",
+                "41.1.0.0/16",
+            ],
+            "seen_by_peers": [10] * 5,
+        },
+        index=[10, 11, 12, 13, 14],
+    )
+    delegated = pd.DataFrame(
+        {
+            "afi": ["ipv4", "ipv4", "asn"],
+            "raw_resource": ["41.0.0.0", "41.0.1.0", "3333"],
+            "length": [65536, 768, 1],
+        },
+        index=["a", "b", "c"],
+    )
+    res = join_delegations(announcements, delegated)
+    assert list(res.itertuples(index=False, name=None)) == [
+        (10, "a", "covering"),
+        (11, "a", "exact"),
+        (12, "a", "covered"),
+        (13, "a", "covered"),
+        (10, "b", "covering"),
+        (11, "b", "covering"),
+        (12, "b", "overlapping"),
+        (13, "b", "covered"),
+    ]
+
+
+def ip_ranges(space: AddressSpace) -> list[tuple[int, int]]:
+    return [
+        (int(first_hi) << 64 | int(first_lo), int(last_hi) << 64 | int(last_lo))
+        for afi in sorted(space.ranges)
+        for first_hi, first_lo, last_hi, last_lo in zip(*space.ranges[afi])
+    ]
+
+
+def test_address_space() -> None:
+    """Set operations match netaddr.IPSet"""
+    with (Path(__file__).parent / "data/riswhoisdump.IPv6.gz").open("rb") as f:
+        df = read_ris_dump(f)
+    lhs = list(df.prefix.sample(2_000, random_state=1)) + [
+        "10.0.0.0/25",
+        "10.0.0.128/25",
+        "192.0.2.0/24",
+    ]
+    rhs = list(df.prefix.sample(2_000, random_state=2)) + ["10.0.0.0/8"]
+
+    for space, ipset in [
+        (AddressSpace.from_prefixes(lhs), netaddr.IPSet(lhs)),
+        (AddressSpace.from_prefixes(rhs), netaddr.IPSet(rhs)),
+        (
+            AddressSpace.from_prefixes(lhs) | AddressSpace.from_prefixes(rhs),
+            netaddr.IPSet(lhs) | netaddr.IPSet(rhs),
+        ),
+        (
+            AddressSpace.from_prefixes(lhs) & AddressSpace.from_prefixes(rhs),
+            netaddr.IPSet(lhs) & netaddr.IPSet(rhs),
+        ),
+        (
+            AddressSpace.from_prefixes(lhs) - AddressSpace.from_prefixes(rhs),
+            netaddr.IPSet(lhs) - netaddr.IPSet(rhs),
+        ),
+        (
+            AddressSpace.from_prefixes(rhs) - AddressSpace.from_prefixes(lhs),
+            netaddr.IPSet(rhs) - netaddr.IPSet(lhs),
+        ),
+    ]:
+        assert space.size() == ipset.size
+        assert ip_ranges(space) == [(r.first, r.last) for r in ipset.iter_ipranges()]
+
+    # adjacent prefixes are merged
+    space = AddressSpace.from_prefixes(lhs)
+    assert (int(2**24 * 10), int(2**24 * 10) + 255) in ip_ranges(space)
+    assert space.size(4) == 256 + 256
+
+    # announced fraction per prefix
+    queries = ["10.0.0.0/24", "10.0.0.0/23", "0.0.0.0/0", "2a00::/12", "::/0"] + list(
+        df.prefix.sample(100, random_state=3)
+    )
+    ipset = netaddr.IPSet(lhs)
+    for query, fraction in zip(queries, space.fraction(queries)):
+        expected = (ipset & netaddr.IPSet([query])).size / netaddr.IPNetwork(query).size
+        assert fraction == pytest.approx(expected)
+
+    # the complete address space
+    everything = AddressSpace.from_prefixes(["0.0.0.0/0", "::/0"])
+    assert everything.size() == 2**32 + 2**128
+    assert len(everything - space) == len(space) + 2
+    assert (everything - space) | space == everything
+    assert len(space - everything) == 0
+    assert (space & everything) == space
+
+
+def test_convert_ris_dumps(tmp_path) -> None:
+    """Dumps are converted to partitioned parquet once"""
+    fixture = Path(__file__).parent / "data/riswhoisdump.IPv6.gz"
+    source = tmp_path / "archive"
+    for day in ["2024/01/30", "2024/01/31"]:
+        (source / day).mkdir(parents=True)
+        (source / day / "riswhoisdump.IPv6.gz").symlink_to(fixture)
+    (source / "riswhoisdump.IPv6.gz").symlink_to(fixture)
+
+    destination = tmp_path / "parquet"
+    written = convert_ris_dumps(source, destination, workers=2)
+    assert sorted(path.relative_to(destination).parts[:2] for path in written) == [
+        ("date=2024-01-30", "afi=6"),
+        ("date=2024-01-31", "afi=6"),
+    ]
+    # converted dumps are skipped
+    assert convert_ris_dumps(source, destination, workers=2) == []
+
+    with fixture.open("rb") as f:
+        df = read_ris_dump(f, prefix_bounds=True)
+    res = scan_ris_parquet(destination).filter(
+        pl.col("date") == datetime.date(2024, 1, 31)
+    )
+    assert res.select(pl.len()).collect().item() == len(df)
+    res = res.collect()
+    assert res["origin"].dtype == pl.Categorical
+    assert set(res["afi"]) == set([6])
+    assert res["prefix"].to_list() == df.prefix.tolist()
+    assert res["prefix_first_hi"].to_list() == df.prefix_first_hi.tolist()
+
+
+def test_summarize_ris_dump(tmp_path) -> None:
+    """Summaries match the dump and are stored next to it"""
+    path = tmp_path / "riswhoisdump.IPv6.gz"
+    path.write_bytes((Path(__file__).parent / "data/riswhoisdump.IPv6.gz").read_bytes())
+    summary = summarize_ris_dump(path)
+    assert ris_summary_path(path).exists()
+    assert summarize_ris_dump(path).equals(summary)
+
+    df = read_ris_dump(path)
+    origins = summary.filter(pl.col("statistic") == "origin")
+    assert dict(zip(origins["origin"], origins["prefixes"])) == (
+        df.origin.value_counts().to_dict()
+    )
+    lengths = summary.filter(pl.col("statistic") == "prefix_length")
+    assert dict(zip(lengths["prefix_length"], lengths["seen_by_peers"])) == (
+        df.groupby("prefix_length").seen_by_peers.sum().to_dict()
+    )
+    visibility = summary.filter(pl.col("statistic") == "seen_by_peers")
+    assert (
+        visibility["seen_by_peers"].to_list()
+        == np.quantile(
+            df.seen_by_peers, visibility["quantile"].to_numpy(), method="inverted_cdf"
+        ).tolist()
+    )
+
+    # batches are combined, per afi
+    with path.open("rb") as f:
+        batches = list(read_ris_dump_batches(f, batch_size=50_000))
+    batches.append(
+        pd.DataFrame(
+            {
+                "origin": ["3333", "3333"],
+                "prefix": ["193.0.0.0/21", "193.0.10.0/23"],
+                "seen_by_peers": [300, 100],
+                "prefix_length": [21, 23],
+            }
+        )
+    )
+    res = summarize_ris_dump_batches(batches)
+    assert res.filter(pl.col("afi") == 6).equals(summary)
+    assert (
+        res.filter((pl.col("afi") == 4) & (pl.col("statistic") == "seen_by_peers"))[
+            "seen_by_peers"
+        ].to_list()
+        == [100] * 5 + [300] * 4
+    )
@@ -1,15 +1,33 @@
 import dataclasses
+import ipaddress
 import lzma
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
+import polars as pl
 import pytest
 
+from rpki_analysis.datastructures import SwappableLookup
+from rpki_analysis.origins import encode_origins
+from rpki_analysis.prefixes import with_prefix_bounds
 from rpki_analysis.routinator import read_csv, read_csvext
 from rpki_analysis.rov import (
+    CachedRovValidator,
+    CompactRouteOriginAuthorizationLookup,
+    ParallelRovValidator,
     RouteOriginAuthorization,
+    RouteOriginAuthorizationHistory,
     RouteOriginAuthorizationLookup,
+    affected_by_diff,
+    rov_revalidate,
     rov_validity,
+    rov_validity_batch,
+    rov_validity_explain,
+    rov_validity_history,
+    rov_validity_parallel,
+    vrp_diff,
 )
 from rpki_analysis.rpki_client import read_dump
 
@@ -100,3 +118,409 @@ def test_roa_validity(df_csvext: pd.DataFrame):  # pylint: disable=redefined-out
     assert rov_validity(AnnouncementStub("100.20.0.0/24", 16509), lookup) == "valid"
     # But > is not
     assert rov_validity(AnnouncementStub("100.20.0.0/25", 16509), lookup) == "invalid"
+
+
+@pytest.fixture(scope="module")
+def df_rpki_client_dump() -> pd.DataFrame:
+    """Fixture to get rpki-client dump output (contains both IPv4 and IPv6)."""
+    with lzma.open(Path(__file__).parent / "data/rpki_client_dump.json.xz", "rt") as f:
+        return read_dump(f)
+
+
+@pytest.fixture(scope="module")
+def df_announcements(df_rpki_client_dump: pd.DataFrame) -> pd.DataFrame:
+    """Announcements around the VRPs: exact, at max length, too specific and less specific."""
+    rows = []
+    for vrp in df_rpki_client_dump.sample(1000, random_state=1).itertuples():
+        network = ipaddress.ip_network(vrp.prefix)
+        for length in set(
+            [
+                network.prefixlen,
+                vrp.max_length,
+                min(vrp.max_length + 1, network.max_prefixlen),
+                max(network.prefixlen - 1, 0),
+            ]
+        ):
+            if length >= network.prefixlen:
+                prefix = next(network.subnets(new_prefix=length))
+            else:
+                prefix = network.supernet(new_prefix=length)
+            for origin in [str(vrp.asn), str(vrp.asn + 1), f"{{{vrp.asn}}}"]:
+                rows.append((str(prefix), origin))
+    return pd.DataFrame(rows, columns=["prefix", "origin"])
+
+
+def test_rov_validity_batch(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """The batch validation gives the same result as rov_validity"""
+    lookup = RouteOriginAuthorizationLookup(df_rpki_client_dump)
+    expected = [rov_validity(row, lookup) for row in df_announcements.itertuples()]
+    assert set(expected) == set(["valid", "invalid", "unknown"])
+
+    res = rov_validity_batch(df_announcements, df_rpki_client_dump)
+    assert list(res) == expected
+    assert (res.index == df_announcements.index).all()
+
+    # polars frames give a polars series
+    res_pl = rov_validity_batch(
+        pl.from_pandas(df_announcements), pl.from_pandas(df_rpki_client_dump)
+    )
+    assert res_pl.to_list() == expected
+
+    # frames with prefix bounds columns are not parsed again
+    with lzma.open(Path(__file__).parent / "data/rpki_client_dump.json.xz", "rt") as f:
+        df_vrps = read_dump(f, prefix_bounds=True)
+    assert "prefix_first_lo" in df_vrps.columns
+    res = rov_validity_batch(with_prefix_bounds(df_announcements), df_vrps)
+    assert list(res) == expected
+
+    # a prebuilt compact lookup can be re-used
+    compact = CompactRouteOriginAuthorizationLookup(df_rpki_client_dump)
+    assert list(rov_validity_batch(df_announcements, compact)) == expected
+
+    # integer encoded origins, as read by read_ris_dump
+    asn, as_set = encode_origins(df_announcements.origin)
+    encoded = df_announcements.assign(origin_asn=asn, origin_as_set=as_set)
+    assert list(rov_validity_batch(encoded, compact)) == expected
+    assert [rov_validity(row, lookup) for row in encoded.itertuples()] == expected
+    # categorical origins are not validated by their codes
+    categorical = pl.from_pandas(df_announcements).with_columns(
+        pl.col("origin").cast(pl.Categorical)
+    )
+    assert rov_validity_batch(categorical, compact).to_list() == expected
+
+
+def test_compact_roa_lookup(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """The compact lookup has the same API and results as the trie based lookup"""
+    lookup = RouteOriginAuthorizationLookup(df_rpki_client_dump)
+    compact = CompactRouteOriginAuthorizationLookup(df_rpki_client_dump)
+    # duplicate VRPs are stored once
+    assert len(compact) == len(
+        df_rpki_client_dump[["asn", "prefix", "max_length"]].drop_duplicates()
+    )
+
+    for prefix in list(df_announcements.prefix.unique()) + ["::/0", "0.0.0.0/0"]:
+        assert compact[prefix] == lookup[prefix]
+        assert (prefix in compact) == (prefix in lookup)
+        # most specific first
+        assert [vrp.prefix for vrp in compact.lookup(prefix)] == sorted(
+            [vrp.prefix for vrp in lookup.lookup(prefix)],
+            key=lambda p: -ipaddress.ip_network(p).prefixlen,
+        )
+
+    # a VRP, its more specifics and IP addresses in it
+    vrp = RouteOriginAuthorization(asn=8888, prefix="146.19.0.0/24", max_length=24)
+    assert vrp in compact["146.19.0.0/24"]
+    assert vrp in compact[ipaddress.ip_network("146.19.0.0/25")]
+    assert vrp in compact["146.19.0.1"]
+    assert vrp not in compact["146.19.0.0/23"]
+
+
+def test_compact_roa_lookup_snapshot(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame, tmp_path: Path
+):  # pylint: disable=redefined-outer-name
+    """A saved lookup is memory mapped read-only and gives the same results"""
+    compact = CompactRouteOriginAuthorizationLookup(df_rpki_client_dump)
+    compact.save(tmp_path / "vrps.bin")
+
+    loaded = CompactRouteOriginAuthorizationLookup.load(tmp_path / "vrps.bin")
+    assert len(loaded) == len(compact)
+    assert not loaded.key.flags.writeable
+
+    for prefix in df_announcements.prefix.unique():
+        assert loaded[prefix] == compact[prefix]
+    assert list(rov_validity_batch(df_announcements, loaded)) == list(
+        rov_validity_batch(df_announcements, compact)
+    )
+
+    # not a snapshot
+    with pytest.raises(ValueError):
+        CompactRouteOriginAuthorizationLookup.load(
+            Path(__file__).parent / "data/rsyncd-minimal.log"
+        )
+
+
+def test_rov_validity_parallel(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame, tmp_path: Path
+):  # pylint: disable=redefined-outer-name
+    """Validating chunks in worker processes gives the results in order"""
+    expected = rov_validity_batch(df_announcements, df_rpki_client_dump)
+
+    with ParallelRovValidator(
+        df_rpki_client_dump, workers=2, chunk_size=997
+    ) as validator:
+        res = validator.validate(df_announcements)
+        assert res.index.equals(df_announcements.index)
+        assert list(res) == list(expected)
+
+        res = validator.validate(pl.from_pandas(df_announcements.astype(str)))
+        assert res.to_list() == list(expected)
+
+        assert len(validator.validate(df_announcements.head(0))) == 0
+        assert validator.rows == 2 * len(df_announcements)
+        assert validator.rows_per_second > 0
+
+    # workers can map an existing snapshot
+    CompactRouteOriginAuthorizationLookup(df_rpki_client_dump).save(
+        tmp_path / "vrps.bin"
+    )
+    res = rov_validity_parallel(df_announcements, tmp_path / "vrps.bin", workers=2)
+    assert list(res) == list(expected)
+    res = rov_validity_parallel(df_announcements, str(tmp_path / "vrps.bin"), workers=2)
+    assert list(res) == list(expected)
+
+
+def test_rov_validity_history(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame, tmp_path: Path
+):  # pylint: disable=redefined-outer-name
+    """Validation at a timestamp matches validation against that snapshot"""
+    df_vrps = df_rpki_client_dump.drop_duplicates(["asn", "prefix", "max_length"])
+    dropped = df_vrps.sample(frac=0.5, random_state=2)
+    snapshots = {
+        pd.Timestamp("2025-01-01", tz="UTC"): df_vrps,
+        pd.Timestamp("2025-01-02", tz="UTC"): df_vrps.drop(dropped.index),
+        pd.Timestamp("2025-01-03", tz="UTC"): df_vrps,
+    }
+    df_history = pd.concat(
+        [df.assign(timestamp=ts) for ts, df in snapshots.items()], ignore_index=True
+    )
+    history = RouteOriginAuthorizationHistory(df_history)
+    assert len(history) == len(df_vrps)
+    # VRPs that were dropped for a snapshot have two intervals
+    assert len(history.intervals()) == len(df_vrps) + len(dropped)
+
+    per_snapshot = []
+    for ts, df in snapshots.items():
+        expected = rov_validity_batch(df_announcements, df)
+        per_snapshot.append(expected)
+        # in between snapshots the previous snapshot is current
+        for at in [ts, ts + pd.Timedelta(hours=12)]:
+            res = rov_validity_history(df_announcements.assign(timestamp=at), history)
+            assert list(res) == list(expected)
+    before = rov_validity_history(
+        df_announcements.assign(timestamp=pd.Timestamp("2024-12-31", tz="UTC")),
+        history,
+    )
+    assert (before == "unknown").all()
+
+    # timeline of announcements that changed state
+    changed = (per_snapshot[0] != per_snapshot[1]).to_numpy().nonzero()[0]
+    assert len(changed)
+    for row in df_announcements.iloc[changed[:20]].itertuples():
+        timeline = history.timeline(row.prefix, row.origin)
+        assert len(timeline) == 3
+        assert list(timeline.validity) == [
+            per_snapshot[0][row.Index],
+            per_snapshot[1][row.Index],
+            per_snapshot[0][row.Index],
+        ]
+        assert history.rov_validity(
+            row.prefix, row.origin, pd.Timestamp("2025-01-02 12:00", tz="UTC")
+        ) == (per_snapshot[1][row.Index])
+
+    # polars frames and saved histories
+    history.save(tmp_path / "history.bin")
+    loaded = RouteOriginAuthorizationHistory.load(tmp_path / "history.bin")
+    announcements = pl.from_pandas(df_announcements).with_columns(
+        timestamp=pl.datetime(2025, 1, 2, 1, time_zone="UTC")
+    )
+    assert rov_validity_history(announcements, loaded).to_list() == list(
+        per_snapshot[1]
+    )
+    assert rov_validity_history(
+        announcements, pl.from_pandas(df_history)
+    ).to_list() == list(per_snapshot[1])
+
+
+def test_vrp_diff(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """Applying a diff only re-validates, and reports, announcements that change"""
+    df_before = df_rpki_client_dump.drop_duplicates(["asn", "prefix", "max_length"])
+    changed_asn = df_before.sample(200, random_state=3)
+    df_after = pd.concat(
+        [
+            df_before.drop(df_before.sample(500, random_state=4).index).drop(
+                changed_asn.index, errors="ignore"
+            ),
+            changed_asn.assign(asn=changed_asn.asn + 1),
+        ]
+    )
+
+    added, removed = vrp_diff(df_before, df_after)
+    assert len(added) == 200
+    assert len(removed) == len(df_before) - len(df_after) + 200
+    # polars frames give the same diff
+    added_pl, removed_pl = vrp_diff(pl.from_pandas(df_before), pl.from_pandas(df_after))
+    assert len(added_pl) == len(added) and len(removed_pl) == len(removed)
+
+    expected_before = rov_validity_batch(df_announcements, df_before)
+    expected_after = rov_validity_batch(df_announcements, df_after)
+    affected = affected_by_diff(df_announcements, added, removed)
+    assert affected.sum() < len(df_announcements)
+    assert (expected_before == expected_after)[~affected].all()
+
+    lookup = RouteOriginAuthorizationLookup(df_before)
+    changed = rov_revalidate(df_announcements, expected_before, lookup, added, removed)
+    assert len(changed)
+    assert list(changed.index) == list(
+        df_announcements.index[(expected_before != expected_after).to_numpy()]
+    )
+    assert list(changed.validity_after) == list(expected_after[changed.index])
+
+    # the updated lookup matches a lookup of the new snapshot
+    fresh = RouteOriginAuthorizationLookup(df_after)
+    # as does one updated with the diff of polars snapshots
+    lookup_pl = RouteOriginAuthorizationLookup(df_before)
+    lookup_pl.apply_diff(added_pl, removed_pl)
+    for prefix in df_announcements.prefix.unique():
+        assert lookup[prefix] == fresh[prefix] == lookup_pl[prefix]
+        assert (prefix in lookup) == (prefix in fresh) == (prefix in lookup_pl)
+
+    # an empty diff changes nothing
+    assert not len(
+        rov_revalidate(
+            df_announcements, expected_after, lookup, *vrp_diff(df_after, df_after)
+        )
+    )
+
+
+def test_swappable_lookup(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """Readers use a frozen lookup while a copy is updated and swapped in"""
+    df_before = df_rpki_client_dump.drop_duplicates(["asn", "prefix", "max_length"])
+    df_after = df_before.drop(df_before.sample(500, random_state=4).index)
+    added, removed = vrp_diff(df_before, df_after)
+    prefixes = df_announcements.prefix.unique()[:1000]
+    expected = [
+        [lookup[prefix] for prefix in prefixes]
+        for lookup in [
+            RouteOriginAuthorizationLookup(df_before),
+            RouteOriginAuthorizationLookup(df_after),
+        ]
+    ]
+
+    lookups = SwappableLookup(RouteOriginAuthorizationLookup(df_before))
+    before = lookups.current
+    assert before.frozen
+    with pytest.raises(ValueError):
+        before.apply_diff(added, removed)
+    with pytest.raises(ValueError):
+        before.trie4["192.0.2.0/24"] = frozenset()
+
+    reloaded = threading.Event()
+
+    def read() -> int:
+        reads = 0
+        while not reloaded.is_set() or not reads:
+            lookup = lookups.current
+            assert [lookup[prefix] for prefix in prefixes] in expected
+            reads += 1
+        return reads
+
+    def build() -> RouteOriginAuthorizationLookup:
+        lookup = lookups.current.copy()
+        lookup.apply_diff(added, removed)
+        return lookup
+
+    with ThreadPoolExecutor(3) as pool:
+        readers = [pool.submit(read) for _ in range(3)]
+        after = lookups.reload(build)
+        reloaded.set()
+        assert all(reader.result() for reader in readers)
+
+    assert lookups.current is after and after.frozen
+    assert [before[prefix] for prefix in prefixes] == expected[0]
+    assert [after[prefix] for prefix in prefixes] == expected[1]
+
+
+def test_rov_validity_explain(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """The reasons match the VRPs from the trie based lookup"""
+    lookup = RouteOriginAuthorizationLookup(df_rpki_client_dump)
+    res = rov_validity_explain(df_announcements, df_rpki_client_dump)
+    assert res.index.equals(df_announcements.index)
+    assert list(res.validity) == list(
+        rov_validity_batch(df_announcements, df_rpki_client_dump)
+    )
+    assert set(res.reason.dropna()) == set(["as-mismatch", "length-exceeded"])
+
+    for row, explained in zip(df_announcements.itertuples(), res.itertuples()):
+        vrps = lookup[row.prefix]
+        assert explained.covering_vrps == len(vrps)
+        same_asn = [vrp for vrp in vrps if str(vrp.asn) == row.origin]
+        if explained.validity == "invalid":
+            assert explained.reason == (
+                "length-exceeded" if same_asn else "as-mismatch"
+            )
+        else:
+            assert pd.isna(explained.reason)
+        if same_asn:
+            assert (explained.matched_vrp, explained.matched_max_length) in [
+                (vrp.prefix, vrp.max_length) for vrp in same_asn
+            ]
+        else:
+            assert pd.isna(explained.matched_vrp)
+            assert pd.isna(explained.matched_max_length)
+
+    res_pl = rov_validity_explain(
+        pl.from_pandas(df_announcements), pl.from_pandas(df_rpki_client_dump)
+    )
+    assert res_pl["validity"].to_list() == list(res.validity)
+    assert res_pl["reason"].to_list() == [None if pd.isna(r) else r for r in res.reason]
+    assert res_pl["matched_vrp"].to_list() == [
+        None if pd.isna(p) else p for p in res.matched_vrp
+    ]
+    assert res_pl["matched_max_length"].null_count() == res.matched_vrp.isna().sum()
+
+    # without VRPs everything is unknown, like rov_validity_batch
+    res = rov_validity_explain(df_announcements, df_rpki_client_dump.head(0))
+    assert (res.validity == "unknown").all()
+    assert res.matched_vrp.isna().all() and res.matched_max_length.isna().all()
+    assert (res.covering_vrps == 0).all()
+
+
+def test_cached_rov_validator(
+    df_rpki_client_dump: pd.DataFrame, df_announcements: pd.DataFrame
+):  # pylint: disable=redefined-outer-name
+    """Repeated pairs are served from the cache, a new snapshot evicts some"""
+    expected = rov_validity_batch(df_announcements, df_rpki_client_dump)
+    pairs = len(df_announcements.drop_duplicates())
+
+    validator = CachedRovValidator(df_rpki_client_dump)
+    res = validator.validate(df_announcements)
+    assert list(res) == list(expected)
+    assert res.index.equals(df_announcements.index)
+    assert (validator.hits, validator.misses) == (0, pairs)
+    assert len(validator) == pairs
+
+    # a shuffled copy, as polars frame, is served from the cache
+    shuffled = df_announcements.sample(frac=1, random_state=5)
+    res = validator.validate(pl.from_pandas(shuffled))
+    assert res.to_list() == list(expected[shuffled.index])
+    assert (validator.hits, validator.misses) == (pairs, pairs)
+
+    # the same snapshot does not evict anything
+    assert validator.update(df_rpki_client_dump.copy()) == 0
+    assert validator.update(df_rpki_client_dump.sample(frac=1, random_state=7)) == 0
+
+    df_after = df_rpki_client_dump.drop(
+        df_rpki_client_dump.sample(500, random_state=6).index
+    )
+    evicted = validator.update(df_after, snapshot="after")
+    assert validator.snapshot == "after"
+    assert 0 < evicted < pairs
+    assert len(validator) == pairs - evicted
+    res = validator.validate(df_announcements)
+    assert list(res) == list(rov_validity_batch(df_announcements, df_after))
+    assert validator.misses == pairs + evicted
+
+    # bounded
+    small = CachedRovValidator(df_rpki_client_dump, maxsize=100)
+    assert list(small.validate(df_announcements)) == list(expected)
+    assert len(small) == 100